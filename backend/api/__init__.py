@@ -1,2 +1,2 @@
-# API package for Change Detection System
-
+# API package for Change Detection System
+
@@ -1,81 +1,202 @@
-
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from pydantic import BaseModel
-from worker import perform_change_detection_task
-from typing import Optional
-import os
-
-router = APIRouter()
-
-class DetectionRequest(BaseModel):
-    aoi_id: str
-    before_date: str
-    after_date: str
-    # Optional direct paths for local testing
-    before_image_path: Optional[str] = None
-    after_image_path: Optional[str] = None
-
-@router.post("/run")
-async def run_detection(request: DetectionRequest, background_tasks: BackgroundTasks):
-    """
-    Trigger a change detection job.
-    """
-    # For prototype, we expect local paths or we default to dummy ones
-    # In production, we would use 'sentinelsat' to download images based on dates + aoi_id geometry
-    
-    img_before = request.before_image_path or "data/samples/before.tif"
-    img_after = request.after_image_path or "data/samples/after.tif"
-
-    # SIMULATION MODE for Demo
-    # If files don't exist, we immediately return a simulated SUCCESS response
-    # This allows the presentation to flow smoothly without needing 500MB+ satellite files.
-    if not os.path.exists(img_before) or not os.path.exists(img_after):
-         import asyncio
-         
-         # Synthesize a realistic result
-         mock_result = {
-             "status": "success",
-             "change_percentage": 24.5,
-             "ndvi_before_mean": 0.72,
-             "ndvi_after_mean": 0.45,
-             "email_sent": True,
-             "email_recipient": "admin@isro.gov.in",
-             "message": "Files not found on disk, used Simulation Mode for Demo."
-         }
-         
-         # Create a fake task ID
-         import uuid
-         task_id = str(uuid.uuid4())
-         
-         # We can't really "queue" it if we want immediate feedback for the demo without a worker
-         # But to keep API consistent, we return queued, and the status endpoint will need to handle it.
-         # Actually, let's just return the result immediately for the simpler demo flow if requested.
-         
-         return {
-            "status": "completed", # Immediate completion for demo
-            "task_id": task_id,
-            "message": "Simulation: Change detected. Email sent.",
-            "result": mock_result
-         }
-
-    # Enqueue task to Celery (Real Mode)
-    task = perform_change_detection_task.delay(img_before, img_after, request.aoi_id)
-    
-    return {
-        "status": "queued",
-        "task_id": task.id,
-        "message": "Change detection job started successfully."
-    }
-
-@router.get("/status/{task_id}")
-async def get_status(task_id: str):
-    """
-    Check status of a detection task.
-    """
-    from celery.result import AsyncResult
-    task_result = AsyncResult(task_id)
-    return {
-        "task_id": task_id,
-        "status": task_result.status,
-        "result": task_result.result if task_result.ready() else None
-    }
+
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from loguru import logger
+from pydantic import BaseModel
+from worker import (
+    detection_fingerprint, detection_route, get_job_registry, get_result_store,
+    perform_batch_change_detection_task, perform_change_detection_task, perform_scatter_change_detection_task
+)
+from typing import List, Literal, Optional
+import os
+import uuid
+
+router = APIRouter()
+
+class DetectionRequest(BaseModel):
+    aoi_id: str
+    before_date: str
+    after_date: str
+    # Optional direct paths for local testing
+    before_image_path: Optional[str] = None
+    after_image_path: Optional[str] = None
+    # Split the scene into tile-row tasks spread over all workers
+    scatter: bool = False
+    # Scheduled runs are delivered after user-triggered ones on the same queue
+    trigger: Literal["user", "scheduled"] = "user"
+
+class BatchDetectionRequest(BaseModel):
+    aoi_ids: List[str]
+    before_image_path: str
+    after_image_path: str
+    trigger: Literal["user", "scheduled"] = "user"
+
+@router.post("/run")
+async def run_detection(request: DetectionRequest, background_tasks: BackgroundTasks):
+    """
+    Trigger a change detection job.
+    """
+    # For prototype, we expect local paths or we default to dummy ones
+    # In production, we would use 'sentinelsat' to download images based on dates + aoi_id geometry
+    
+    img_before = request.before_image_path or "data/samples/before.tif"
+    img_after = request.after_image_path or "data/samples/after.tif"
+
+    # SIMULATION MODE for Demo
+    # If files don't exist, we immediately return a simulated SUCCESS response
+    # This allows the presentation to flow smoothly without needing 500MB+ satellite files.
+    if not os.path.exists(img_before) or not os.path.exists(img_after):
+         # Synthesize a realistic result
+         mock_result = {
+             "status": "success",
+             "change_percentage": 24.5,
+             "ndvi_before_mean": 0.72,
+             "ndvi_after_mean": 0.45,
+             "email_sent": True,
+             "email_recipient": "admin@isro.gov.in",
+             "message": "Files not found on disk, used Simulation Mode for Demo."
+         }
+         
+         # Create a fake task ID
+         task_id = str(uuid.uuid4())
+         
+         # We can't really "queue" it if we want immediate feedback for the demo without a worker
+         # But to keep API consistent, we return queued, and the status endpoint will need to handle it.
+         # Actually, let's just return the result immediately for the simpler demo flow if requested.
+         
+         return {
+            "status": "completed", # Immediate completion for demo
+            "task_id": task_id,
+            "message": "Simulation: Change detected. Email sent.",
+            "result": mock_result
+         }
+
+    # Identical jobs (same scene content, AOI geometry, settings and engine
+    # version) reuse a finished result or attach to the task still running
+    task_id = str(uuid.uuid4())
+    fingerprint = None
+    try:
+        fingerprint = await run_in_threadpool(detection_fingerprint, img_before, img_after, request.aoi_id)
+        reused = await run_in_threadpool(reuse_detection_job, fingerprint, task_id)
+        if reused is not None:
+            return reused
+    except Exception as e:
+        logger.warning(f"Could not check for an identical job, running a new one: {e}")
+
+    # Enqueue task to Celery (Real Mode), on the queue for its estimated size
+    route = await route_detection_job(img_after, [request.aoi_id], request.trigger)
+    detection_task = perform_scatter_change_detection_task if request.scatter else perform_change_detection_task
+    try:
+        task = detection_task.apply_async(
+            args=(img_before, img_after, request.aoi_id), kwargs={"fingerprint": fingerprint}, task_id=task_id,
+            **route
+        )
+    except Exception:
+        # Identical requests would otherwise attach to a task that never existed
+        if fingerprint is not None:
+            try:
+                await run_in_threadpool(get_job_registry().release, fingerprint, task_id)
+            except Exception as e:
+                logger.warning(f"Could not release the claim on job {fingerprint}: {e}")
+        raise
+    
+    return {
+        "status": "queued",
+        "task_id": task.id,
+        "queue": route.get("queue"),
+        "message": "Change detection job started successfully."
+    }
+
+async def route_detection_job(after_image_path: str, aoi_ids: List[str], trigger: str,
+                              batch: bool = False) -> dict:
+    """
+    ``apply_async`` queue and priority options for a detection job. If the
+    route cannot be computed the task's default queue (task_routes) is used.
+    """
+    try:
+        route = await run_in_threadpool(detection_route, after_image_path, aoi_ids, trigger, batch)
+    except Exception as e:
+        logger.warning(f"Could not route the detection job by size, using the default queue: {e}")
+        return {}
+    logger.info(f"Routing detection job ({route['estimated_pixels']} pixels, {trigger}) to {route['queue']}")
+    return {"queue": route["queue"], "priority": route["priority"]}
+
+def reuse_detection_job(fingerprint: str, task_id: str) -> Optional[dict]:
+    """
+    Claim ``fingerprint`` for the new task ``task_id``. Returns the response
+    for an identical job that succeeded or is still running, or None if the
+    new task should be enqueued (also when the identical job failed or has
+    not finished within the registry's ``stale_after``).
+    """
+    from celery.result import AsyncResult
+    registry = get_job_registry()
+    for _ in range(2):
+        existing = registry.claim(fingerprint, task_id)
+        if existing is None:
+            return None
+
+        previous = AsyncResult(existing)
+        if not previous.ready():
+            if not registry.is_stale(fingerprint):
+                return {
+                    "status": "queued",
+                    "task_id": existing,
+                    "reused": True,
+                    "message": "An identical change detection job is already running."
+                }
+            # Lost tasks (message or worker gone) stay PENDING or STARTED
+            # until their result expires; run the job again instead
+            logger.warning(f"Identical job {existing} unfinished {registry.stale_after}s after its claim, "
+                           f"running a new one")
+        else:
+            result = previous.result
+            if previous.successful() and isinstance(result, dict) and result.get("status") == "success":
+                return {
+                    "status": "completed",
+                    "task_id": existing,
+                    "reused": True,
+                    "message": "Identical change detection job already completed.",
+                    "result": result
+                }
+        registry.release(fingerprint, existing)
+    return None
+
+@router.post("/run/batch")
+async def run_batch_detection(request: BatchDetectionRequest):
+    """
+    Trigger one change detection job for many AOIs sharing a scene pair.
+    """
+    if not request.aoi_ids:
+        raise HTTPException(status_code=400, detail="At least one AOI id is required")
+    if not os.path.exists(request.before_image_path) or not os.path.exists(request.after_image_path):
+        raise HTTPException(status_code=404, detail="Before or after image not found")
+
+    route = await route_detection_job(request.after_image_path, request.aoi_ids, request.trigger, batch=True)
+    task = perform_batch_change_detection_task.apply_async(
+        args=(request.before_image_path, request.after_image_path, request.aoi_ids), **route
+    )
+
+    return {
+        "status": "queued",
+        "task_id": task.id,
+        "queue": route.get("queue"),
+        "message": f"Batch change detection started for {len(request.aoi_ids)} AOIs."
+    }
+
+@router.get("/status/{task_id}")
+async def get_status(task_id: str, full: bool = False):
+    """
+    Check status of a detection task.
+    Large results only carry a summary and a result_ref; pass full=true to
+    load the complete result from the result store.
+    """
+    from celery.result import AsyncResult
+    task_result = AsyncResult(task_id)
+    result = task_result.result if task_result.ready() else None
+    if full and isinstance(result, dict) and "result_ref" in result:
+        result = get_result_store().resolve(result)
+    return {
+        "task_id": task_id,
+        "status": task_result.status,
+        "result": result
+    }
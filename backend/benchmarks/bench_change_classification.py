@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cost of change-type classification relative to change detection
+
+Runs ChangeDetector.detect_changes (which classifies the significant
+changes) on a synthetic image pair and times the classification step on
+its own. Run from the backend directory:
+
+    python benchmarks/bench_change_classification.py --size 4096 --workers 4
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.change_detection import ChangeDetector  # noqa: E402
+
+# Detection time must grow by less than this fraction
+OVERHEAD_BUDGET = 0.10
+
+
+def make_pair(size: int):
+    """Synthetic red/green/NIR reflectance pair with vegetation loss, gain and water patches"""
+    rng = np.random.default_rng(0)
+    before = np.empty((3, size, size), dtype=np.float32)
+    for band, (low, high) in enumerate([(0.05, 0.15), (0.05, 0.15), (0.3, 0.5)]):
+        noise = ndimage.gaussian_filter(rng.random((size, size), dtype=np.float32), 3)
+        before[band] = low + (high - low) * noise
+    after = before + rng.normal(0, 0.005, before.shape).astype(np.float32)
+
+    quarter = size // 4
+    after[2, :quarter, :quarter] = 0.12                 # vegetation loss
+    after[0, quarter:2 * quarter, :quarter] *= 0.3      # vegetation gain
+    after[2, 2 * quarter:3 * quarter, :quarter] = 0.02  # water
+    after[:, 3 * quarter:, :quarter] += 0.3             # bright bare ground
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=4096, help="Image edge length in pixels")
+    parser.add_argument("--workers", type=int, default=4, help="Threads")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is kept)")
+    args = parser.parse_args()
+
+    before, after = make_pair(args.size)
+    no_clouds = np.zeros(before.shape[1:], dtype=bool)
+    config = {"detection": {"processing": {"max_workers": args.workers, "memory_budget_mb": 0}}}
+    detector = ChangeDetector(config)
+    print(f"Image pair {args.size}x{args.size}, {args.workers} workers")
+
+    detect_times, classify_times = [], []
+    classify = detector._classify_changes
+    with tempfile.TemporaryDirectory() as output_dir:
+        def timed_classify(*call_args, **kwargs):
+            start = time.perf_counter()
+            result = classify(*call_args, **kwargs)
+            classify_times.append(time.perf_counter() - start)
+            return result
+
+        detector._classify_changes = timed_classify
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = detector.detect_changes(before, after, no_clouds, no_clouds, output_dir=output_dir)
+            detect_times.append(time.perf_counter() - start)
+
+    detect_time, classify_time = min(detect_times), min(classify_times)
+    overhead = classify_time / (detect_time - classify_time)
+    print(f"{'step':<16} {'wall s':>8}")
+    print(f"{'detect_changes':<16} {detect_time:>8.3f}")
+    print(f"{'classification':<16} {classify_time:>8.3f}")
+    print(f"change types: {result['change_types']}")
+    print(f"classification overhead {overhead:.1%} (budget {OVERHEAD_BUDGET:.0%})")
+    if overhead >= OVERHEAD_BUDGET:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: legacy float64 NDVI-difference vs the fused float32 kernel
+
+Each variant runs in its own subprocess so the reported peak RSS is not
+polluted by the other one. Run from the backend directory:
+
+    python benchmarks/bench_ndvi_kernel.py --size 4096 --tile 512
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from core.ndvi import NDVIDifferenceKernel  # noqa: E402
+from core.statistics import ChangeAccumulator  # noqa: E402
+from core.tiling import iter_windows  # noqa: E402
+
+THRESHOLD = 0.2
+
+
+def make_bands(size: int):
+    """Synthetic uint16 red/NIR bands for two dates"""
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 4000, (size, size), dtype=np.uint16) for _ in range(4)]
+
+
+def legacy(before_red, before_nir, after_red, after_nir):
+    """The pre-kernel code path: float64 casts, nan_to_num and full-scene temporaries"""
+    def calculate_ndvi(red_band, nir_band):
+        np.seterr(divide='ignore', invalid='ignore')
+        ndvi = (nir_band.astype(float) - red_band.astype(float)) / (nir_band.astype(float) + red_band.astype(float))
+        return np.nan_to_num(ndvi, nan=0.0)
+
+    ndvi_before = calculate_ndvi(before_red, before_nir)
+    ndvi_after = calculate_ndvi(after_red, after_nir)
+    diff = ndvi_after - ndvi_before
+    change_mask = np.abs(diff) > THRESHOLD
+    return (np.count_nonzero(change_mask) / change_mask.size * 100,
+            float(np.mean(ndvi_before)), float(np.mean(ndvi_after)))
+
+
+def fused(before_red, before_nir, after_red, after_nir, tile: int):
+    """Tile loop over the fused kernel, copying each window into its buffers"""
+    height, width = before_red.shape
+    kernel = NDVIDifferenceKernel(tile * tile)
+    accumulator = ChangeAccumulator()
+
+    for window, _ in iter_windows(width, height, tile):
+        rows, cols = window.toslices()
+        shape = (int(window.height), int(window.width))
+
+        red, nir = kernel.band_buffers(shape)
+        np.copyto(red, before_red[rows, cols])
+        np.copyto(nir, before_nir[rows, cols])
+        ndvi_before = kernel.ndvi("before", shape)
+
+        red, nir = kernel.band_buffers(shape)
+        np.copyto(red, after_red[rows, cols])
+        np.copyto(nir, after_nir[rows, cols])
+        ndvi_after = kernel.ndvi("after", shape)
+
+        accumulator.update(ndvi_before, ndvi_after, kernel.change_mask(ndvi_before, ndvi_after, THRESHOLD))
+
+    return accumulator.change_percentage, accumulator.ndvi_before_mean, accumulator.ndvi_after_mean
+
+
+def run_variant(variant: str, size: int, tile: int):
+    bands = make_bands(size)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if variant == "legacy":
+        result = legacy(*bands)
+    else:
+        result = fused(*bands, tile=tile)
+    elapsed = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux; report growth over the input arrays
+    print(f"{variant},{elapsed:.4f},{(peak_rss - baseline_rss) / 1024:.1f},"
+          f"{result[0]:.6f},{result[1]:.6f},{result[2]:.6f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=4096, help="Scene edge length in pixels")
+    parser.add_argument("--tile", type=int, default=512, help="Kernel tile edge length")
+    parser.add_argument("--variant", choices=["legacy", "fused"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.size, args.tile)
+        return
+
+    print(f"Scene {args.size}x{args.size}, tile {args.tile}")
+    print(f"{'variant':<8} {'wall s':>8} {'peak RSS MiB':>13} {'change %':>10} {'ndvi before':>12} {'ndvi after':>11}")
+    for variant in ("legacy", "fused"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, "--size", str(args.size), "--tile", str(args.tile)],
+            check=True, capture_output=True, text=True
+        ).stdout.strip().splitlines()[-1]
+        name, elapsed, rss, change, before, after = out.split(",")
+        print(f"{name:<8} {float(elapsed):>8.3f} {float(rss):>13.1f} {float(change):>10.4f} "
+              f"{float(before):>12.6f} {float(after):>11.6f}")
+
+
+if __name__ == "__main__":
+    main()
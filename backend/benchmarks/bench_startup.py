@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold import time of the API and worker entry points
+
+Each module is imported in a fresh interpreter under ``python -X
+importtime``; the slowest imports one level below the entry point are
+listed, and the run fails if the best total exceeds the budget or if a
+heavy scientific package (which must only load on first use) is imported
+at startup. Run from the backend directory:
+
+    python benchmarks/bench_startup.py --module main --budget-ms 1500
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+# Packages that must not be imported by the API or the worker at startup
+HEAVY_PACKAGES = ("rasterio", "sklearn", "skimage", "scipy", "cv2", "geopandas", "xarray", "pandas")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def import_profile(module: str) -> Tuple[int, List[Tuple[str, int]], List[str]]:
+    """
+    Import ``module`` in a fresh interpreter.
+
+    Returns:
+        (total microseconds, [(second-level import, cumulative us)], heavy packages loaded)
+    """
+    code = (
+        f"import sys; import {module}; "
+        f"print(','.join(name for name in {HEAVY_PACKAGES!r} if name in sys.modules))"
+    )
+    env = dict(os.environ, PYTHONPATH=str(BACKEND_DIR))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    # Nested imports are indented two spaces per level under their importer
+    total = 0
+    direct: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3)) // 2
+        if depth == 0:
+            total += int(match.group(2))
+        elif depth == 1:
+            direct[match.group(4)] = direct.get(match.group(4), 0) + int(match.group(2))
+
+    loaded = completed.stdout.strip().splitlines()
+    heavy = [name for name in loaded[-1].split(",") if name] if loaded else []
+    ranked = sorted(direct.items(), key=lambda item: item[1], reverse=True)
+    return total, ranked, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", action="append",
+                        help="Module to import (repeatable, default: main and worker)")
+    parser.add_argument("--budget-ms", type=float, default=1500.0,
+                        help="Maximum import time per module in milliseconds")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per module (best is kept)")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.module or ["main", "worker"]:
+        try:
+            runs = [import_profile(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"\n{module}: {e}")
+            failed = True
+            continue
+        total, ranked, heavy = min(runs, key=lambda run: run[0])
+
+        print(f"\n{module}: {total / 1000:.0f} ms (budget {args.budget_ms:.0f} ms)")
+        print(f"  {'cumulative ms':>13}  import")
+        for name, cumulative in ranked[:args.top]:
+            print(f"  {cumulative / 1000:>13.1f}  {name}")
+
+        if heavy:
+            print(f"  FAIL: heavy packages imported at startup: {', '.join(heavy)}")
+            failed = True
+        if total / 1000 > args.budget_ms:
+            print("  FAIL: import time over budget")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,2 @@
-# Configuration package for Change Detection System
-
+# Configuration package for Change Detection System
+
@@ -41,6 +41,12 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Create base class for models
 Base = declarative_base()
 
+# Columns added to existing tables since they were first created;
+# create_all only creates missing tables, so these run on every init_db
+SCHEMA_UPGRADES = [
+    "ALTER TABLE satellite_images ADD COLUMN IF NOT EXISTS tile_index JSONB",
+]
+
 def get_db():
     """Dependency to get database session"""
     db = SessionLocal()
@@ -60,6 +66,9 @@ def init_db():
         
         # Create all tables
         Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            for statement in SCHEMA_UPGRADES:
+                conn.execute(text(statement))
         logger.info("Database tables created successfully")
         logger.info("Available tables:")
         for table_name in Base.metadata.tables.keys():
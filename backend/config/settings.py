@@ -0,0 +1,31 @@
+"""
+Application settings loaded from the YAML configuration file
+"""
+
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict
+
+import yaml
+from loguru import logger
+
+# Default configuration file shipped with the backend
+DEFAULT_CONFIG_PATH = Path(__file__).resolve().parent / "config.yml"
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Dict:
+    """
+    Load settings from the file named by CONFIG_PATH (or config/config.yml).
+    The parsed dictionary is cached for the lifetime of the process.
+    """
+    path = Path(os.getenv("CONFIG_PATH", str(DEFAULT_CONFIG_PATH)))
+    try:
+        with open(path, "r") as f:
+            settings = yaml.safe_load(f) or {}
+        logger.info(f"Loaded settings from {path}")
+        return settings
+    except FileNotFoundError:
+        logger.warning(f"Config file not found at {path}, using built-in defaults")
+        return {}
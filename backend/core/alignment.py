@@ -0,0 +1,226 @@
+"""
+Grid alignment of before/after scene pairs through warped virtual datasets
+"""
+
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from rasterio.crs import CRS
+from rasterio.enums import MaskFlags
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, transform_bounds, transform_geom
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import transform as window_transform
+
+
+class AlignedGrid:
+    """Common pixel grid shared by both scenes of a pair"""
+
+    def __init__(self, crs, transform, width: int, height: int):
+        self.crs = CRS.from_user_input(crs)
+        self.transform = transform
+        self.width = width
+        self.height = height
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+    @property
+    def key(self) -> str:
+        """Stable identifier, used to key cached products computed on this grid"""
+        return f"{self.crs.to_string()}|{tuple(self.transform)[:6]}|{self.width}x{self.height}"
+
+    def __repr__(self):
+        return f"<AlignedGrid({self.width}x{self.height}, crs='{self.crs.to_string()}')>"
+
+
+def common_grid(src_before, src_after) -> AlignedGrid:
+    """
+    Intersection of two scenes on the before scene's pixel grid.
+
+    The after scene's footprint is transformed into the before scene's CRS,
+    intersected with the before footprint and snapped inwards to whole
+    before pixels, so the before scene never needs resampling.
+
+    Raises:
+        ValueError: If the scenes do not overlap
+    """
+    before = src_before.bounds
+    if src_after.crs == src_before.crs:
+        after = src_after.bounds
+    else:
+        after = transform_bounds(src_after.crs, src_before.crs, *src_after.bounds, densify_pts=21)
+
+    left, bottom = max(before[0], after[0]), max(before[1], after[1])
+    right, top = min(before[2], after[2]), min(before[3], after[3])
+    if left >= right or bottom >= top:
+        raise ValueError("Before and after scenes do not overlap")
+
+    window = from_bounds(left, bottom, right, top, transform=src_before.transform)
+    col_start = max(0, math.ceil(window.col_off - 1e-6))
+    row_start = max(0, math.ceil(window.row_off - 1e-6))
+    col_stop = min(src_before.width, math.floor(window.col_off + window.width + 1e-6))
+    row_stop = min(src_before.height, math.floor(window.row_off + window.height + 1e-6))
+    if col_stop <= col_start or row_stop <= row_start:
+        raise ValueError("Before and after scenes overlap by less than one pixel")
+
+    snapped = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    return AlignedGrid(
+        src_before.crs, window_transform(snapped, src_before.transform),
+        snapped.width, snapped.height
+    )
+
+
+def geometry_to_crs(geometry, src_crs, dst_crs) -> Dict:
+    """GeoJSON-like mapping of a shapely geometry or mapping, reprojected to dst_crs"""
+    if hasattr(geometry, "__geo_interface__"):
+        geometry = geometry.__geo_interface__
+    if CRS.from_user_input(src_crs) == CRS.from_user_input(dst_crs):
+        return geometry
+    return transform_geom(src_crs, dst_crs, geometry)
+
+
+def geometry_bounds(geometry: Dict) -> Tuple[float, float, float, float]:
+    """(left, bottom, right, top) of a GeoJSON-like mapping"""
+    xs, ys = [], []
+
+    def collect(coords):
+        if isinstance(coords[0], (int, float)):
+            xs.append(coords[0])
+            ys.append(coords[1])
+        else:
+            for part in coords:
+                collect(part)
+
+    if geometry["type"] == "GeometryCollection":
+        for part in geometry["geometries"]:
+            bounds = geometry_bounds(part)
+            xs.extend(bounds[0::2])
+            ys.extend(bounds[1::2])
+    else:
+        collect(geometry["coordinates"])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def crop_grid(grid: AlignedGrid, geometry: Dict) -> AlignedGrid:
+    """
+    Sub-grid covering the bounding box of ``geometry`` (already in the grid's
+    CRS), snapped outwards to whole grid pixels and clipped to the grid.
+
+    Raises:
+        ValueError: If the geometry does not intersect the grid
+    """
+    window = from_bounds(*geometry_bounds(geometry), transform=grid.transform)
+    col_start = max(0, math.floor(window.col_off + 1e-6))
+    row_start = max(0, math.floor(window.row_off + 1e-6))
+    col_stop = min(grid.width, math.ceil(window.col_off + window.width - 1e-6))
+    row_stop = min(grid.height, math.ceil(window.row_off + window.height - 1e-6))
+    if col_stop <= col_start or row_stop <= row_start:
+        raise ValueError("AOI does not intersect the scenes")
+
+    snapped = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    return AlignedGrid(
+        grid.crs, window_transform(snapped, grid.transform), snapped.width, snapped.height
+    )
+
+
+def _grid_offset(src, grid: AlignedGrid) -> Optional[Tuple[int, int]]:
+    """Integer (col, row) offset of the grid inside src, or None if src needs warping"""
+    if src.crs != grid.crs:
+        return None
+
+    src_t, grid_t = src.transform, grid.transform
+    if not all(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-12)
+               for a, b in zip((src_t.a, src_t.b, src_t.d, src_t.e),
+                               (grid_t.a, grid_t.b, grid_t.d, grid_t.e))):
+        return None
+
+    col, row = ~src_t * (grid_t.c, grid_t.f)
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+
+    col, row = int(round(col)), int(round(row))
+    if col < 0 or row < 0 or col + grid.width > src.width or row + grid.height > src.height:
+        return None
+    return col, row
+
+
+class GridReader:
+    """
+    Reads windows of an AlignedGrid from one scene.
+
+    A scene already on the grid is read through a plain window offset; any
+    other scene goes through a WarpedVRT, so GDAL decodes only the source
+    blocks under each requested window and resamples them exactly once.
+    """
+
+    def __init__(self, src, grid: AlignedGrid, resampling: Resampling = Resampling.bilinear):
+        self.src = src
+        self.grid = grid
+        self.resampling = resampling
+
+        self.name = src.name
+        self.count = src.count
+        self.block_shapes = src.block_shapes
+        self.width, self.height = grid.width, grid.height
+
+        self._vrt = None
+        self._offset = _grid_offset(src, grid)
+        if self._offset is None:
+            self._vrt = WarpedVRT(
+                src, crs=grid.crs, transform=grid.transform,
+                width=grid.width, height=grid.height, resampling=resampling
+            )
+            self._offset = (0, 0)
+
+    @property
+    def warped(self) -> bool:
+        return self._vrt is not None
+
+    @property
+    def cache_extra(self) -> Optional[str]:
+        """Cache discriminator: warped reads depend on the grid, offset reads do not"""
+        return self.grid.key if self.warped else None
+
+    def source_window(self, window: Window) -> Window:
+        """Window in the underlying dataset (or VRT) for a window of the grid"""
+        col, row = self._offset
+        if not col and not row:
+            return window
+        return Window(window.col_off + col, window.row_off + row, window.width, window.height)
+
+    def read(self, index, window: Window, out, resampling: Optional[Resampling] = None):
+        """
+        Read one band (or a list of bands) of a grid window into ``out``.
+        An ``out`` smaller than the window is a decimated read, served from
+        overviews when the dataset has them.
+        """
+        dataset = self._vrt if self._vrt is not None else self.src
+        return dataset.read(index, window=self.source_window(window), out=out,
+                            resampling=resampling or self.resampling)
+
+    def mask_nodata(self, index: int, window: Window, data: np.ndarray, valid: np.ndarray):
+        """
+        Clear ``valid`` where band ``index`` of a grid window holds no data,
+        per the dataset's nodata value or mask. ``data`` is the band as read
+        by ``read``; bands without nodata leave ``valid`` untouched.
+        """
+        dataset = self._vrt if self._vrt is not None else self.src
+        flags = dataset.mask_flag_enums[index - 1]
+        if MaskFlags.all_valid in flags:
+            return
+        if MaskFlags.nodata in flags:
+            nodata = dataset.nodata
+            valid &= ~np.isnan(data) if np.isnan(nodata) else data != nodata
+            return
+        # Internal mask, alpha band or per-dataset mask
+        mask = dataset.read_masks(index, window=self.source_window(window), out_shape=valid.shape,
+                                  resampling=Resampling.nearest)
+        valid &= mask != 0
+
+    def close(self):
+        if self._vrt is not None:
+            self._vrt.close()
+            self._vrt = None
@@ -0,0 +1,169 @@
+"""
+Unsupervised per-pixel anomaly scoring of image pairs
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+from core.tiling import iter_windows
+
+
+class AnomalyScorer:
+    """
+    Isolation forest over the spectra of both dates, fitted on a sample.
+
+    Fitting draws a pool of ``pool_factor * sample_size`` valid pixels,
+    spread over the scene in proportion to each tile's valid pixels, and
+    clusters it into ``n_strata`` spectral strata with mini-batch k-means.
+    The training sample takes an equal share from every stratum, so rare
+    but ordinary land covers (water, urban) are not what the forest learns
+    to isolate. Scoring then runs over chunks of ``chunk_size`` pixels on a
+    thread pool; tree traversal releases the GIL and memory is bounded by
+    the chunk size, so the cost is linear in the number of valid pixels.
+
+    Scores are the forest's anomaly score in (0, 1), higher is more
+    anomalous; pixels scoring above ``threshold`` are the anomalies
+    expected at ``contamination``.
+    """
+
+    def __init__(self, sample_size: int = 50000, n_strata: int = 8, pool_factor: int = 4,
+                 n_estimators: int = 100, contamination="auto", chunk_size: int = 262144,
+                 tile_size: int = 512, max_workers: int = 4, random_state: int = 0):
+        self.sample_size = sample_size
+        self.n_strata = n_strata
+        self.pool_factor = pool_factor
+        self.n_estimators = n_estimators
+        self.contamination = contamination
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+        self.max_workers = max_workers
+        self.random_state = random_state
+        self.model = None
+
+    @classmethod
+    def from_config(cls, config: Dict) -> Optional["AnomalyScorer"]:
+        """Create the scorer described by ``detection.anomaly``, or None if disabled"""
+        settings = config.get('detection', {}).get('anomaly', {})
+        if not settings.get('enabled', False):
+            return None
+        processing = config.get('detection', {}).get('processing', {})
+        return cls(
+            sample_size=settings.get('sample_size', 50000),
+            n_strata=settings.get('n_strata', 8),
+            pool_factor=settings.get('pool_factor', 4),
+            n_estimators=settings.get('n_estimators', 100),
+            contamination=settings.get('contamination', 'auto'),
+            chunk_size=settings.get('chunk_size', 262144),
+            tile_size=processing.get('tile_size', 512),
+            max_workers=processing.get('max_workers', 4),
+            random_state=settings.get('random_state', 0)
+        )
+
+    @property
+    def threshold(self) -> float:
+        """Score above which a pixel is an anomaly"""
+        return float(-self.model.offset_)
+
+    def fit(self, image1: np.ndarray, image2: np.ndarray, valid: np.ndarray) -> "AnomalyScorer":
+        """
+        Fit the forest on a stratified sample of valid pixels.
+
+        Args:
+            image1, image2: Images of both dates (bands, height, width)
+            valid: Pixels that may be sampled (height, width)
+        """
+        # scikit-learn takes longer to import than most requests take to serve
+        from sklearn.cluster import MiniBatchKMeans
+        from sklearn.ensemble import IsolationForest
+
+        rng = np.random.default_rng(self.random_state)
+        pool = self._sample_pool(image1, image2, valid, rng)
+        if len(pool) < self.n_strata:
+            raise ValueError("Too few valid pixels for anomaly scoring")
+
+        strata = MiniBatchKMeans(
+            n_clusters=self.n_strata, batch_size=4096, n_init=3, random_state=self.random_state
+        ).fit_predict(pool)
+        per_stratum = max(1, self.sample_size // self.n_strata)
+        sample = []
+        for stratum in range(self.n_strata):
+            members = np.flatnonzero(strata == stratum)
+            if len(members) > per_stratum:
+                members = rng.choice(members, per_stratum, replace=False)
+            sample.append(members)
+        sample = pool[np.concatenate(sample)]
+
+        self.model = IsolationForest(
+            n_estimators=self.n_estimators, contamination=self.contamination,
+            random_state=self.random_state
+        ).fit(sample)
+        logger.info(f"Fitted anomaly model on {len(sample)} pixels from {len(pool)} in {self.n_strata} strata")
+        return self
+
+    def score(self, image1: np.ndarray, image2: np.ndarray, valid: np.ndarray,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Anomaly score of every valid pixel, NaN elsewhere.
+
+        Args:
+            out: Optional float32 (height, width) array for the scores
+        """
+        height, width = valid.shape
+        if out is None:
+            out = np.empty((height, width), dtype=np.float32)
+
+        def process(rows: slice):
+            chunk_valid = valid[rows]
+            scores = np.full(chunk_valid.shape, np.nan, dtype=np.float32)
+            if chunk_valid.any():
+                features = _features(image1[:, rows], image2[:, rows], chunk_valid)
+                scores[chunk_valid] = -self.model.score_samples(features)
+            out[rows] = scores
+
+        rows_per_chunk = max(1, self.chunk_size // width)
+        row_bands = [window.toslices()[0] for window, _ in iter_windows(width, height, width, rows_per_chunk)]
+        if self.max_workers > 1 and len(row_bands) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="anomaly") as pool:
+                list(pool.map(process, row_bands))
+        else:
+            for rows in row_bands:
+                process(rows)
+        return out
+
+    def _sample_pool(self, image1: np.ndarray, image2: np.ndarray, valid: np.ndarray,
+                     rng: np.random.Generator) -> np.ndarray:
+        """Features of up to ``pool_factor * sample_size`` valid pixels, drawn tile by tile"""
+        height, width = valid.shape
+        n_valid = int(np.count_nonzero(valid))
+        pool_size = min(n_valid, self.pool_factor * self.sample_size)
+        if not pool_size:
+            return np.empty((0, 2 * min(len(image1), len(image2))), dtype=np.float32)
+
+        parts = []
+        for window, _ in iter_windows(width, height, self.tile_size):
+            rows, cols = window.toslices()
+            tile_valid = valid[rows, cols]
+            indices = np.flatnonzero(tile_valid)
+            take = int(rng.binomial(len(indices), pool_size / n_valid)) if len(indices) else 0
+            if not take:
+                continue
+            picked = np.zeros(tile_valid.size, dtype=bool)
+            picked[rng.choice(indices, take, replace=False)] = True
+            parts.append(_features(image1[:, rows, cols], image2[:, rows, cols],
+                                   picked.reshape(tile_valid.shape)))
+        if not parts:
+            return np.empty((0, 2 * min(len(image1), len(image2))), dtype=np.float32)
+        return np.concatenate(parts)
+
+
+def _features(image1: np.ndarray, image2: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """(pixels, 2 * bands) float32 spectra of both dates where ``mask`` is set"""
+    n_bands = min(len(image1), len(image2))
+    features = np.empty((int(np.count_nonzero(mask)), 2 * n_bands), dtype=np.float32)
+    for band in range(n_bands):
+        features[:, band] = image1[band][mask]
+        features[:, n_bands + band] = image2[band][mask]
+    return features
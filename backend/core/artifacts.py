@@ -0,0 +1,161 @@
+"""
+Compact on-disk result artifacts and lazy loaders
+
+Rasters are written as Cloud-Optimized GeoTIFFs, quantised to small
+integer types with GDAL scale/offset metadata so GIS tools see real
+values. Boolean masks are bit-packed row by row (1 bit per pixel) into
+memory-mappable ``.npy`` files. Change polygons are GeoJSON files (see
+``core.vectorize``). Result dictionaries carry small reference
+dicts instead of pixel data; ``open_artifact`` turns a reference back
+into a lazy reader.
+"""
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy as rio_copy
+from rasterio.windows import Window
+
+from core.tiling import iter_windows
+
+# Quantisation used for change magnitude: 0.001 steps, 65535 reserved for nodata
+MAGNITUDE_SCALE = 0.001
+MAGNITUDE_NODATA = 65535
+
+# Quantisation used for anomaly scores in (0, 1): 0.0001 steps, 65535 reserved for nodata
+ANOMALY_SCALE = 0.0001
+ANOMALY_NODATA = 65535
+
+# Number of set bits in every byte value, for counting packed masks
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def write_raster(path: str, array: np.ndarray, dtype: str, scale: float = 1.0,
+                 offset: float = 0.0, nodata=None, transform=None, crs=None,
+                 tile_size: int = 512) -> Dict:
+    """
+    Write a 2-D array as a COG, quantising ``value -> (value - offset) / scale``.
+
+    The array is written window by window to a temporary tiled GeoTIFF and
+    then copied to the COG driver, so no full-size quantised copy is held.
+
+    Returns:
+        Artifact reference dict
+    """
+    height, width = array.shape
+    info = np.iinfo(dtype) if np.issubdtype(np.dtype(dtype), np.integer) else None
+    tmp_path = f"{path}.{os.getpid()}.tmp.tif"
+
+    profile = {
+        "driver": "GTiff", "width": width, "height": height, "count": 1, "dtype": dtype,
+        "nodata": nodata, "tiled": True, "blockxsize": 256, "blockysize": 256,
+        "compress": "deflate"
+    }
+    if transform is not None:
+        profile["transform"] = transform
+    if crs is not None:
+        profile["crs"] = crs
+
+    try:
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            dst.scales = (scale,)
+            dst.offsets = (offset,)
+            for window, _ in iter_windows(width, height, tile_size):
+                block = array[window.toslices()]
+                values = (block - offset) / scale if (scale != 1.0 or offset != 0.0) else block
+                if info is not None:
+                    values = np.clip(np.rint(values), info.min, info.max if nodata is None else info.max - 1)
+                if nodata is not None and np.issubdtype(block.dtype, np.floating):
+                    values = np.where(np.isnan(block), nodata, values)
+                dst.write(values.astype(dtype), 1, window=window)
+
+        rio_copy(tmp_path, path, driver="COG", compress="DEFLATE", overview_resampling="nearest")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "kind": "raster", "path": path, "shape": [height, width], "dtype": dtype,
+        "scale": scale, "offset": offset, "nodata": nodata
+    }
+
+
+def write_mask(path: str, mask: np.ndarray) -> Dict:
+    """Write a boolean mask bit-packed along rows (1 bit per pixel)"""
+    np.save(path, np.packbits(mask, axis=1))
+    return {"kind": "mask", "path": path, "shape": list(mask.shape), "encoding": "packbits"}
+
+
+class RasterArtifact:
+    """Lazy reader for a raster artifact; values are returned in real units as float32"""
+
+    def __init__(self, ref: Dict):
+        self.ref = ref
+        self.path = ref["path"]
+        self.shape: Tuple[int, int] = tuple(ref["shape"])
+
+    def read(self, window: Optional[Window] = None) -> np.ndarray:
+        """Read the whole raster or one window; nodata becomes NaN"""
+        with rasterio.open(self.path) as src:
+            raw = src.read(1, window=window)
+        values = raw.astype(np.float32) * self.ref["scale"] + self.ref["offset"]
+        if self.ref.get("nodata") is not None:
+            values[raw == self.ref["nodata"]] = np.nan
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.read()
+        return values.astype(dtype) if dtype is not None else values
+
+
+class MaskArtifact:
+    """Lazy reader for a bit-packed mask; only the requested rows are unpacked"""
+
+    def __init__(self, ref: Dict):
+        self.ref = ref
+        self.path = ref["path"]
+        self.shape: Tuple[int, int] = tuple(ref["shape"])
+        self._packed = np.load(self.path, mmap_mode="r")
+
+    def read(self, rows: slice = slice(None)) -> np.ndarray:
+        """Unpack a range of rows (default: all) into a bool array"""
+        return np.unpackbits(self._packed[rows], axis=1, count=self.shape[1]).astype(bool)
+
+    def count(self, chunk_rows: int = 4096) -> int:
+        """Number of set pixels, counted on the packed bytes chunk by chunk"""
+        total = 0
+        for start in range(0, self.shape[0], chunk_rows):
+            total += int(_POPCOUNT[self._packed[start:start + chunk_rows]].sum())
+        return total
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.read()
+        return values.astype(dtype) if dtype is not None else values
+
+
+class VectorArtifact:
+    """Lazy reader for a GeoJSON artifact"""
+
+    def __init__(self, ref: Dict):
+        self.ref = ref
+        self.path = ref["path"]
+        self.count = ref.get("count")
+
+    def read(self) -> Dict:
+        """Load the FeatureCollection"""
+        with open(self.path) as f:
+            return json.load(f)
+
+
+def open_artifact(ref: Dict):
+    """Open an artifact reference lazily"""
+    if ref["kind"] == "raster":
+        return RasterArtifact(ref)
+    if ref["kind"] == "mask":
+        return MaskArtifact(ref)
+    if ref["kind"] == "vector":
+        return VectorArtifact(ref)
+    raise ValueError(f"Unknown artifact kind: {ref['kind']}")
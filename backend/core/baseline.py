@@ -0,0 +1,248 @@
+"""
+Persistent per-AOI NDVI baselines kept as memory-mapped arrays
+"""
+
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+from numpy.lib.format import open_memmap
+from rasterio.windows import Window
+
+from core.alignment import AlignedGrid
+from core.statistics import ChangeAccumulator
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within one process
+    fcntl = None
+
+
+class Baseline:
+    """
+    Per-pixel NDVI history of one AOI on a fixed grid.
+
+    ``count``, ``mean`` and ``m2`` are Welford running moments, ``median``
+    is a frugal streaming median that moves ``median_step`` towards every
+    new observation. All four are ``.npy`` files opened with ``mmap_mode``,
+    so windows are read and updated in place and memory use does not depend
+    on the AOI size.
+
+    The arrays live in numbered generation directories and ``meta.json``
+    names the current one. A scene is folded into a copy (``stage``) that
+    ``commit`` publishes together with the scene list by replacing
+    ``meta.json``, so a failed update leaves the baseline as it was and
+    retrying it never applies a window twice.
+    """
+
+    ARRAYS = {"count": np.uint16, "mean": np.float32, "m2": np.float32, "median": np.float32}
+
+    def __init__(self, path: Path, grid: AlignedGrid, scenes: List[str], median_step: float,
+                 generation: int = 0):
+        self.path = path
+        self.grid = grid
+        self.scenes = scenes
+        self.median_step = median_step
+        self.generation = generation
+        self._staged = False
+        self._arrays = self._open_arrays(generation, "r")
+
+    @property
+    def n_scenes(self) -> int:
+        return len(self.scenes)
+
+    def has_scene(self, scene_id: str) -> bool:
+        return scene_id in self.scenes
+
+    def score(self, window: Window, ndvi: np.ndarray, valid: np.ndarray, min_scenes: int,
+              z_threshold: float, min_ndvi_change: float) -> Tuple[ChangeAccumulator, np.ndarray]:
+        """
+        Score one window of a new scene against the baseline.
+
+        A pixel changed if it has at least ``min_scenes`` observations, its
+        z-score against the running mean and variance exceeds
+        ``z_threshold`` and it is more than ``min_ndvi_change`` away from the
+        running median (which keeps near-constant pixels from flagging
+        noise).
+
+        Returns:
+            (statistics with the baseline mean as "before", change mask)
+        """
+        rows, cols = window.toslices()
+        count = self._arrays["count"][rows, cols]
+        mean = self._arrays["mean"][rows, cols]
+
+        scored = valid & (count >= max(min_scenes, 2))
+        variance = self._arrays["m2"][rows, cols] / np.maximum(count.astype(np.float32) - 1, 1)
+        deviation = np.abs(ndvi - mean)
+
+        change = deviation > z_threshold * np.sqrt(variance)
+        change &= np.abs(ndvi - self._arrays["median"][rows, cols]) > min_ndvi_change
+        change &= scored
+
+        window_stats = ChangeAccumulator()
+        window_stats.update(mean, ndvi, change, valid=scored)
+        return window_stats, change
+
+    def stage(self):
+        """
+        Copy the arrays to the next generation, which ``update`` modifies
+        and ``score`` reads from then on. Leftovers of failed updates are
+        removed first; call with the AOI's lock held.
+        """
+        for entry in self.path.glob("gen-*"):
+            if entry.is_dir() and entry != _generation_path(self.path, self.generation):
+                shutil.rmtree(entry)
+
+        staged = _generation_path(self.path, self.generation + 1)
+        staged.mkdir()
+        for name in self.ARRAYS:
+            shutil.copyfile(_generation_path(self.path, self.generation) / f"{name}.npy",
+                            staged / f"{name}.npy")
+        self._arrays = self._open_arrays(self.generation + 1, "r+")
+        self._staged = True
+
+    def update(self, window: Window, ndvi: np.ndarray, valid: np.ndarray):
+        """Fold one window of a new scene into the staged running statistics"""
+        if not self._staged:
+            raise RuntimeError("Baseline.stage() must be called before update()")
+        rows, cols = window.toslices()
+        count = self._arrays["count"][rows, cols]
+        mean = self._arrays["mean"][rows, cols]
+        m2 = self._arrays["m2"][rows, cols]
+        median = self._arrays["median"][rows, cols]
+
+        first = valid & (count == 0)
+        count += valid
+
+        delta = np.where(valid, ndvi - mean, 0)
+        mean += delta / np.maximum(count, 1)
+        m2 += delta * np.where(valid, ndvi - mean, 0)
+
+        step = np.sign(ndvi - median) * self.median_step
+        median += np.where(valid, step, 0)
+        median[first] = ndvi[first]
+
+    def commit(self, scene_id: str):
+        """Publish the staged arrays with the scene recorded as part of the baseline"""
+        if not self._staged:
+            raise RuntimeError("Baseline.stage() must be called before commit()")
+        for array in self._arrays.values():
+            array.flush()
+
+        previous = self.generation
+        _write_meta(self.path, self.grid, self.scenes + [scene_id], previous + 1)
+        self.scenes.append(scene_id)
+        self.generation = previous + 1
+        self._staged = False
+        shutil.rmtree(_generation_path(self.path, previous), ignore_errors=True)
+
+    def close(self):
+        self._arrays.clear()
+
+    def _open_arrays(self, generation: int, mode: str) -> Dict[str, np.ndarray]:
+        path = _generation_path(self.path, generation)
+        return {name: np.load(path / f"{name}.npy", mmap_mode=mode) for name in self.ARRAYS}
+
+
+class BaselineStore:
+    """
+    Directory of baselines, one sub-directory per AOI.
+
+    Updates of one AOI are serialized with a lock file (``flock``), so
+    several workers can share the store.
+    """
+
+    def __init__(self, root: str, median_step: float = 0.01):
+        self.root = Path(root)
+        self.median_step = median_step
+        self._thread_lock = threading.Lock()
+
+    def open(self, aoi_id: str) -> Optional[Baseline]:
+        """Open an existing baseline, or None if the AOI has none yet"""
+        path = self._path(aoi_id)
+        meta_path = path / "meta.json"
+        if not meta_path.exists():
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        grid = AlignedGrid(
+            meta["grid"]["crs"], Affine(*meta["grid"]["transform"]),
+            meta["grid"]["width"], meta["grid"]["height"]
+        )
+        return Baseline(path, grid, meta["scenes"], self.median_step, meta["generation"])
+
+    def create(self, aoi_id: str, grid: AlignedGrid) -> Baseline:
+        """Create an empty baseline on ``grid``"""
+        path = self._path(aoi_id)
+        arrays_path = _generation_path(path, 0)
+        arrays_path.mkdir(parents=True, exist_ok=True)
+        for name, dtype in Baseline.ARRAYS.items():
+            array = open_memmap(arrays_path / f"{name}.npy", mode="w+", dtype=dtype, shape=grid.shape)
+            array.flush()
+            del array
+        _write_meta(path, grid, [], 0)
+        return Baseline(path, grid, [], self.median_step)
+
+    @contextmanager
+    def lock(self, aoi_id: str):
+        """Hold the AOI's lock for a read-modify-write of its baseline"""
+        path = self._path(aoi_id)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                self._thread_lock.acquire()
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    self._thread_lock.release()
+
+    @staticmethod
+    def scene_id(image_path: str) -> str:
+        """Identifier of a scene file, so re-running a scene does not count it twice"""
+        stat = os.stat(image_path)
+        return f"{os.path.realpath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+
+    def _path(self, aoi_id: str) -> Path:
+        return self.root / str(aoi_id)
+
+
+def _generation_path(path: Path, generation: int) -> Path:
+    return path / f"gen-{generation}"
+
+
+def _write_meta(path: Path, grid: AlignedGrid, scenes: List[str], generation: int):
+    meta = {
+        "grid": {
+            "crs": grid.crs.to_wkt(),
+            "transform": list(grid.transform)[:6],
+            "width": grid.width,
+            "height": grid.height
+        },
+        "scenes": scenes,
+        "generation": generation
+    }
+    tmp_path = path / f"meta.json.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, path / "meta.json")
+
+
+def baseline_store_from_config(config: Dict) -> BaselineStore:
+    """Create the store described by ``detection.baseline``"""
+    settings = config.get('detection', {}).get('baseline', {})
+    base_path = config.get('storage', {}).get('base_path', './data')
+    root = settings.get('path', os.path.join(base_path, 'baselines'))
+    return BaselineStore(root, settings.get('median_step', 0.01))
@@ -1,323 +1,663 @@
-"""
-Core change detection algorithms for satellite imagery analysis
-"""
-
-import numpy as np
-import rasterio
-from rasterio.mask import mask
-from rasterio.warp import calculate_default_transform, reproject, Resampling
-from scipy import ndimage
-from skimage import filters, morphology, segmentation
-from sklearn.cluster import KMeans
-from sklearn.ensemble import IsolationForest
-import cv2
-from loguru import logger
-from typing import Tuple, Dict, List, Optional
-import geopandas as gpd
-from shapely.geometry import Polygon, box
-import json
-
-class ChangeDetector:
-    """Main change detection class for satellite imagery analysis"""
-    
-    def __init__(self, config: Dict):
-        """
-        Initialize change detector with configuration
-        
-        Args:
-            config: Configuration dictionary with detection parameters
-        """
-        self.config = config
-        self.bands = config.get('detection', {}).get('bands', ['red', 'green', 'nir'])
-        self.cloud_thresholds = config.get('detection', {}).get('cloud', {})
-        self.change_thresholds = config.get('detection', {}).get('change', {})
-        
-        logger.info(f"Initialized ChangeDetector with bands: {self.bands}")
-    
-    def preprocess_imagery(self, image_path: str, aoi_geometry: Polygon) -> np.ndarray:
-        """
-        Preprocess satellite imagery for analysis
-        
-        Args:
-            image_path: Path to satellite imagery file
-            aoi_geometry: AOI geometry for masking
-            
-        Returns:
-            Preprocessed image array
-        """
-        try:
-            with rasterio.open(image_path) as src:
-                # Reproject to consistent CRS if needed
-                if src.crs != 'EPSG:4326':
-                    transform, width, height = calculate_default_transform(
-                        src.crs, 'EPSG:4326', src.width, src.height, *src.bounds
-                    )
-                    image = np.empty((src.count, height, width))
-                    reproject(
-                        source=rasterio.band(src, 1),
-                        destination=image[0],
-                        src_transform=src.transform,
-                        src_crs=src.crs,
-                        dst_transform=transform,
-                        dst_crs='EPSG:4326',
-                        resampling=Resampling.bilinear
-                    )
-                else:
-                    image = src.read()
-                
-                # Mask to AOI
-                masked_image, _ = mask(src, [aoi_geometry], crop=True, nodata=0)
-                
-                # Normalize to 0-1 range
-                normalized_image = self._normalize_image(masked_image)
-                
-                logger.info(f"Preprocessed image: {normalized_image.shape}")
-                return normalized_image
-                
-        except Exception as e:
-            logger.error(f"Error preprocessing imagery: {e}")
-            raise
-    
-    def detect_clouds_and_shadows(self, image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
-        """
-        Detect clouds and shadows in satellite imagery
-        
-        Args:
-            image: Input image array (bands, height, width)
-            
-        Returns:
-            Tuple of (cloud_mask, shadow_mask)
-        """
-        try:
-            # Calculate NDVI for vegetation detection
-            if len(image) >= 3:  # Need at least Red and NIR bands
-                red_band = image[0]  # Assuming first band is red
-                nir_band = image[2]  # Assuming third band is NIR
-                
-                ndvi = (nir_band - red_band) / (nir_band + red_band + 1e-8)
-                
-                # Cloud detection using brightness and NDVI
-                brightness = np.mean(image[:3], axis=0)  # Average of RGB bands
-                
-                cloud_mask = (
-                    (brightness > self.cloud_thresholds.get('brightness_threshold', 0.7)) |
-                    (ndvi < self.cloud_thresholds.get('ndvi_threshold', 0.1))
-                )
-                
-                # Shadow detection (dark areas near clouds)
-                shadow_mask = self._detect_shadows(image, cloud_mask)
-                
-                # Morphological operations to clean up masks
-                cloud_mask = morphology.binary_closing(cloud_mask, morphology.disk(3))
-                shadow_mask = morphology.binary_closing(shadow_mask, morphology.disk(2))
-                
-                logger.info(f"Cloud coverage: {np.sum(cloud_mask) / cloud_mask.size:.2%}")
-                logger.info(f"Shadow coverage: {np.sum(shadow_mask) / shadow_mask.size:.2%}")
-                
-                return cloud_mask, shadow_mask
-            else:
-                logger.warning("Insufficient bands for cloud/shadow detection")
-                return np.zeros(image.shape[1:], dtype=bool), np.zeros(image.shape[1:], dtype=bool)
-                
-        except Exception as e:
-            logger.error(f"Error in cloud/shadow detection: {e}")
-            raise
-    
-    def _detect_shadows(self, image: np.ndarray, cloud_mask: np.ndarray) -> np.ndarray:
-        """Detect shadows based on dark areas near clouds"""
-        # Simple shadow detection: dark areas with low NDVI
-        if len(image) >= 3:
-            red_band = image[0]
-            nir_band = image[2]
-            ndvi = (nir_band - red_band) / (nir_band + red_band + 1e-8)
-            
-            # Dark areas with low NDVI near clouds
-            dark_areas = np.mean(image[:3], axis=0) < self.cloud_thresholds.get('shadow_threshold', 0.3)
-            low_ndvi = ndvi < 0.1
-            
-            # Dilate cloud mask to find areas near clouds
-            dilated_clouds = morphology.binary_dilation(cloud_mask, morphology.disk(5))
-            
-            shadow_mask = dark_areas & low_ndvi & dilated_clouds
-            return shadow_mask
-        
-        return np.zeros(image.shape[1:], dtype=bool)
-    
-    def detect_changes(self, 
-                      image1: np.ndarray, 
-                      image2: np.ndarray,
-                      cloud_mask1: np.ndarray,
-                      cloud_mask2: np.ndarray) -> Dict:
-        """
-        Detect changes between two temporal images
-        
-        Args:
-            image1: First temporal image
-            image2: Second temporal image
-            cloud_mask1: Cloud mask for first image
-            cloud_mask2: Cloud mask for second image
-            
-        Returns:
-            Dictionary containing change detection results
-        """
-        try:
-            # Create valid pixel mask (no clouds in either image)
-            valid_pixels = ~(cloud_mask1 | cloud_mask2)
-            
-            if np.sum(valid_pixels) < 100:  # Need minimum valid pixels
-                logger.warning("Insufficient valid pixels for change detection")
-                return self._empty_change_result()
-            
-            # Calculate spectral differences
-            spectral_diff = self._calculate_spectral_differences(image1, image2, valid_pixels)
-            
-            # Apply change detection algorithms
-            change_magnitude = self._calculate_change_magnitude(spectral_diff)
-            change_direction = self._calculate_change_direction(spectral_diff)
-            
-            # Filter changes based on thresholds
-            significant_changes = self._filter_significant_changes(
-                change_magnitude, 
-                self.change_thresholds.get('min_change_threshold', 0.15)
-            )
-            
-            # Classify change types
-            change_types = self._classify_changes(
-                image1, image2, change_magnitude, change_direction, valid_pixels
-            )
-            
-            # Calculate change statistics
-            change_stats = self._calculate_change_statistics(
-                change_magnitude, significant_changes, valid_pixels
-            )
-            
-            result = {
-                'change_magnitude': change_magnitude.tolist(),
-                'change_direction': change_direction.tolist(),
-                'significant_changes': significant_changes.tolist(),
-                'change_types': change_types,
-                'statistics': change_stats,
-                'valid_pixels': valid_pixels.tolist(),
-                'metadata': {
-                    'algorithm': 'multi-spectral_change_detection',
-                    'thresholds': self.change_thresholds,
-                    'bands_used': self.bands
-                }
-            }
-            
-            logger.info(f"Change detection completed. Significant changes: {change_stats['significant_change_percentage']:.2%}")
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error in change detection: {e}")
-            raise
-    
-    def _calculate_spectral_differences(self, image1: np.ndarray, image2: np.ndarray, 
-                                      valid_pixels: np.ndarray) -> np.ndarray:
-        """Calculate spectral differences between two images"""
-        # Normalized difference for each band
-        differences = []
-        
-        for i in range(min(len(image1), len(image2))):
-            band1 = image1[i]
-            band2 = image2[i]
-            
-            # Normalized difference
-            diff = (band2 - band1) / (band1 + 1e-8)
-            differences.append(diff)
-        
-        # Combine differences (weighted average)
-        combined_diff = np.mean(differences, axis=0)
-        
-        # Apply valid pixel mask
-        combined_diff[~valid_pixels] = 0
-        
-        return combined_diff
-    
-    def _calculate_change_magnitude(self, spectral_diff: np.ndarray) -> np.ndarray:
-        """Calculate magnitude of changes"""
-        return np.abs(spectral_diff)
-    
-    def _calculate_change_direction(self, spectral_diff: np.ndarray) -> np.ndarray:
-        """Calculate direction of changes (positive/negative)"""
-        return np.sign(spectral_diff)
-    
-    def _filter_significant_changes(self, change_magnitude: np.ndarray, threshold: float) -> np.ndarray:
-        """Filter changes based on magnitude threshold"""
-        return change_magnitude > threshold
-    
-    def _classify_changes(self, image1: np.ndarray, image2: np.ndarray, 
-                         change_magnitude: np.ndarray, change_direction: np.ndarray,
-                         valid_pixels: np.ndarray) -> Dict:
-        """Classify types of changes"""
-        # Simple classification based on spectral characteristics
-        changes = {
-            'vegetation_loss': 0,
-            'vegetation_gain': 0,
-            'urban_expansion': 0,
-            'water_changes': 0,
-            'other': 0
-        }
-        
-        # This is a simplified classification - in practice, you'd use more sophisticated methods
-        # like machine learning models trained on labeled data
-        
-        return changes
-    
-    def _calculate_change_statistics(self, change_magnitude: np.ndarray, 
-                                   significant_changes: np.ndarray,
-                                   valid_pixels: np.ndarray) -> Dict:
-        """Calculate comprehensive change statistics"""
-        total_valid_pixels = np.sum(valid_pixels)
-        total_changes = np.sum(significant_changes)
-        
-        stats = {
-            'total_pixels': int(change_magnitude.size),
-            'valid_pixels': int(total_valid_pixels),
-            'changed_pixels': int(total_changes),
-            'change_percentage': float(total_changes / total_valid_pixels * 100) if total_valid_pixels > 0 else 0,
-            'significant_change_percentage': float(total_changes / total_valid_pixels * 100) if total_valid_pixels > 0 else 0,
-            'mean_change_magnitude': float(np.mean(change_magnitude[valid_pixels])),
-            'max_change_magnitude': float(np.max(change_magnitude[valid_pixels])),
-            'std_change_magnitude': float(np.std(change_magnitude[valid_pixels]))
-        }
-        
-        return stats
-    
-    def _normalize_image(self, image: np.ndarray) -> np.ndarray:
-        """Normalize image to 0-1 range"""
-        if image.dtype != np.float32:
-            image = image.astype(np.float32)
-        
-        # Handle different data types (uint8, uint16, etc.)
-        if image.max() > 1.0:
-            image = image / image.max()
-        
-        return image
-    
-    def _empty_change_result(self) -> Dict:
-        """Return empty change detection result"""
-        return {
-            'change_magnitude': [],
-            'change_direction': [],
-            'significant_changes': [],
-            'change_types': {},
-            'statistics': {
-                'total_pixels': 0,
-                'valid_pixels': 0,
-                'changed_pixels': 0,
-                'change_percentage': 0.0,
-                'significant_change_percentage': 0.0,
-                'mean_change_magnitude': 0.0,
-                'max_change_magnitude': 0.0,
-                'std_change_magnitude': 0.0
-            },
-            'valid_pixels': [],
-            'metadata': {
-                'algorithm': 'multi-spectral_change_detection',
-                'thresholds': self.change_thresholds,
-                'bands_used': self.bands,
-                'error': 'insufficient_valid_pixels'
-            }
-        }
-
+"""
+Core change detection algorithms for satellite imagery analysis
+"""
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.warp import calculate_default_transform
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from loguru import logger
+from typing import Tuple, Dict, List, Optional
+from shapely.geometry import Polygon, shape
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from core.alignment import AlignedGrid, GridReader, crop_grid, geometry_to_crs
+from core.anomaly import AnomalyScorer
+from core.artifacts import (
+    ANOMALY_NODATA, ANOMALY_SCALE, MAGNITUDE_NODATA, MAGNITUDE_SCALE, write_mask, write_raster
+)
+from core.classification import CHANGE_CLASSES, ChangeClassifier
+from core.masking import CloudShadowMasker
+from core.ndvi_cache import ndvi_cache_from_config
+from core.scratch import scratch_from_config
+from core.statistics import RunningStatistics
+from core.tile_index import TileIndex
+from core.tiling import iter_windows
+from core.vectorize import vectorizer_from_config
+
+class ChangeDetector:
+    """Main change detection class for satellite imagery analysis"""
+    
+    def __init__(self, config: Dict):
+        """
+        Initialize change detector with configuration
+        
+        Args:
+            config: Configuration dictionary with detection parameters
+        """
+        self.config = config
+        self.bands = config.get('detection', {}).get('bands', ['red', 'green', 'nir'])
+        self.cloud_thresholds = config.get('detection', {}).get('cloud', {})
+        self.change_thresholds = config.get('detection', {}).get('change', {})
+        self.ndvi_cache = ndvi_cache_from_config(config)
+        self.masker = CloudShadowMasker.from_thresholds(self.cloud_thresholds)
+        try:
+            self.classifier = ChangeClassifier.from_config(config, self.bands)
+        except ValueError as e:
+            logger.warning(f"Change classification disabled: {e}")
+            self.classifier = None
+        # Optional isolation-forest anomaly scores (detection.anomaly.enabled)
+        self.anomaly_scorer = AnomalyScorer.from_config(config)
+        # Whole-raster intermediates past processing.memory_budget_mb spill to disk
+        self.scratch = scratch_from_config(config)
+        
+        processing = config.get('detection', {}).get('processing', {})
+        self.tile_size = processing.get('tile_size', 512)
+        self.max_workers = processing.get('max_workers', 4)
+        self.streaming = processing.get('streaming', True)
+        self.results_path = config.get('storage', {}).get('results_path', './data/results')
+        
+        logger.info(f"Initialized ChangeDetector with bands: {self.bands}")
+    
+    def preprocess_imagery(self, image_path: str, aoi_geometry: Polygon,
+                           out_path: Optional[str] = None,
+                           tile_index: Optional[TileIndex] = None) -> np.ndarray:
+        """
+        Preprocess satellite imagery for analysis
+        
+        Args:
+            image_path: Path to satellite imagery file
+            aoi_geometry: AOI geometry for masking (EPSG:4326)
+            out_path: Optional file to hold the image as a memory-mapped array
+            tile_index: Optional ingest-time index of the image (see ``read_aoi``)
+            
+        Returns:
+            Preprocessed float32 image array (bands, height, width) in EPSG:4326
+        """
+        try:
+            image, _, _ = self.read_aoi(image_path, aoi_geometry, out_path=out_path,
+                                        tile_index=tile_index)
+            
+            # Normalize to 0-1 range
+            normalized_image = self._normalize_image(image)
+            
+            logger.info(f"Preprocessed image: {normalized_image.shape}")
+            return normalized_image
+                
+        except Exception as e:
+            logger.error(f"Error preprocessing imagery: {e}")
+            raise
+    
+    def read_aoi(self, image_path: str, aoi_geometry: Optional[Polygon] = None,
+                 aoi_crs: str = 'EPSG:4326', dst_crs: str = 'EPSG:4326',
+                 band_indexes: Optional[List[int]] = None,
+                 out_path: Optional[str] = None,
+                 tile_index: Optional[TileIndex] = None) -> Tuple[np.ndarray, Affine, CRS]:
+        """
+        Read the AOI window of an image on a ``dst_crs`` grid in one pass
+        
+        The destination grid is the scene's default grid in ``dst_crs``,
+        cropped to the AOI bounding box. A scene already in ``dst_crs`` is
+        read through a plain window; any other scene is warped once for all
+        bands through a WarpedVRT, so only source blocks under the AOI are
+        decoded. Pixels outside the AOI polygon are set to 0.
+        
+        With a ``tile_index`` the grid is read tile by tile instead, and
+        tiles the index shows to hold only nodata are set to the nodata
+        value without being decoded, so the result is the same. All-cloud
+        tiles are still read: the index measures cloud on the raw values,
+        while this detector normalizes by the image maximum.
+        
+        Args:
+            image_path: Path to satellite imagery file
+            aoi_geometry: AOI geometry in ``aoi_crs`` (None reads the whole scene)
+            aoi_crs: CRS of ``aoi_geometry``
+            dst_crs: CRS of the returned array
+            band_indexes: 1-based bands to read (default: all bands)
+            out_path: Optional file to back the float32 buffer with np.memmap
+            tile_index: Optional ``TileIndex`` of the image
+            
+        Returns:
+            Tuple of (image, transform, crs)
+        """
+        with rasterio.open(image_path) as src:
+            if band_indexes is None:
+                band_indexes = list(range(1, src.count + 1))
+            
+            if CRS.from_user_input(dst_crs) == src.crs:
+                grid = AlignedGrid(src.crs, src.transform, src.width, src.height)
+            else:
+                transform, width, height = calculate_default_transform(
+                    src.crs, dst_crs, src.width, src.height, *src.bounds
+                )
+                grid = AlignedGrid(dst_crs, transform, width, height)
+            
+            aoi_shape = None
+            if aoi_geometry is not None:
+                aoi_shape = geometry_to_crs(aoi_geometry, aoi_crs, grid.crs)
+                grid = crop_grid(grid, aoi_shape)
+            
+            shape = (len(band_indexes), grid.height, grid.width)
+            if out_path is not None:
+                image = np.memmap(out_path, dtype=np.float32, mode='w+', shape=shape)
+            else:
+                image = self.scratch.empty(shape, np.float32)
+            
+            if tile_index is not None and not tile_index.is_current(image_path):
+                logger.warning(f"Tile index of {image_path} is out of date, reading every tile")
+                tile_index = None
+            
+            reader = GridReader(src, grid)
+            try:
+                if tile_index is None:
+                    reader.read(band_indexes, Window(0, 0, grid.width, grid.height), out=image)
+                else:
+                    nodata = src.nodata if src.nodata is not None else 0
+                    self._read_usable_tiles(reader, band_indexes, grid, tile_index, image, nodata)
+            finally:
+                reader.close()
+        
+        if aoi_shape is not None:
+            outside = geometry_mask([aoi_shape], out_shape=grid.shape, transform=grid.transform)
+            image[:, outside] = 0
+        
+        return image, grid.transform, grid.crs
+    
+    def _read_usable_tiles(self, reader: GridReader, band_indexes: List[int], grid: AlignedGrid,
+                           tile_index: TileIndex, image: np.ndarray, nodata: float):
+        """Read the tiles of ``grid`` that have data into ``image``; fill the rest with ``nodata``"""
+        windows = [window for window, _ in iter_windows(grid.width, grid.height, self.tile_size)]
+        usable = [tile_index.usable(window_bounds(window, grid.transform), grid.crs, skip_cloudy=False)
+                  for window in windows]
+        if all(usable):
+            reader.read(band_indexes, Window(0, 0, grid.width, grid.height), out=image)
+            return
+        
+        for window, window_usable in zip(windows, usable):
+            rows, cols = window.toslices()
+            if window_usable:
+                image[:, rows, cols] = reader.read(band_indexes, window, out=None)
+            else:
+                image[:, rows, cols] = nodata
+        logger.info(f"Skipped {usable.count(False)} of {len(windows)} tiles without valid pixels per the tile index")
+    
+    def calculate_ndvi(self, image: np.ndarray, image_path: Optional[str] = None,
+                       aoi_geometry: Optional[Polygon] = None) -> np.ndarray:
+        """
+        Calculate NDVI for a preprocessed image
+        
+        Args:
+            image: Input image array (bands, height, width)
+            image_path: Source file of ``image``; enables the NDVI cache
+            aoi_geometry: AOI the image was cropped to (part of the cache key)
+            
+        Returns:
+            NDVI array (height, width)
+        """
+        red_band = image[0]  # Assuming first band is red
+        nir_band = image[2]  # Assuming third band is NIR
+        
+        key = None
+        if self.ndvi_cache is not None and image_path is not None:
+            # Accept the AOI as a shapely geometry or a GeoJSON mapping
+            aoi_key = shape(aoi_geometry).wkb_hex if aoi_geometry is not None else None
+            key = self.ndvi_cache.key(image_path, self.bands, aoi_key, red_band.shape,
+                                      extra='preprocessed')
+            ndvi = np.empty(red_band.shape, dtype=np.float32)
+            if self.ndvi_cache.get(key, ndvi):
+                return ndvi
+        
+        ndvi = ((nir_band - red_band) / (nir_band + red_band + 1e-8)).astype(np.float32, copy=False)
+        
+        if key is not None:
+            self.ndvi_cache.put(key, ndvi)
+        return ndvi
+    
+    def detect_clouds_and_shadows(self, image: np.ndarray, image_path: Optional[str] = None,
+                                  aoi_geometry: Optional[Polygon] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Detect clouds and shadows in satellite imagery
+        
+        Args:
+            image: Input image array (bands, height, width)
+            image_path: Source file of ``image``; enables the NDVI cache
+            aoi_geometry: AOI the image was cropped to
+            
+        Returns:
+            Tuple of (cloud_mask, shadow_mask)
+        """
+        try:
+            if len(image) >= 3:  # Need at least Red and NIR bands
+                # NDVI is computed (or loaded from the cache) once and shared
+                ndvi = self.calculate_ndvi(image, image_path, aoi_geometry)
+                cloud_mask, shadow_mask = self._cloud_shadow_masks(image, ndvi)
+                
+                logger.info(f"Cloud coverage: {np.count_nonzero(cloud_mask) / cloud_mask.size:.2%}")
+                logger.info(f"Shadow coverage: {np.count_nonzero(shadow_mask) / shadow_mask.size:.2%}")
+                
+                return cloud_mask, shadow_mask
+            else:
+                logger.warning("Insufficient bands for cloud/shadow detection")
+                return np.zeros(image.shape[1:], dtype=bool), np.zeros(image.shape[1:], dtype=bool)
+                
+        except Exception as e:
+            logger.error(f"Error in cloud/shadow detection: {e}")
+            raise
+    
+    def _cloud_shadow_masks(self, image: np.ndarray, ndvi: np.ndarray,
+                            max_workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Run the fused cloud/shadow masker tile by tile. Tiles overlap by the
+        masker's halo and only their cores are written out, so the masks are
+        the same as for the whole scene while intermediates stay tile-sized.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        
+        height, width = ndvi.shape
+        cloud_mask = self.scratch.empty((height, width), bool)
+        shadow_mask = self.scratch.empty((height, width), bool)
+        
+        def process(tile):
+            window, (core_rows, core_cols) = tile
+            rows, cols = window.toslices()
+            cloud, shadow = self.masker.masks(image[:3, rows, cols], ndvi[rows, cols])
+            out_rows = slice(rows.start + core_rows.start, rows.start + core_rows.stop)
+            out_cols = slice(cols.start + core_cols.start, cols.start + core_cols.stop)
+            cloud_mask[out_rows, out_cols] = cloud[core_rows, core_cols]
+            shadow_mask[out_rows, out_cols] = shadow[core_rows, core_cols]
+        
+        tiles = list(iter_windows(width, height, self.tile_size, overlap=self.masker.halo))
+        if max_workers > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mask") as pool:
+                list(pool.map(process, tiles))
+        else:
+            for tile in tiles:
+                process(tile)
+        
+        return cloud_mask, shadow_mask
+    
+    def detect_changes(self, 
+                      image1: np.ndarray, 
+                      image2: np.ndarray,
+                      cloud_mask1: np.ndarray,
+                      cloud_mask2: np.ndarray,
+                      streaming: Optional[bool] = None,
+                      max_workers: Optional[int] = None,
+                      output_dir: Optional[str] = None,
+                      transform=None,
+                      crs=None) -> Dict:
+        """
+        Detect changes between two temporal images
+        
+        Args:
+            image1: First temporal image
+            image2: Second temporal image
+            cloud_mask1: Cloud mask for first image
+            cloud_mask2: Cloud mask for second image
+            streaming: Process the images in row bands of ``tile_size`` rows
+                (default ``processing.streaming``); statistics are merged per band
+            max_workers: Threads used for streaming (default ``processing.max_workers``)
+            output_dir: Directory for the raster and mask artifacts (and, with
+                ``detection.anomaly.enabled``, the per-pixel anomaly scores)
+                (default: a new directory under ``storage.results_path``)
+            transform, crs: Optional georeferencing for the raster artifacts;
+                when given, significant changes are also vectorized into
+                ``change_polygons`` (GeoJSON, see ``detection.vectorize``)
+            
+        Returns:
+            Dictionary containing change detection results. Rasters and masks
+            are artifact references (see ``core.artifacts.open_artifact``)
+        """
+        if streaming is None:
+            streaming = self.streaming
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        try:
+            # Create valid pixel mask (no clouds in either image)
+            valid_pixels = self.scratch.empty(cloud_mask1.shape, bool)
+            np.logical_or(cloud_mask1, cloud_mask2, out=valid_pixels)
+            np.logical_not(valid_pixels, out=valid_pixels)
+            
+            if np.count_nonzero(valid_pixels) < 100:  # Need minimum valid pixels
+                logger.warning("Insufficient valid pixels for change detection")
+                return self._empty_change_result()
+            
+            threshold = self.change_thresholds.get('min_change_threshold', 0.15)
+            
+            if streaming:
+                change_magnitude, change_direction, significant_changes, magnitude_stats = \
+                    self._detect_changes_streaming(image1, image2, valid_pixels, threshold, max_workers)
+            else:
+                # Calculate spectral differences
+                spectral_diff = self._calculate_spectral_differences(image1, image2, valid_pixels)
+                dtype = spectral_diff.dtype
+                
+                # Apply change detection algorithms
+                change_magnitude = self._calculate_change_magnitude(
+                    spectral_diff, out=self.scratch.empty(spectral_diff.shape, dtype)
+                )
+                # Direction is computed in place; the differences are not needed afterwards
+                change_direction = self._calculate_change_direction(spectral_diff, out=spectral_diff)
+                
+                # Filter changes based on thresholds
+                significant_changes = self._filter_significant_changes(
+                    change_magnitude, threshold, out=self.scratch.empty(spectral_diff.shape, bool)
+                )
+                magnitude_stats = RunningStatistics().update(change_magnitude, valid_pixels)
+            
+            # Classify change types
+            change_types = self._classify_changes(
+                image1, image2, change_magnitude, change_direction, valid_pixels,
+                significant_changes, max_workers
+            )
+            
+            # Calculate change statistics
+            change_stats = self._calculate_change_statistics(
+                change_magnitude, significant_changes, valid_pixels, magnitude_stats
+            )
+            
+            anomaly_score = None
+            if self.anomaly_scorer is not None:
+                anomaly_score = self._score_anomalies(image1, image2, valid_pixels)
+                change_stats['anomaly'] = self._anomaly_statistics(anomaly_score, valid_pixels)
+            
+            artifacts = self._write_artifacts(
+                output_dir, change_magnitude, change_direction,
+                significant_changes, valid_pixels, transform, crs, anomaly_score
+            )
+            
+            result = {
+                'change_magnitude': artifacts['change_magnitude'],
+                'change_direction': artifacts['change_direction'],
+                'significant_changes': artifacts['significant_changes'],
+                'change_types': change_types,
+                'statistics': change_stats,
+                'valid_pixels': artifacts['valid_pixels'],
+                'change_polygons': artifacts.get('change_polygons'),
+                'anomaly_score': artifacts.get('anomaly_score'),
+                'metadata': {
+                    'algorithm': 'multi-spectral_change_detection',
+                    'thresholds': self.change_thresholds,
+                    'bands_used': self.bands
+                }
+            }
+            
+            logger.info(f"Change detection completed. Significant changes: {change_stats['significant_change_percentage']:.2%}")
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error in change detection: {e}")
+            raise
+    
+    def _detect_changes_streaming(self, image1: np.ndarray, image2: np.ndarray,
+                                  valid_pixels: np.ndarray, threshold: float,
+                                  max_workers: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, RunningStatistics]:
+        """
+        Compute change magnitude, direction and significance band by band.
+        Intermediates stay band-sized and magnitude statistics are merged from
+        per-band RunningStatistics, so bands can run on a thread pool.
+        """
+        height, width = valid_pixels.shape
+        dtype = np.result_type(image1.dtype, image2.dtype, np.float32)
+        change_magnitude = self.scratch.empty((height, width), dtype)
+        change_direction = self.scratch.empty((height, width), dtype)
+        significant_changes = self.scratch.empty((height, width), bool)
+        
+        def process(rows: slice) -> RunningStatistics:
+            valid = valid_pixels[rows]
+            spectral_diff = self._calculate_spectral_differences(image1[:, rows], image2[:, rows], valid)
+            change_magnitude[rows] = self._calculate_change_magnitude(spectral_diff)
+            change_direction[rows] = self._calculate_change_direction(spectral_diff)
+            significant_changes[rows] = self._filter_significant_changes(change_magnitude[rows], threshold)
+            return RunningStatistics().update(change_magnitude[rows], valid)
+        
+        row_bands = [window.toslices()[0] for window, _ in iter_windows(width, height, width, self.tile_size)]
+        
+        magnitude_stats = RunningStatistics()
+        if max_workers > 1 and len(row_bands) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="change") as pool:
+                for band_stats in pool.map(process, row_bands):
+                    magnitude_stats.merge(band_stats)
+        else:
+            for rows in row_bands:
+                magnitude_stats.merge(process(rows))
+        
+        return change_magnitude, change_direction, significant_changes, magnitude_stats
+    
+    def _write_artifacts(self, output_dir: Optional[str], change_magnitude: np.ndarray,
+                         change_direction: np.ndarray, significant_changes: np.ndarray,
+                         valid_pixels: np.ndarray, transform=None, crs=None,
+                         anomaly_score: Optional[np.ndarray] = None) -> Dict:
+        """
+        Write result rasters as compact artifacts: magnitude as a uint16 COG
+        (0.001 steps), direction as a uint8 COG (offset -1) and both masks
+        bit-packed. Georeferenced results also get the significant changes as
+        GeoJSON polygons, and anomaly scores are a uint16 COG (0.0001 steps).
+        Returns artifact references keyed by result field.
+        """
+        if output_dir is None:
+            output_dir = os.path.join(self.results_path, uuid.uuid4().hex)
+        os.makedirs(output_dir, exist_ok=True)
+        
+        artifacts = {
+            'change_magnitude': write_raster(
+                os.path.join(output_dir, 'change_magnitude.tif'), change_magnitude, 'uint16',
+                scale=MAGNITUDE_SCALE, nodata=MAGNITUDE_NODATA, transform=transform, crs=crs,
+                tile_size=self.tile_size
+            ),
+            'change_direction': write_raster(
+                os.path.join(output_dir, 'change_direction.tif'), change_direction, 'uint8',
+                offset=-1.0, transform=transform, crs=crs, tile_size=self.tile_size
+            ),
+            'significant_changes': write_mask(
+                os.path.join(output_dir, 'significant_changes.npy'), significant_changes
+            ),
+            'valid_pixels': write_mask(os.path.join(output_dir, 'valid_pixels.npy'), valid_pixels)
+        }
+        
+        if anomaly_score is not None:
+            artifacts['anomaly_score'] = write_raster(
+                os.path.join(output_dir, 'anomaly_score.tif'), anomaly_score, 'uint16',
+                scale=ANOMALY_SCALE, nodata=ANOMALY_NODATA, transform=transform, crs=crs,
+                tile_size=self.tile_size
+            )
+        
+        if transform is not None and crs is not None:
+            height, width = significant_changes.shape
+            artifacts['change_polygons'] = vectorizer_from_config(self.config).write_geojson(
+                os.path.join(output_dir, 'change_polygons.geojson'),
+                lambda window: significant_changes[window.toslices()],
+                width, height, transform, crs
+            )
+        
+        logger.info(f"Wrote change detection artifacts to {output_dir}")
+        return artifacts
+    
+    def _score_anomalies(self, image1: np.ndarray, image2: np.ndarray,
+                         valid_pixels: np.ndarray) -> np.ndarray:
+        """
+        Per-pixel anomaly score of the image pair (NaN where invalid)
+        
+        The model is fitted on a stratified sample of valid pixels and the
+        full raster is scored in chunks, see ``AnomalyScorer``.
+        """
+        scores = self.scratch.empty(valid_pixels.shape, np.float32)
+        return self.anomaly_scorer.fit(image1, image2, valid_pixels).score(
+            image1, image2, valid_pixels, out=scores
+        )
+    
+    def _anomaly_statistics(self, anomaly_score: np.ndarray, valid_pixels: np.ndarray) -> Dict:
+        """Share of valid pixels scoring above the model's anomaly threshold"""
+        threshold = self.anomaly_scorer.threshold
+        total_valid = int(np.count_nonzero(valid_pixels))
+        anomalous = 0
+        for window, _ in iter_windows(valid_pixels.shape[1], valid_pixels.shape[0], self.tile_size):
+            anomalous += int(np.count_nonzero(anomaly_score[window.toslices()] > threshold))
+        return {
+            'threshold': threshold,
+            'anomalous_pixels': anomalous,
+            'anomaly_percentage': float(anomalous / total_valid * 100) if total_valid else 0.0
+        }
+    
+    def _calculate_spectral_differences(self, image1: np.ndarray, image2: np.ndarray, 
+                                      valid_pixels: np.ndarray) -> np.ndarray:
+        """
+        Calculate spectral differences between two images
+        
+        The per-band normalized differences are averaged by accumulating
+        into one output array, so only two band-sized scratch arrays are
+        needed regardless of the band count.
+        """
+        n_bands = min(len(image1), len(image2))
+        shape = image1.shape[1:]
+        dtype = np.result_type(image1.dtype, image2.dtype, np.float32)
+        
+        combined_diff = self.scratch.zeros(shape, dtype)
+        band_diff = self.scratch.empty(shape, dtype)
+        denominator = self.scratch.empty(shape, dtype)
+        
+        for i in range(n_bands):
+            # Normalized difference
+            np.subtract(image2[i], image1[i], out=band_diff)
+            np.add(image1[i], 1e-8, out=denominator)
+            np.divide(band_diff, denominator, out=band_diff)
+            combined_diff += band_diff
+        
+        # Combine differences (unweighted average)
+        combined_diff /= n_bands
+        
+        # Apply valid pixel mask
+        combined_diff[~valid_pixels] = 0
+        
+        return combined_diff
+    
+    def _calculate_change_magnitude(self, spectral_diff: np.ndarray,
+                                    out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Calculate magnitude of changes"""
+        return np.abs(spectral_diff, out=out)
+    
+    def _calculate_change_direction(self, spectral_diff: np.ndarray,
+                                    out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Calculate direction of changes (positive/negative)"""
+        return np.sign(spectral_diff, out=out)
+    
+    def _filter_significant_changes(self, change_magnitude: np.ndarray, threshold: float,
+                                    out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Filter changes based on magnitude threshold"""
+        return np.greater(change_magnitude, threshold, out=out)
+    
+    def _classify_changes(self, image1: np.ndarray, image2: np.ndarray, 
+                         change_magnitude: np.ndarray, change_direction: np.ndarray,
+                         valid_pixels: np.ndarray,
+                         significant_changes: Optional[np.ndarray] = None,
+                         max_workers: Optional[int] = None) -> Dict:
+        """
+        Classify types of changes
+        
+        Valid, significant changes are classified by their NDVI, NDWI and
+        built-up index deltas (see ``ChangeClassifier``). Tiles run on the
+        thread pool and each is reduced to a histogram of change codes, so
+        only the per-tile histograms are merged.
+        
+        Returns:
+            Pixel count per change type
+        """
+        changes = dict.fromkeys(CHANGE_CLASSES, 0)
+        if self.classifier is None:
+            return changes
+        if max_workers is None:
+            max_workers = self.max_workers
+        if significant_changes is None:
+            threshold = self.change_thresholds.get('min_change_threshold', 0.15)
+            significant_changes = self._filter_significant_changes(change_magnitude, threshold)
+        
+        def process(window: Window) -> np.ndarray:
+            rows, cols = window.toslices()
+            mask = significant_changes[rows, cols] & valid_pixels[rows, cols]
+            return self.classifier.code_counts(image1[:, rows, cols], image2[:, rows, cols], mask)
+        
+        height, width = valid_pixels.shape
+        windows = [window for window, _ in iter_windows(width, height, self.tile_size)]
+        if max_workers > 1 and len(windows) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="classify") as pool:
+                code_counts = sum(pool.map(process, windows))
+        else:
+            code_counts = sum(process(window) for window in windows)
+        
+        changes.update(self.classifier.class_counts(code_counts))
+        return changes
+    
+    def _calculate_change_statistics(self, change_magnitude: np.ndarray, 
+                                   significant_changes: np.ndarray,
+                                   valid_pixels: np.ndarray,
+                                   magnitude_stats: Optional[RunningStatistics] = None) -> Dict:
+        """Calculate comprehensive change statistics"""
+        if magnitude_stats is None:
+            magnitude_stats = RunningStatistics().update(change_magnitude, valid_pixels)
+        
+        total_valid_pixels = magnitude_stats.count
+        total_changes = np.count_nonzero(significant_changes)
+        
+        stats = {
+            'total_pixels': int(change_magnitude.size),
+            'valid_pixels': int(total_valid_pixels),
+            'changed_pixels': int(total_changes),
+            'change_percentage': float(total_changes / total_valid_pixels * 100) if total_valid_pixels > 0 else 0,
+            'significant_change_percentage': float(total_changes / total_valid_pixels * 100) if total_valid_pixels > 0 else 0,
+            'mean_change_magnitude': float(magnitude_stats.mean),
+            'max_change_magnitude': float(magnitude_stats.max),
+            'std_change_magnitude': magnitude_stats.std,
+            'change_magnitude_histogram': magnitude_stats.histogram_dict()
+        }
+        
+        return stats
+    
+    def _normalize_image(self, image: np.ndarray) -> np.ndarray:
+        """Normalize image to 0-1 range (in place for float32 input)"""
+        if image.dtype != np.float32:
+            image = image.astype(np.float32)
+        
+        # Handle different data types (uint8, uint16, etc.)
+        max_value = image.max()
+        if max_value > 1.0:
+            image /= max_value
+        
+        return image
+    
+    def _empty_change_result(self) -> Dict:
+        """Return empty change detection result"""
+        return {
+            'change_magnitude': None,
+            'change_direction': None,
+            'significant_changes': None,
+            'change_types': dict.fromkeys(CHANGE_CLASSES, 0),
+            'statistics': {
+                'total_pixels': 0,
+                'valid_pixels': 0,
+                'changed_pixels': 0,
+                'change_percentage': 0.0,
+                'significant_change_percentage': 0.0,
+                'mean_change_magnitude': 0.0,
+                'max_change_magnitude': 0.0,
+                'std_change_magnitude': 0.0,
+                'change_magnitude_histogram': RunningStatistics().histogram_dict()
+            },
+            'valid_pixels': None,
+            'change_polygons': None,
+            'anomaly_score': None,
+            'metadata': {
+                'algorithm': 'multi-spectral_change_detection',
+                'thresholds': self.change_thresholds,
+                'bands_used': self.bands,
+                'error': 'insufficient_valid_pixels'
+            }
+        }
+
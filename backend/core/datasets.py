@@ -0,0 +1,196 @@
+"""
+Per-process pool of open raster datasets and GDAL block cache sizing
+
+Closing a dataset drops its blocks from GDAL's block cache, so a worker
+that opens the same scenes for every job re-parses their headers and
+decodes their blocks again each time. ``DatasetPool`` keeps released
+handles open for reuse instead, with their cached blocks.
+"""
+
+import ctypes
+import ctypes.util
+import glob
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+
+import rasterio
+from loguru import logger
+
+
+@lru_cache(maxsize=1)
+def _gdal_library() -> Optional[ctypes.CDLL]:
+    """The GDAL library rasterio uses, for the cache calls it does not wrap"""
+    wheel_libs = os.path.join(os.path.dirname(os.path.dirname(rasterio.__file__)), "rasterio.libs")
+    candidates = glob.glob(os.path.join(wheel_libs, "libgdal*")) or [ctypes.util.find_library("gdal")]
+    for candidate in candidates:
+        if not candidate:
+            continue
+        try:
+            library = ctypes.CDLL(candidate)
+        except OSError:
+            continue
+        library.GDALGetCacheUsed64.restype = ctypes.c_int64
+        library.GDALGetCacheMax64.restype = ctypes.c_int64
+        library.GDALSetCacheMax64.argtypes = [ctypes.c_int64]
+        return library
+    return None
+
+
+def configure_gdal_cache(config: Dict) -> Optional[int]:
+    """
+    Size GDAL's block cache from ``processing.gdal_cache_mb`` (per process).
+    Call it before the first raster is read, e.g. in Celery's
+    ``worker_process_init``. Returns the size in bytes, or None if unset.
+    """
+    cache_mb = config.get('detection', {}).get('processing', {}).get('gdal_cache_mb')
+    if cache_mb is None:
+        return None
+
+    cache_bytes = int(cache_mb) * 1024 * 1024
+    # Read by GDAL when the cache is first used...
+    os.environ["GDAL_CACHEMAX"] = f"{int(cache_mb)}MB"
+    # ...and set directly in case it already was
+    library = _gdal_library()
+    if library is not None:
+        library.GDALSetCacheMax64(cache_bytes)
+    logger.info(f"GDAL block cache set to {cache_mb} MB")
+    return cache_bytes
+
+
+def gdal_cache_stats() -> Dict:
+    """Bytes in GDAL's block cache and its limit; None where GDAL is not reachable"""
+    library = _gdal_library()
+    if library is None:
+        return {"bytes": None, "max_bytes": None}
+    return {"bytes": library.GDALGetCacheUsed64(), "max_bytes": library.GDALGetCacheMax64()}
+
+
+class DatasetPool:
+    """
+    LRU pool of open read-only rasterio datasets, keyed by path and the
+    modification time and size of the file and its external overviews, so
+    a rewritten scene is never served from a stale handle.
+
+    Rasterio datasets are not thread-safe, so a handle is used by one
+    caller at a time: ``acquire`` takes an idle handle for the path (or
+    opens a new one) and ``release`` puts it back. Up to ``max_open`` idle
+    handles stay open; the least recently released are closed first.
+    """
+
+    def __init__(self, max_open: int = 32):
+        self.max_open = max_open
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._idle: "OrderedDict[Tuple, list]" = OrderedDict()
+        self._idle_count = 0
+        self._keys: Dict[int, Tuple] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, path: str):
+        """An open dataset for ``path``; hand it back with ``release``"""
+        key = self._key(path)
+        if key is None:
+            # Not a local file (URL, /vsi path): nothing to key the pool on
+            return rasterio.open(path)
+
+        with self._lock:
+            handles = self._idle.get(key)
+            if handles:
+                dataset = handles.pop()
+                self._idle_count -= 1
+                if not handles:
+                    del self._idle[key]
+                self.hits += 1
+                self._keys[id(dataset)] = key
+                return dataset
+            self.misses += 1
+            stale = [idle_key for idle_key in self._idle if idle_key[0] == key[0]]
+            stale_handles = [dataset for idle_key in stale for dataset in self._idle.pop(idle_key)]
+            self._idle_count -= len(stale_handles)
+
+        for dataset in stale_handles:
+            dataset.close()
+        dataset = rasterio.open(path)
+        with self._lock:
+            self._keys[id(dataset)] = key
+        return dataset
+
+    def release(self, dataset):
+        """Return a dataset from ``acquire`` to the pool"""
+        with self._lock:
+            key = self._keys.pop(id(dataset), None)
+        if key is None or dataset.closed or self._key(key[0]) != key:
+            dataset.close()
+            return
+
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(key, []).append(dataset)
+            self._idle.move_to_end(key)
+            self._idle_count += 1
+            while self._idle_count > self.max_open:
+                oldest_key, handles = next(iter(self._idle.items()))
+                evicted.append(handles.pop(0))
+                if not handles:
+                    del self._idle[oldest_key]
+                self._idle_count -= 1
+                self.evictions += 1
+        for handle in evicted:
+            handle.close()
+
+    @contextmanager
+    def open(self, path: str) -> Iterator:
+        """``rasterio.open`` replacement for read-only use, backed by the pool"""
+        dataset = self.acquire(path)
+        try:
+            yield dataset
+        finally:
+            self.release(dataset)
+
+    def clear(self):
+        """Close every idle handle"""
+        with self._lock:
+            handles = [dataset for datasets in self._idle.values() for dataset in datasets]
+            self._idle.clear()
+            self._idle_count = 0
+        for dataset in handles:
+            dataset.close()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters, idle handles and GDAL block cache usage"""
+        lookups = self.hits + self.misses
+        gdal_cache = gdal_cache_stats()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "idle_handles": self._idle_count,
+            "gdal_cache_bytes": gdal_cache["bytes"],
+            "gdal_cache_max_bytes": gdal_cache["max_bytes"]
+        }
+
+    @staticmethod
+    def _key(path: str) -> Optional[Tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        try:
+            overviews = os.stat(f"{path}.ovr").st_mtime_ns
+        except OSError:
+            overviews = None
+        return path, stat.st_mtime_ns, stat.st_size, overviews
+
+
+def dataset_pool_from_config(config: Dict) -> Optional[DatasetPool]:
+    """Create the pool described by ``detection.processing.dataset_pool``, if enabled"""
+    settings = config.get('detection', {}).get('processing', {}).get('dataset_pool', {})
+    if not settings.get('enabled', False):
+        return None
+    return DatasetPool(settings.get('max_open', 32))
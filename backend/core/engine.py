@@ -1,111 +1,1147 @@
-
-import numpy as np
-import rasterio
-from rasterio.warp import reproject, Resampling
-from loguru import logger
-import cv2
-
-class ChangeDetectionEngine:
-    """
-    Core engine for performing change detection on satellite imagery.
-    Implements NDVI-based differencing and simple thresholding.
-    """
-
-    def __init__(self):
-        pass
-
-    def calculate_ndvi(self, red_band: np.ndarray, nir_band: np.ndarray) -> np.ndarray:
-        """
-        Calculate Normalized Difference Vegetation Index (NDVI).
-        NDVI = (NIR - Red) / (NIR + Red)
-        """
-        # Allow division by zero
-        np.seterr(divide='ignore', invalid='ignore')
-        
-        ndvi = (nir_band.astype(float) - red_band.astype(float)) / (nir_band.astype(float) + red_band.astype(float))
-        
-        # Fill NaN values with 0
-        ndvi = np.nan_to_num(ndvi, nan=0.0)
-        
-        return ndvi
-
-    def mask_clouds(self, image: np.ndarray, threshold: int = 200) -> np.ndarray:
-        """
-        Simple cloud masking based on brightness threshold.
-        Assumes higher values in visible bands correspond to clouds.
-        Returns a binary mask (0 for cloud, 1 for clear).
-        """
-        # Simple assumption: Clouds are bright in RGB
-        # If image has 3 bands (RGB), take mean. if single band, take it directly.
-        if len(image.shape) == 3:
-            brightness = np.mean(image, axis=0)
-        else:
-            brightness = image
-            
-        mask = brightness < threshold
-        return mask.astype(np.uint8)
-
-    def detect_changes(self, before_path: str, after_path: str, threshold: float = 0.2) -> dict:
-        """
-        Perform change detection between two images.
-        """
-        try:
-            with rasterio.open(before_path) as src_before, rasterio.open(after_path) as src_after:
-                # Read Red and NIR bands (Assuming Band 3=Red, Band 4=NIR for Sentinel-2, adjust as needed)
-                # NOTE: This implies the input images are multi-spectral.
-                # For demo purposes, we will safely try to read the first few bands.
-                
-                # Check band counts
-                if src_before.count < 3 or src_after.count < 3:
-                     raise ValueError("Input images need at least 3 bands (RGB/NIR) for accurate analysis")
-
-                # Reading bands (0-indexed read)
-                # Custom mapping: 0:Blue, 1:Green, 2:Red, 3:NIR (Example)
-                # Let's assume standard 4-band ordering or usage of kwargs to specify indices
-                
-                # Simplify: Using Red (idx 2) and Green (idx 1) for a basic vegetation index helper
-                # Ideally, we need NIR. Let's assume the user provides suitable GeoTIFFs.
-                
-                before_red = src_before.read(3) if src_before.count >= 3 else src_before.read(1)
-                before_nir = src_before.read(4) if src_before.count >= 4 else src_before.read(1) # Fallback to 1 if not 4
-                
-                after_red = src_after.read(3) if src_after.count >= 3 else src_after.read(1)
-                after_nir = src_after.read(4) if src_after.count >= 4 else src_after.read(1)
-
-                # Ensure dimensions match
-                if before_red.shape != after_red.shape:
-                    logger.warning("Dimensions mismatch, resizing after_image to match before_image")
-                    # In a real scenario, we should reproject/resample. 
-                    # For prototype, cv2 resize (lossy but fast)
-                    after_red = cv2.resize(after_red, (before_red.shape[1], before_red.shape[0]))
-                    after_nir = cv2.resize(after_nir, (before_nir.shape[1], before_nir.shape[0]))
-
-                # Calculate NDVI
-                ndvi_before = self.calculate_ndvi(before_red, before_nir)
-                ndvi_after = self.calculate_ndvi(after_red, after_nir)
-
-                # Diff
-                diff = ndvi_after - ndvi_before
-                
-                # Thresholding for change
-                # Positive change (growth) vs Negative change (loss)
-                # We care about magnitude
-                change_mask = np.abs(diff) > threshold
-                
-                change_pixels = np.count_nonzero(change_mask)
-                total_pixels = change_mask.size
-                change_percentage = (change_pixels / total_pixels) * 100
-
-                return {
-                    "status": "success",
-                    "change_percentage": change_percentage,
-                    "change_mask_shape": change_mask.shape,
-                    "ndvi_before_mean": float(np.mean(ndvi_before)),
-                    "ndvi_after_mean": float(np.mean(ndvi_after))
-                }
-
-        except Exception as e:
-            logger.error(f"Error in change detection: {e}")
-            return {"status": "error", "message": str(e)}
-
-engine = ChangeDetectionEngine()
+import math
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, rasterize
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from loguru import logger
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from config.settings import get_settings
+from core.alignment import (
+    AlignedGrid, GridReader, common_grid, crop_grid, geometry_bounds, geometry_to_crs
+)
+from core.baseline import Baseline, baseline_store_from_config
+from core.datasets import dataset_pool_from_config
+from core.ndvi import NDVIDifferenceKernel, ndvi_into
+from core.ndvi_cache import ndvi_cache_from_config
+from core.statistics import ChangeAccumulator, LabelAccumulator
+from core.tile_index import TileIndex
+from core.tiling import block_aligned_tile_shape, iter_windows
+from core.timeseries import HarmonicAnalyzer, write_netcdf
+from core.vectorize import raster_window_reader, vectorizer_from_config
+
+class ChangeDetectionEngine:
+    """
+    Core engine for performing change detection on satellite imagery.
+    Implements NDVI-based differencing and simple thresholding.
+    """
+
+    def __init__(self, config: Optional[Dict] = None):
+        self.config = config or {}
+        processing = self.config.get('detection', {}).get('processing', {})
+        self.tile_size = processing.get('tile_size', 512)
+        # NDVI differencing is per-pixel, so the halo is only used by
+        # neighbourhood operations; streamed statistics count tile cores only.
+        self.overlap = processing.get('overlap', 64)
+        self.streaming = processing.get('streaming', True)
+        self.max_workers = processing.get('max_workers', 4)
+        self.pyramid = processing.get('pyramid', {})
+        self.scatter = processing.get('scatter', {})
+        self.skip_cloudy_tiles = self.config.get('detection', {}).get('tile_index', {}).get('skip_cloudy', True)
+        self._local = threading.local()
+        self.ndvi_cache = ndvi_cache_from_config(self.config)
+        self.datasets = dataset_pool_from_config(self.config)
+        self.baseline_store = baseline_store_from_config(self.config)
+        baseline = self.config.get('detection', {}).get('baseline', {})
+        self.baseline_z_threshold = baseline.get('z_threshold', 3.0)
+        self.baseline_min_ndvi_change = baseline.get('min_ndvi_change', 0.1)
+        self.baseline_min_scenes = baseline.get('min_scenes', 3)
+        self.timeseries = self.config.get('detection', {}).get('timeseries', {})
+        self.seasonal_filter = self.config.get('detection', {}).get('change', {}).get('seasonal_filter', True)
+
+    def calculate_ndvi(self, red_band: np.ndarray, nir_band: np.ndarray) -> np.ndarray:
+        """
+        Calculate Normalized Difference Vegetation Index (NDVI).
+        NDVI = (NIR - Red) / (NIR + Red)
+        Computed in float32; pixels where NIR + Red == 0 are set to 0.
+        """
+        red = red_band.astype(np.float32)
+        nir = nir_band.astype(np.float32)
+
+        # NDVI is written over the float32 copy of the red band
+        return ndvi_into(red, nir, out=red, denom=np.empty_like(nir))
+
+    def mask_clouds(self, image: np.ndarray, threshold: int = 200) -> np.ndarray:
+        """
+        Simple cloud masking based on brightness threshold.
+        Assumes higher values in visible bands correspond to clouds.
+        Returns a binary mask (0 for cloud, 1 for clear).
+        """
+        # Simple assumption: Clouds are bright in RGB
+        # If image has 3 bands (RGB), take mean. if single band, take it directly.
+        if len(image.shape) == 3:
+            brightness = np.mean(image, axis=0)
+        else:
+            brightness = image
+            
+        mask = brightness < threshold
+        return mask.astype(np.uint8)
+
+    def detect_changes(self, before_path: str, after_path: str, threshold: float = 0.2,
+                       streaming: Optional[bool] = None, mask_path: Optional[str] = None,
+                       max_workers: Optional[int] = None, aoi_geometry=None,
+                       aoi_crs: str = "EPSG:4326", polygons_path: Optional[str] = None,
+                       pyramid: Optional[bool] = None,
+                       tile_indexes: Optional[Dict[str, TileIndex]] = None) -> dict:
+        """
+        Perform change detection between two images.
+
+        If ``aoi_geometry`` (a shapely geometry or GeoJSON mapping in
+        ``aoi_crs``) is given, only the window covering its bounding box is
+        read and pixels outside the polygon are excluded from the statistics.
+
+        Both scenes are read on their common grid: the intersection of their
+        footprints on the before scene's pixel grid. A scene on a different
+        grid is resampled on the fly through a WarpedVRT, so only overlapping
+        blocks are decoded.
+
+        In streaming mode (the default, see ``processing.streaming``) the grid
+        is processed window by window, so peak memory depends on ``tile_size``
+        rather than scene size. Windows are spread over ``max_workers`` threads
+        (default ``processing.max_workers``). If ``mask_path`` is given the
+        change mask is written there as a uint8 GeoTIFF, one window at a time.
+
+        If ``polygons_path`` is given the change mask is also vectorized into a
+        GeoJSON FeatureCollection in ``aoi_crs`` (see ``detection.vectorize``
+        for the minimum mapping unit and simplification tolerance).
+
+        With ``pyramid`` (default ``processing.pyramid.enabled``) every tile
+        is first scored on a decimated read, served from the scenes'
+        overviews (see ``core.ingest.build_overviews``), and only tiles whose
+        coarse NDVI change comes within ``processing.pyramid.margin`` of
+        ``threshold`` are processed at full resolution. The result reports
+        the pixels and tiles processed and skipped.
+
+        Pixels without data in either scene are left out of the statistics.
+        ``tile_indexes`` maps scene paths to their ingest-time ``TileIndex``;
+        windows either scene has no data for are skipped unread, which does
+        not change the result.
+        """
+        if streaming is None:
+            streaming = self.streaming
+        if max_workers is None:
+            max_workers = self.max_workers
+        if pyramid is None:
+            pyramid = self.pyramid.get('enabled', False)
+
+        try:
+            with self._open_dataset(before_path) as src_before, self._open_dataset(after_path) as src_after:
+                grid, aoi_shapes = self._pair_grid(src_before, src_after, aoi_geometry, aoi_crs)
+                readers = (GridReader(src_before, grid), GridReader(src_after, grid))
+                try:
+                    if readers[1].warped:
+                        logger.info(f"Scenes differ in grid, warping after_image onto {grid}")
+                    return self._detect_changes_on_grid(
+                        readers, (before_path, after_path), grid, threshold,
+                        mask_path, max_workers, streaming, aoi_shapes,
+                        polygons_path, aoi_crs, pyramid,
+                        self._scene_indexes(tile_indexes, (before_path, after_path))
+                    )
+                finally:
+                    for reader in readers:
+                        reader.close()
+
+        except Exception as e:
+            logger.error(f"Error in change detection: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def plan_detection(self, before_path: str, after_path: str, aoi_geometry=None,
+                       aoi_crs: str = "EPSG:4326", tiles_per_part: Optional[int] = None) -> dict:
+        """
+        Split ``detect_changes`` of a scene pair into independent parts for
+        scatter/gather execution across processes or machines.
+
+        Parts are bands of whole tile rows holding about ``tiles_per_part``
+        tiles (default ``processing.scatter.tiles_per_task``), so every part
+        processes exactly the windows a single streaming run would and the
+        merged result matches it. Run the parts with ``detect_changes_part``
+        and combine them with ``merge_detection_parts``.
+
+        Returns:
+            JSON-friendly dict with the grid ``shape``, ``crs`` and
+            ``transform`` and the ``row_ranges`` ([start, stop) grid rows)
+            of the parts
+        """
+        if tiles_per_part is None:
+            tiles_per_part = self.scatter.get('tiles_per_task', 16)
+
+        try:
+            with self._open_dataset(before_path) as src_before, self._open_dataset(after_path) as src_after:
+                grid, _ = self._pair_grid(src_before, src_after, aoi_geometry, aoi_crs)
+                # The before scene is on the grid's pixels, so this reader never warps
+                tile_width, tile_height = block_aligned_tile_shape(GridReader(src_before, grid), self.tile_size)
+
+            tiles_per_row = math.ceil(grid.width / tile_width)
+            rows_per_part = max(1, tiles_per_part // tiles_per_row) * tile_height
+            return {
+                "status": "success",
+                "shape": grid.shape,
+                "crs": grid.crs.to_string(),
+                "transform": list(grid.transform)[:6],
+                "row_ranges": [
+                    [start, min(start + rows_per_part, grid.height)]
+                    for start in range(0, grid.height, rows_per_part)
+                ]
+            }
+
+        except Exception as e:
+            logger.error(f"Error planning change detection: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def detect_changes_part(self, before_path: str, after_path: str, rows: Tuple[int, int],
+                            threshold: float = 0.2, mask_path: Optional[str] = None,
+                            max_workers: Optional[int] = None, aoi_geometry=None,
+                            aoi_crs: str = "EPSG:4326", pyramid: Optional[bool] = None,
+                            tile_indexes: Optional[Dict[str, TileIndex]] = None) -> dict:
+        """
+        Run one part of a plan from ``plan_detection``: the tile rows in
+        ``rows`` of the grid ``detect_changes`` would use for the same
+        scenes and AOI. Parts always stream; the other arguments are those
+        of ``detect_changes``. If ``mask_path`` is given the change mask of
+        these rows is written there.
+
+        Returns:
+            Partial result for ``merge_detection_parts``: the raw statistics
+            and tile counts of the rows
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        if pyramid is None:
+            pyramid = self.pyramid.get('enabled', False)
+        paths = (before_path, after_path)
+
+        try:
+            with self._open_dataset(before_path) as src_before, self._open_dataset(after_path) as src_after:
+                grid, aoi_shapes = self._pair_grid(src_before, src_after, aoi_geometry, aoi_crs)
+                readers = (GridReader(src_before, grid), GridReader(src_after, grid))
+                try:
+                    part = self._scan_grid(
+                        readers, paths, grid, threshold, mask_path, max_workers,
+                        aoi_shapes=aoi_shapes, pyramid=pyramid,
+                        scene_indexes=self._scene_indexes(tile_indexes, paths), rows=tuple(rows)
+                    )
+                finally:
+                    for reader in readers:
+                        reader.close()
+
+            part["status"] = "success"
+            if mask_path:
+                part["mask_path"] = mask_path
+            return part
+
+        except Exception as e:
+            logger.error(f"Error in change detection of rows {rows}: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def merge_detection_parts(self, plan: Dict, parts: List[Dict], mask_path: Optional[str] = None,
+                              polygons_path: Optional[str] = None,
+                              polygons_crs: str = "EPSG:4326") -> dict:
+        """
+        Combine the results of ``detect_changes_part`` into the result
+        ``detect_changes`` returns for the whole plan.
+
+        Statistics are merged from the parts' raw totals. If ``mask_path``
+        or ``polygons_path`` is given, every part must have written its
+        mask; the part masks are mosaicked into one mask on the plan's grid
+        (and removed), which is then vectorized like in ``detect_changes``.
+        """
+        part_masks = [part["mask_path"] for part in parts if part.get("mask_path")]
+        try:
+            failed = [part for part in parts if part.get("status") != "success"]
+            if failed:
+                raise ValueError(f"{len(failed)} of {len(parts)} parts failed, first: "
+                                 f"{failed[0].get('message') or failed[0].get('error')}")
+
+            output_mask_path = mask_path
+            if polygons_path and not mask_path:
+                output_mask_path = f"{polygons_path}.mask.tif"
+            if output_mask_path:
+                if len(part_masks) != len(parts):
+                    raise ValueError("A change mask was requested but not every part wrote one")
+                height, width = plan["shape"]
+                grid = AlignedGrid(plan["crs"], Affine(*plan["transform"]), width, height)
+                self._mosaic_masks(output_mask_path, grid, parts)
+
+            return self._change_result(plan["shape"], parts, mask_path, output_mask_path,
+                                       polygons_path, polygons_crs)
+
+        except Exception as e:
+            logger.error(f"Error merging change detection parts: {e}")
+            return {"status": "error", "message": str(e)}
+        finally:
+            for path in part_masks:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def detect_changes_batch(self, before_path: str, after_path: str, aois: Dict[str, object],
+                             threshold: float = 0.2, aoi_crs: str = "EPSG:4326",
+                             max_workers: Optional[int] = None,
+                             tile_indexes: Optional[Dict[str, TileIndex]] = None) -> dict:
+        """
+        Perform change detection for many AOIs over one scene pair.
+
+        The pair is read once, over the window covering all AOIs that
+        intersect it. Per window the AOIs are rasterized into label rasters
+        and reduced with ``np.bincount``, so the cost scales with the area
+        read rather than with the number of AOIs. Overlapping AOIs are put
+        on separate label layers so every AOI sees all of its pixels.
+
+        Args:
+            aois: Mapping of AOI id to geometry (shapely or GeoJSON mapping)
+            tile_indexes: Scene path to ``TileIndex``, to skip invalid windows
+
+        Returns:
+            Dict with a per-AOI ``results`` mapping in the same format as
+            ``detect_changes`` and the ids of ``skipped`` AOIs that do not
+            intersect the scenes.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        try:
+            with self._open_dataset(before_path) as src_before, self._open_dataset(after_path) as src_after:
+                if src_before.count < 3 or src_after.count < 3:
+                     raise ValueError("Input images need at least 3 bands (RGB/NIR) for accurate analysis")
+
+                grid = common_grid(src_before, src_after)
+
+                aoi_ids, shapes, skipped = [], [], []
+                for aoi_id, geometry in aois.items():
+                    shape = geometry_to_crs(geometry, aoi_crs, grid.crs)
+                    try:
+                        crop_grid(grid, shape)
+                    except ValueError:
+                        skipped.append(aoi_id)
+                        continue
+                    aoi_ids.append(aoi_id)
+                    shapes.append(shape)
+
+                if not shapes:
+                    return {"status": "success", "results": {}, "skipped": skipped}
+
+                grid = crop_grid(grid, {"type": "GeometryCollection", "geometries": shapes})
+                bounds = np.array([geometry_bounds(shape) for shape in shapes])
+                layers = self._label_layers(bounds)
+                logger.info(f"Batch detection for {len(shapes)} AOIs in {len(layers)} label layer(s) over {grid}")
+
+                readers = (GridReader(src_before, grid), GridReader(src_after, grid))
+                try:
+                    accumulator = LabelAccumulator(len(shapes))
+                    tile_width, tile_height = block_aligned_tile_shape(readers[0], self.tile_size)
+                    windows = (window for window, _ in iter_windows(grid.width, grid.height, tile_width, tile_height))
+                    windows = self._usable_windows(
+                        windows, self._scene_indexes(tile_indexes, (before_path, after_path)), grid,
+                        skip_cloudy=False
+                    )
+                    process = partial(self._process_window_labels, threshold=threshold,
+                                      grid=grid, shapes=shapes, bounds=bounds, layers=layers)
+
+                    for _, window_stats in self._iter_window_results(
+                        readers, (before_path, after_path), grid, windows, max_workers, process
+                    ):
+                        if window_stats is not None:
+                            accumulator.merge(window_stats)
+                finally:
+                    for reader in readers:
+                        reader.close()
+
+                return {
+                    "status": "success",
+                    "results": {
+                        aoi_id: dict(accumulator.label_result(label), status="success")
+                        for label, aoi_id in enumerate(aoi_ids, start=1)
+                    },
+                    "skipped": skipped
+                }
+
+        except Exception as e:
+            logger.error(f"Error in batch change detection: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def detect_changes_baseline(self, image_path: str, aoi_id: str, aoi_geometry=None,
+                                aoi_crs: str = "EPSG:4326", update: bool = True,
+                                mask_path: Optional[str] = None,
+                                max_workers: Optional[int] = None,
+                                tile_indexes: Optional[Dict[str, TileIndex]] = None) -> dict:
+        """
+        Score a new scene against the AOI's rolling NDVI baseline, then fold
+        it into the baseline.
+
+        Only the new scene is read, once, window by window: each window is
+        scored against the stored running mean, variance and median and then
+        used to update them, so a run costs O(AOI pixels) no matter how many
+        scenes the baseline holds. The first scene of an AOI fixes the
+        baseline grid (its own pixel grid cropped to the AOI); later scenes
+        are warped onto it. A scene already in the baseline is scored but
+        not counted again. Pixels are scored once the baseline has
+        ``detection.baseline.min_scenes`` observations of them. Windows the
+        scene's ``TileIndex`` (in ``tile_indexes``) rules out are skipped.
+
+        Returns:
+            Dict in the format of ``detect_changes``, where "before" is the
+            baseline mean, plus ``baseline_scenes`` and ``baseline_updated``
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        try:
+            with self.baseline_store.lock(aoi_id), self._open_dataset(image_path) as src:
+                if src.count < 3:
+                    raise ValueError("Input images need at least 3 bands (RGB/NIR) for accurate analysis")
+
+                baseline = self.baseline_store.open(aoi_id)
+                if baseline is None:
+                    grid = AlignedGrid(src.crs, src.transform, src.width, src.height)
+                    if aoi_geometry is not None:
+                        grid = crop_grid(grid, geometry_to_crs(aoi_geometry, aoi_crs, grid.crs))
+                    baseline = self.baseline_store.create(aoi_id, grid)
+                    logger.info(f"Created NDVI baseline for AOI {aoi_id} on {grid}")
+                grid = baseline.grid
+
+                aoi_shapes = None
+                if aoi_geometry is not None:
+                    aoi_shapes = [geometry_to_crs(aoi_geometry, aoi_crs, grid.crs)]
+
+                scene_id = self.baseline_store.scene_id(image_path)
+                update = update and not baseline.has_scene(scene_id)
+                if update:
+                    baseline.stage()
+
+                reader = GridReader(src, grid)
+                accumulator = ChangeAccumulator()
+                mask_dst = None
+                try:
+                    tile_width, tile_height = block_aligned_tile_shape(reader, self.tile_size)
+                    if mask_path:
+                        mask_dst = self._open_mask_output(mask_path, grid, tile_width, tile_height)
+                    windows = (window for window, _ in iter_windows(grid.width, grid.height, tile_width, tile_height))
+                    windows = self._usable_windows(
+                        windows, self._scene_indexes(tile_indexes, (image_path,)), grid
+                    )
+                    process = partial(self._process_baseline_window, baseline=baseline, grid=grid,
+                                      aoi_shapes=aoi_shapes, update=update)
+
+                    for window, (window_stats, change_mask) in self._iter_window_results(
+                        (reader,), (image_path,), grid, windows, max_workers, process
+                    ):
+                        accumulator.merge(window_stats)
+                        if mask_dst is not None:
+                            mask_dst.write(change_mask.astype(np.uint8), 1, window=window)
+                finally:
+                    reader.close()
+                    if mask_dst is not None:
+                        mask_dst.close()
+
+                if update:
+                    baseline.commit(scene_id)
+                baseline.close()
+
+            result = {
+                "status": "success",
+                "change_percentage": accumulator.change_percentage,
+                "change_mask_shape": grid.shape,
+                "ndvi_before_mean": accumulator.ndvi_before_mean,
+                "ndvi_after_mean": accumulator.ndvi_after_mean,
+                "pixels_analyzed": accumulator.total_pixels,
+                "baseline_scenes": baseline.n_scenes,
+                "baseline_updated": update
+            }
+            if mask_path:
+                result["change_mask_path"] = mask_path
+            return result
+
+        except Exception as e:
+            logger.error(f"Error in baseline change detection: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def _process_baseline_window(self, readers, window: Window, kernel: NDVIDifferenceKernel,
+                                 baseline: Baseline, grid: AlignedGrid,
+                                 aoi_shapes: Optional[List[Dict]] = None,
+                                 update: bool = True) -> Tuple[ChangeAccumulator, np.ndarray]:
+        """Score one window of a scene against the baseline and optionally update it"""
+        shape = (int(window.height), int(window.width))
+
+        ndvi, valid = self._window_ndvi(kernel, "after", readers[0], window, shape)
+        if aoi_shapes:
+            valid &= geometry_mask(aoi_shapes, out_shape=shape, invert=True,
+                                   transform=window_transform(window, grid.transform))
+        if not valid.any():
+            return ChangeAccumulator(), np.zeros(shape, dtype=bool)
+
+        window_stats, change_mask = baseline.score(
+            window, ndvi, valid, self.baseline_min_scenes,
+            self.baseline_z_threshold, self.baseline_min_ndvi_change
+        )
+        if update:
+            baseline.update(window, ndvi, valid)
+        return window_stats, change_mask
+
+    def analyze_time_series(self, scenes: List[Tuple[datetime, str]], aoi_geometry=None,
+                            aoi_crs: str = "EPSG:4326", output_path: Optional[str] = None,
+                            max_workers: Optional[int] = None,
+                            tile_indexes: Optional[Dict[str, TileIndex]] = None) -> dict:
+        """
+        Per-pixel trend, seasonality and breakpoint analysis over N scenes.
+
+        The scenes form a (date, y, x) NDVI cube on the first scene's grid
+        (cropped to the AOI; other scenes are warped onto it). The cube is
+        never materialized: it is read in spatial chunks of
+        ``timeseries.chunk_size`` pixels, each chunk holding every date, and
+        chunks are fitted on the worker threads (see ``HarmonicAnalyzer``),
+        so memory depends on the chunk size times the number of dates.
+
+        With ``change.seasonal_filter`` the model includes
+        ``timeseries.harmonics`` annual harmonics, so seasonal NDVI cycles
+        are not reported as change; without it only a linear trend is
+        removed.
+
+        Chunks a scene's ``TileIndex`` (in ``tile_indexes``) rules out are
+        not read for that date; they count as gaps in the series.
+
+        Args:
+            scenes: (acquisition date, image path) pairs
+            output_path: Optional netCDF file for the per-pixel rasters
+            tile_indexes: Scene path to ``TileIndex``
+
+        Returns:
+            Summary dict with ``change_percentage``, ``trend_mean`` (NDVI per
+            year) and the number of pixels breaking at each date
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+
+        try:
+            scenes = sorted(scenes)
+            dates = [date for date, _ in scenes]
+            paths = tuple(path for _, path in scenes)
+            analyzer = HarmonicAnalyzer(
+                dates,
+                harmonics=self.timeseries.get('harmonics', 2) if self.seasonal_filter else 0,
+                breakpoint_critical=self.timeseries.get('breakpoint_critical', 1.36),
+                anomaly_z=self.timeseries.get('anomaly_z', 3.0)
+            )
+            # Fewer dates than the model needs would leave every pixel unfitted
+            min_dates = max(self.timeseries.get('min_dates', 8), analyzer.min_observations)
+            if len(scenes) < min_dates:
+                raise ValueError(f"Time-series analysis needs at least {min_dates} scenes, got {len(scenes)}")
+
+            with ExitStack() as stack:
+                sources = [stack.enter_context(self._open_dataset(path)) for path in paths]
+                if any(src.count < 3 for src in sources):
+                    raise ValueError("Input images need at least 3 bands (RGB/NIR) for accurate analysis")
+
+                first = sources[0]
+                grid = AlignedGrid(first.crs, first.transform, first.width, first.height)
+                aoi_shapes = None
+                if aoi_geometry is not None:
+                    aoi_shapes = [geometry_to_crs(aoi_geometry, aoi_crs, grid.crs)]
+                    grid = crop_grid(grid, aoi_shapes[0])
+                logger.info(f"Time-series analysis of {len(paths)} scenes over {grid}")
+
+                readers = tuple(GridReader(src, grid) for src in sources)
+                for reader in readers:
+                    stack.callback(reader.close)
+
+                outputs = analyzer.empty_outputs(grid.shape)
+                chunk_size = self.timeseries.get('chunk_size', 256)
+                windows = (window for window, _ in iter_windows(grid.width, grid.height, chunk_size))
+                process = partial(self._process_time_series_window, analyzer=analyzer,
+                                  grid=grid, aoi_shapes=aoi_shapes,
+                                  scene_indexes=self._scene_indexes(tile_indexes, paths))
+
+                for window, chunk in self._iter_window_results(
+                    readers, paths, grid, windows, max_workers, process
+                ):
+                    if chunk is None:
+                        continue
+                    for name, values in chunk.items():
+                        outputs[name][window.toslices()] = values
+
+            fitted = ~np.isnan(outputs["trend"])
+            pixels = int(np.count_nonzero(fitted))
+            if not pixels:
+                raise ValueError(
+                    f"No pixel has the {analyzer.min_observations} valid dates needed to fit the model"
+                )
+            breaks = np.bincount(outputs["breakpoint"][outputs["breakpoint"] >= 0], minlength=len(dates))
+            result = {
+                "status": "success",
+                "dates": [date.isoformat() for date in dates],
+                "seasonal_filter": self.seasonal_filter,
+                "pixels_analyzed": pixels,
+                "change_percentage": float(np.count_nonzero(outputs["change"]) / pixels * 100),
+                "trend_mean": float(np.mean(outputs["trend"][fitted])),
+                "breakpoints_by_date": {
+                    date.isoformat(): int(count) for date, count in zip(dates, breaks) if count
+                }
+            }
+
+            if output_path:
+                write_netcdf(output_path, outputs, dates, grid.transform, grid.crs,
+                             attrs={"harmonics": analyzer.harmonics})
+                result["output_path"] = output_path
+            return result
+
+        except Exception as e:
+            logger.error(f"Error in time-series analysis: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def _process_time_series_window(self, readers, window: Window, kernel: NDVIDifferenceKernel,
+                                    analyzer: HarmonicAnalyzer, grid: AlignedGrid,
+                                    aoi_shapes: Optional[List[Dict]] = None,
+                                    scene_indexes: Optional[List[Optional[TileIndex]]] = None) -> Optional[Dict[str, np.ndarray]]:
+        """Read one chunk of every date into a (date, y, x) NDVI cube and fit it"""
+        shape = (int(window.height), int(window.width))
+
+        usable = [True] * len(readers)
+        if scene_indexes:
+            usable = [self._window_usable(index, grid, window) for index in scene_indexes]
+            if not any(usable):
+                return None
+
+        outside = None
+        if aoi_shapes:
+            outside = geometry_mask(aoi_shapes, out_shape=shape,
+                                    transform=window_transform(window, grid.transform))
+            if outside.all():
+                return None
+
+        cube = np.empty((len(readers),) + shape, dtype=np.float32)
+        for index, reader in enumerate(readers):
+            if not usable[index]:
+                cube[index] = np.nan
+                continue
+            ndvi, valid = self._window_ndvi(kernel, "after", reader, window, shape)
+            np.copyto(cube[index], ndvi)
+            np.copyto(cube[index], np.nan, where=~valid)
+        if outside is not None:
+            cube[:, outside] = np.nan
+
+        return analyzer.analyze(cube)
+
+    def _label_layers(self, bounds: np.ndarray) -> List[List[int]]:
+        """
+        Greedily group AOI indexes into layers whose bounding boxes do not
+        overlap, so each layer can be burned into a single label raster.
+        """
+        layers, layer_bounds = [], []
+
+        for index, box in enumerate(bounds):
+            for layer, members in zip(layers, layer_bounds):
+                other = np.asarray(members)
+                overlaps = ((other[:, 0] < box[2]) & (box[0] < other[:, 2]) &
+                            (other[:, 1] < box[3]) & (box[1] < other[:, 3]))
+                if not overlaps.any():
+                    layer.append(index)
+                    members.append(box)
+                    break
+            else:
+                layers.append([index])
+                layer_bounds.append([box])
+        return layers
+
+    def _process_window_labels(self, readers, window: Window, kernel: NDVIDifferenceKernel,
+                               threshold: float, grid: AlignedGrid, shapes: List[Dict],
+                               bounds: np.ndarray, layers: List[List[int]]) -> Optional[LabelAccumulator]:
+        """Per-AOI statistics for one window; None if no AOI touches it"""
+        shape = (int(window.height), int(window.width))
+        transform = window_transform(window, grid.transform)
+
+        # Only AOIs whose bounding box touches this window are rasterized
+        left, bottom, right, top = window_bounds(window, grid.transform)
+        touching = ((bounds[:, 0] < right) & (left < bounds[:, 2]) &
+                    (bounds[:, 1] < top) & (bottom < bounds[:, 3]))
+
+        label_rasters = []
+        for layer in layers:
+            members = [index for index in layer if touching[index]]
+            if not members:
+                continue
+            labels = rasterize(
+                ((shapes[index], index + 1) for index in members),
+                out_shape=shape, transform=transform, fill=0, dtype="int32"
+            )
+            if labels.any():
+                label_rasters.append(labels)
+        if not label_rasters:
+            return None
+
+        ndvi_before, valid_before = self._window_ndvi(kernel, "before", readers[0], window, shape)
+        ndvi_after, valid_after = self._window_ndvi(kernel, "after", readers[1], window, shape)
+        change_mask = kernel.change_mask(ndvi_before, ndvi_after, threshold)
+        invalid = ~self._valid_pixels(kernel, valid_before, valid_after)
+
+        window_stats = LabelAccumulator(len(shapes))
+        for labels in label_rasters:
+            labels[invalid] = 0
+            window_stats.update(labels, ndvi_before, ndvi_after, change_mask)
+        return window_stats
+
+    def _detect_changes_on_grid(self, readers, paths: Tuple[str, str], grid: AlignedGrid,
+                                threshold: float, mask_path: Optional[str] = None,
+                                max_workers: int = 1, streaming: bool = True,
+                                aoi_shapes: Optional[List[Dict]] = None,
+                                polygons_path: Optional[str] = None,
+                                polygons_crs: str = "EPSG:4326",
+                                pyramid: bool = False,
+                                scene_indexes: Optional[List[Optional[TileIndex]]] = None) -> dict:
+        """
+        Tile-by-tile change detection over the common grid. Only a few windows
+        of each band are held in memory at a time; per-window statistics are
+        merged as windows complete. Without streaming the grid is one window.
+        ``aoi_shapes`` (in the grid CRS) are rasterized per window to mask
+        statistics to the AOI. Polygons are vectorized from the written mask,
+        which is kept in a temporary file when no ``mask_path`` was asked for.
+        With ``pyramid`` tiles are pruned on their coarse change score first.
+        Windows the ``scene_indexes`` rule out are not read at all.
+        """
+        output_mask_path = mask_path
+        if polygons_path and not mask_path:
+            output_mask_path = f"{polygons_path}.mask.tif"
+
+        part = self._scan_grid(readers, paths, grid, threshold, output_mask_path, max_workers,
+                               streaming, aoi_shapes, pyramid, scene_indexes)
+        result = self._change_result(grid.shape, [part], mask_path, output_mask_path,
+                                     polygons_path, polygons_crs)
+        if self.ndvi_cache is not None:
+            result["ndvi_cache"] = self.ndvi_cache.stats()
+        if self.datasets is not None:
+            result["dataset_pool"] = self.datasets.stats()
+        return result
+
+    def _scan_grid(self, readers, paths: Tuple[str, str], grid: AlignedGrid, threshold: float,
+                   mask_path: Optional[str] = None, max_workers: int = 1, streaming: bool = True,
+                   aoi_shapes: Optional[List[Dict]] = None, pyramid: bool = False,
+                   scene_indexes: Optional[List[Optional[TileIndex]]] = None,
+                   rows: Optional[Tuple[int, int]] = None) -> Dict:
+        """
+        Process the windows of the grid and return their merged statistics
+        and tile counts as a JSON-friendly partial result. With ``rows`` only
+        the grid rows in [start, stop) are processed (start must be a
+        multiple of the tile height) and ``mask_path`` covers just those rows.
+        """
+        if streaming:
+            tile_width, tile_height = block_aligned_tile_shape(readers[0], self.tile_size)
+        else:
+            tile_width, tile_height, max_workers = grid.width, grid.height, 1
+        row_start, row_stop = rows or (0, grid.height)
+
+        accumulator = ChangeAccumulator()
+        mask_dst = None
+        if mask_path:
+            mask_grid = AlignedGrid(grid.crs, grid.transform * Affine.translation(0, row_start),
+                                    grid.width, row_stop - row_start)
+            mask_dst = self._open_mask_output(mask_path, mask_grid, tile_width,
+                                              min(tile_height, mask_grid.height))
+
+        windows = (window for window, _ in iter_windows(grid.width, row_stop - row_start,
+                                                        tile_width, tile_height, row_off=row_start))
+        # Only nodata windows are skipped: change detection does not mask
+        # clouds, so cloudy pixels are valid here
+        invalid = []
+        windows = self._usable_windows(windows, scene_indexes, grid, invalid, skip_cloudy=False)
+        process = partial(self._process_window, threshold=threshold, keep_mask=mask_dst is not None,
+                          grid=grid, aoi_shapes=aoi_shapes)
+        if pyramid:
+            factor = self.pyramid.get('factor', 8)
+            if not any(reader.src.overviews(1) for reader in readers):
+                logger.info("Scenes have no overviews; coarse reads decimate the full-resolution data")
+            process = partial(self._process_window_pyramid, process=process, threshold=threshold,
+                              factor=factor, margin=self.pyramid.get('margin', 0.1),
+                              grid=grid, aoi_shapes=aoi_shapes)
+
+        tiles = tiles_skipped = 0
+        try:
+            for window, (window_stats, change_mask) in self._iter_window_results(
+                readers, paths, grid, windows, max_workers, process, reuse_kernel=streaming
+            ):
+                accumulator.merge(window_stats)
+                if window_stats.total_pixels:
+                    tiles += 1
+                    tiles_skipped += window_stats.skipped_pixels > 0
+
+                if mask_dst is not None:
+                    mask_window = Window(window.col_off, window.row_off - row_start, window.width, window.height)
+                    mask_dst.write(change_mask, 1, window=mask_window)
+        finally:
+            if mask_dst is not None:
+                mask_dst.close()
+
+        part = {
+            "rows": [row_start, row_stop],
+            "statistics": accumulator.to_dict(),
+            "pyramid": pyramid,
+            "tiles": tiles,
+            "tiles_skipped": tiles_skipped
+        }
+        if scene_indexes and any(scene_indexes):
+            part["tiles_invalid"] = len(invalid)
+        return part
+
+    def _change_result(self, shape: Tuple[int, int], parts: List[Dict], mask_path: Optional[str] = None,
+                       output_mask_path: Optional[str] = None, polygons_path: Optional[str] = None,
+                       polygons_crs: str = "EPSG:4326") -> dict:
+        """
+        The ``detect_changes`` result for a grid from the partial results of
+        ``_scan_grid``. Polygons are vectorized from ``output_mask_path``,
+        which is removed afterwards unless it is ``mask_path``.
+        """
+        accumulator = ChangeAccumulator()
+        for part in parts:
+            accumulator.merge(ChangeAccumulator.from_dict(part["statistics"]))
+
+        result = {
+            "status": "success",
+            "change_percentage": accumulator.change_percentage,
+            "change_mask_shape": tuple(shape),
+            "ndvi_before_mean": accumulator.ndvi_before_mean,
+            "ndvi_after_mean": accumulator.ndvi_after_mean,
+            "pixels_analyzed": accumulator.total_pixels
+        }
+        if any(part["pyramid"] for part in parts):
+            tiles = sum(part["tiles"] for part in parts)
+            tiles_skipped = sum(part["tiles_skipped"] for part in parts)
+            result.update({
+                "pixels_processed": accumulator.total_pixels - accumulator.skipped_pixels,
+                "pixels_skipped": accumulator.skipped_pixels,
+                "tiles_processed": tiles - tiles_skipped,
+                "tiles_skipped": tiles_skipped
+            })
+        if any("tiles_invalid" in part for part in parts):
+            result["tiles_invalid"] = sum(part.get("tiles_invalid", 0) for part in parts)
+        if mask_path:
+            result["change_mask_path"] = mask_path
+        if polygons_path:
+            try:
+                result["change_polygons"] = self._vectorize_mask(
+                    output_mask_path, polygons_path, polygons_crs
+                )
+            finally:
+                if output_mask_path != mask_path and os.path.exists(output_mask_path):
+                    os.remove(output_mask_path)
+        return result
+
+    def _pair_grid(self, src_before, src_after, aoi_geometry=None,
+                   aoi_crs: str = "EPSG:4326") -> Tuple[AlignedGrid, Optional[List[Dict]]]:
+        """Common grid of a scene pair, cropped to the AOI, and the AOI shapes in its CRS"""
+        # Read Red and NIR bands (Assuming Band 3=Red, Band 4=NIR for Sentinel-2, adjust as needed)
+        # NOTE: This implies the input images are multi-spectral.
+        if src_before.count < 3 or src_after.count < 3:
+             raise ValueError("Input images need at least 3 bands (RGB/NIR) for accurate analysis")
+
+        grid = common_grid(src_before, src_after)
+        aoi_shapes = None
+        if aoi_geometry is not None:
+            aoi_shapes = [geometry_to_crs(aoi_geometry, aoi_crs, grid.crs)]
+            grid = crop_grid(grid, aoi_shapes[0])
+            logger.info(f"Restricting detection to the AOI window {grid}")
+        return grid, aoi_shapes
+
+    def _mosaic_masks(self, mask_path: str, grid: AlignedGrid, parts: List[Dict]):
+        """Copy the row-band change masks of ``parts`` into one mask on the grid"""
+        with rasterio.open(parts[0]["mask_path"]) as first:
+            tile_height, tile_width = first.block_shapes[0]
+        with self._open_mask_output(mask_path, grid, tile_width, tile_height) as dst:
+            for part in parts:
+                row_start = part["rows"][0]
+                with rasterio.open(part["mask_path"]) as src:
+                    for _, window in src.block_windows(1):
+                        dst.write(src.read(1, window=window), 1, window=Window(
+                            window.col_off, window.row_off + row_start, window.width, window.height
+                        ))
+
+    def _scene_indexes(self, tile_indexes: Optional[Dict[str, TileIndex]],
+                       paths: Iterable[str]) -> Optional[List[Optional[TileIndex]]]:
+        """The tile index of each scene, or None where it is missing or out of date"""
+        if not tile_indexes:
+            return None
+        indexes = []
+        for path in paths:
+            index = tile_indexes.get(path)
+            if index is not None and not index.is_current(path):
+                logger.warning(f"Tile index of {path} is out of date, reading every tile")
+                index = None
+            indexes.append(index)
+        return indexes
+
+    def _window_usable(self, index: Optional[TileIndex], grid: AlignedGrid, window: Window,
+                       skip_cloudy: Optional[bool] = None) -> bool:
+        """
+        Whether a scene can yield valid pixels for a grid window, per its
+        tile index. All-cloud windows count as unusable if ``skip_cloudy``
+        (default ``tile_index.skip_cloudy``).
+        """
+        if index is None:
+            return True
+        if skip_cloudy is None:
+            skip_cloudy = self.skip_cloudy_tiles
+        return index.usable(window_bounds(window, grid.transform), grid.crs, skip_cloudy)
+
+    def _usable_windows(self, windows: Iterable[Window], scene_indexes: Optional[List[Optional[TileIndex]]],
+                        grid: AlignedGrid, skipped: Optional[List[Window]] = None,
+                        skip_cloudy: Optional[bool] = None) -> Iterator[Window]:
+        """Windows every scene can yield valid pixels for; the rest go to ``skipped``"""
+        for window in windows:
+            if not scene_indexes or all(self._window_usable(index, grid, window, skip_cloudy)
+                                        for index in scene_indexes):
+                yield window
+            elif skipped is not None:
+                skipped.append(window)
+
+    def _open_dataset(self, path: str):
+        """Open a scene for reading, through the dataset pool if there is one"""
+        if self.datasets is not None:
+            return self.datasets.open(path)
+        return rasterio.open(path)
+
+    def _open_readers(self, paths: Tuple[str, str], grid: AlignedGrid) -> Tuple[GridReader, GridReader]:
+        """Open both scenes and wrap them in readers for the common grid"""
+        if self.datasets is not None:
+            return tuple(GridReader(self.datasets.acquire(path), grid) for path in paths)
+        return tuple(GridReader(rasterio.open(path), grid) for path in paths)
+
+    def _close_readers(self, readers: Tuple[GridReader, ...]):
+        """Close readers from ``_open_readers`` and release their scenes"""
+        for reader in readers:
+            reader.close()
+            if self.datasets is not None:
+                self.datasets.release(reader.src)
+            else:
+                reader.src.close()
+
+    def _iter_window_results(self, readers, paths: Tuple[str, str], grid: AlignedGrid,
+                             windows: Iterable[Window], max_workers: int, process: Callable,
+                             reuse_kernel: bool = True) -> Iterator:
+        """
+        Yield (window, process(readers, window, kernel)) in window order.
+
+        With more than one worker, windows are processed on a thread pool.
+        GDAL reads and numpy arithmetic release the GIL, so threads scale
+        across cores without the pickling cost of a process pool (and work
+        inside daemonic Celery worker processes, which cannot fork children).
+        Rasterio handles are not thread-safe, so each thread opens its own.
+        """
+        if max_workers <= 1:
+            kernel = self._kernel() if reuse_kernel else NDVIDifferenceKernel()
+            for window in windows:
+                yield window, process(readers, window, kernel)
+            return
+
+        local = threading.local()
+        opened = []
+        lock = threading.Lock()
+
+        def run(window: Window):
+            thread_readers = getattr(local, "readers", None)
+            if thread_readers is None:
+                thread_readers = local.readers = self._open_readers(paths, grid)
+                with lock:
+                    opened.append(thread_readers)
+            return process(thread_readers, window, self._kernel())
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="detect") as pool:
+                # Bound the number of windows in flight so memory stays per-tile
+                pending = deque()
+                for window in windows:
+                    pending.append((window, pool.submit(run, window)))
+                    if len(pending) >= 2 * max_workers:
+                        done_window, future = pending.popleft()
+                        yield done_window, future.result()
+                while pending:
+                    done_window, future = pending.popleft()
+                    yield done_window, future.result()
+        finally:
+            for thread_readers in opened:
+                self._close_readers(thread_readers)
+
+    def _process_window(self, readers, window: Window, kernel: NDVIDifferenceKernel,
+                        threshold: float, keep_mask: bool = False,
+                        grid: Optional[AlignedGrid] = None,
+                        aoi_shapes: Optional[List[Dict]] = None) -> Tuple[ChangeAccumulator, Optional[np.ndarray]]:
+        """
+        Compute the NDVI change statistics for a single grid window with the
+        fused kernel. The change mask is returned as a uint8 copy only when
+        ``keep_mask`` is set, since the kernel's buffers are reused by the
+        next window.
+        """
+        shape = (int(window.height), int(window.width))
+
+        inside = None
+        if aoi_shapes:
+            inside = geometry_mask(aoi_shapes, out_shape=shape, invert=True,
+                                   transform=window_transform(window, grid.transform))
+            if not inside.any():
+                return ChangeAccumulator(), (np.zeros(shape, dtype=np.uint8) if keep_mask else None)
+
+        ndvi_before, valid_before = self._window_ndvi(kernel, "before", readers[0], window, shape)
+        ndvi_after, valid_after = self._window_ndvi(kernel, "after", readers[1], window, shape)
+
+        change_mask = kernel.change_mask(ndvi_before, ndvi_after, threshold)
+        valid = self._valid_pixels(kernel, valid_before, valid_after, inside)
+        np.logical_and(change_mask, valid, out=change_mask)
+
+        window_stats = ChangeAccumulator()
+        window_stats.update(ndvi_before, ndvi_after, change_mask, valid=valid)
+        return window_stats, (change_mask.astype(np.uint8) if keep_mask else None)
+
+    def _valid_pixels(self, kernel: NDVIDifferenceKernel, valid_before: np.ndarray, valid_after: np.ndarray,
+                      inside: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Pixels with data in both scenes (see ``_window_ndvi``), within
+        ``inside`` if given. Windows a tile index rules out hold no such
+        pixels, so skipping them leaves results unchanged.
+        """
+        valid = kernel.buffer("valid", valid_before.shape)
+        np.logical_and(valid_before, valid_after, out=valid)
+        if inside is not None:
+            valid &= inside
+        return valid
+
+    def _process_window_pyramid(self, readers, window: Window, kernel: NDVIDifferenceKernel,
+                                process: Callable, threshold: float, factor: int, margin: float,
+                                grid: AlignedGrid,
+                                aoi_shapes: Optional[List[Dict]] = None) -> Tuple[ChangeAccumulator, Optional[np.ndarray]]:
+        """
+        Score one window on a read decimated by ``factor`` and hand it to
+        ``process`` only if its largest coarse NDVI change exceeds
+        ``threshold - margin``. Averaging dilutes changes smaller than a
+        coarse pixel, which is what the margin absorbs.
+
+        A pruned window counts as unchanged, with its NDVI means taken from
+        the coarse read; its pixels are recorded as skipped.
+        """
+        shape = (int(window.height), int(window.width))
+        coarse_shape = (math.ceil(shape[0] / factor), math.ceil(shape[1] / factor))
+
+        inside_pixels = shape[0] * shape[1]
+        coarse_inside = None
+        if aoi_shapes:
+            transform = window_transform(window, grid.transform)
+            inside_pixels = int(geometry_mask(aoi_shapes, out_shape=shape, invert=True,
+                                              transform=transform).sum())
+            if not inside_pixels:
+                return process(readers, window, kernel)
+            coarse_transform = transform * Affine.scale(shape[1] / coarse_shape[1], shape[0] / coarse_shape[0])
+            coarse_inside = geometry_mask(aoi_shapes, out_shape=coarse_shape, invert=True,
+                                          transform=coarse_transform, all_touched=True)
+
+        ndvi = []
+        valid = np.ones(coarse_shape, dtype=bool)
+        for reader in readers:
+            red, nir = kernel.band_buffers(coarse_shape)
+            self._read_window_bands(reader, window, (red, nir), valid, resampling=Resampling.average)
+            ndvi.append(ndvi_into(red, nir, out=np.empty(coarse_shape, dtype=np.float32),
+                                  denom=kernel.buffer("scratch", coarse_shape),
+                                  valid=kernel.buffer("valid", coarse_shape)))
+            valid &= kernel.buffer("valid", coarse_shape)
+
+        difference = np.abs(ndvi[1] - ndvi[0])
+        if coarse_inside is not None:
+            difference = difference[coarse_inside]
+            ndvi = [values[coarse_inside] for values in ndvi]
+            valid = valid[coarse_inside]
+        difference = difference[valid]
+        if difference.size and difference.max() > threshold - margin:
+            return process(readers, window, kernel)
+
+        # Nodata is left out as at full resolution, in proportion to the
+        # coarse pixels without data in either scene
+        window_stats = ChangeAccumulator()
+        if valid.any():
+            window_stats.add_skipped(round(inside_pixels * valid.mean()),
+                                     float(ndvi[0][valid].mean()), float(ndvi[1][valid].mean()))
+        keep_mask = process.keywords.get("keep_mask", False)
+        return window_stats, (np.zeros(shape, dtype=np.uint8) if keep_mask else None)
+
+    def _window_ndvi(self, kernel: NDVIDifferenceKernel, name: str, reader: GridReader,
+                     window: Window, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        NDVI of one grid window and its valid pixels, served from the NDVI
+        cache when possible. A pixel is valid if both bands hold data per
+        the dataset's nodata value or mask and red + NIR != 0; NDVI itself
+        may be exactly 0 (red == NIR) on a valid pixel.
+        """
+        out = kernel.buffer(f"ndvi_{name}", shape)
+        valid = kernel.buffer(f"valid_{name}", shape)
+
+        key = None
+        if self.ndvi_cache is not None:
+            key = self.ndvi_cache.key(reader.name, self._band_indexes(reader),
+                                      reader.source_window(window), shape,
+                                      extra=reader.cache_extra)
+            if self.ndvi_cache.get(key, out, valid):
+                return out, valid
+
+        valid.fill(True)
+        self._read_window_bands(reader, window, kernel.band_buffers(shape), valid)
+        kernel.ndvi(name, shape)
+        valid &= kernel.buffer("valid", shape)
+
+        if key is not None:
+            self.ndvi_cache.put(key, out, valid)
+        return out, valid
+
+    def _kernel(self) -> NDVIDifferenceKernel:
+        """The calling thread's NDVI-difference kernel, sized for one tile"""
+        kernel = getattr(self._local, "kernel", None)
+        if kernel is None:
+            kernel = self._local.kernel = NDVIDifferenceKernel(self.tile_size * self.tile_size)
+        return kernel
+
+    def _band_indexes(self, src) -> Tuple[int, int]:
+        """Return the (red, nir) band indexes used for a dataset"""
+        red = 3 if src.count >= 3 else 1
+        nir = 4 if src.count >= 4 else 1  # Fallback to 1 if not 4
+        return red, nir
+
+    def _read_window_bands(self, reader: GridReader, window: Window, out: Tuple[np.ndarray, np.ndarray],
+                           valid: np.ndarray, resampling: Optional[Resampling] = None):
+        """
+        Read the red/NIR bands of one grid window straight into float32
+        buffers, clearing ``valid`` where either band holds nodata
+        """
+        red_idx, nir_idx = self._band_indexes(reader)
+        for index, buffer in zip((red_idx, nir_idx), out):
+            reader.read(index, window, out=buffer, resampling=resampling)
+            reader.mask_nodata(index, window, buffer, valid)
+
+    def _vectorize_mask(self, mask_path: str, polygons_path: str, crs: str) -> Dict:
+        """Vectorize a written change mask into a GeoJSON file in ``crs``"""
+        vectorizer = vectorizer_from_config(self.config, dst_crs=crs)
+        with rasterio.open(mask_path) as src:
+            return vectorizer.write_geojson(
+                polygons_path, raster_window_reader(src), src.width, src.height,
+                src.transform, src.crs
+            )
+
+    def _open_mask_output(self, mask_path: str, grid: AlignedGrid, tile_width: int, tile_height: int):
+        """Create a uint8 GeoTIFF on the common grid for the change mask"""
+        profile = {
+            "driver": "GTiff",
+            "width": grid.width,
+            "height": grid.height,
+            "count": 1,
+            "dtype": "uint8",
+            "crs": grid.crs,
+            "transform": grid.transform,
+            "compress": "deflate",
+        }
+        # GeoTIFF tiles must be multiples of 16; otherwise fall back to strips
+        if tile_width % 16 == 0 and tile_height % 16 == 0:
+            profile.update(tiled=True, blockxsize=tile_width, blockysize=tile_height)
+        return rasterio.open(mask_path, "w", **profile)
+
+engine = ChangeDetectionEngine(get_settings())
@@ -0,0 +1,123 @@
+"""
+Job fingerprints for reusing detection results
+
+A fingerprint hashes everything a detection result depends on: the
+content of the input scenes, the AOI geometry, the job parameters and
+``ENGINE_VERSION``. Scene digests are memoised by path, size and mtime,
+so a scene is read in full only the first time it is fingerprinted.
+``JobRegistry`` maps fingerprints to the Celery task computing them.
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional
+
+# Part of every fingerprint: bump it whenever a change to the detection
+# code alters results, so results computed before are not reused
+ENGINE_VERSION = "1"
+
+# Delete a key only if it still holds the given value
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """BLAKE2b digest of a file's content"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _text(value) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class JobRegistry:
+    """
+    Fingerprint-to-task records in Redis.
+
+    ``claim`` registers a task for a fingerprint with ``SET NX``, so of
+    several identical submissions racing each other exactly one enqueues
+    a task and the rest get its id. Records expire after ``ttl`` seconds,
+    which should not exceed how long the result backend keeps results.
+    A claim older than ``stale_after`` seconds whose task has not finished
+    is presumed lost; its age is read from the record's remaining TTL.
+    """
+
+    def __init__(self, client, ttl: int = 86400, prefix: str = "detection",
+                 stale_after: int = 7200):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stale_after = stale_after
+
+    def file_digest(self, path: str) -> str:
+        """Content digest of a scene, memoised while its size and mtime are unchanged"""
+        stat = os.stat(path)
+        key = f"{self.prefix}:file:{os.path.abspath(path)}"
+        memo = self.client.get(key)
+        if memo is not None:
+            memo = json.loads(memo)
+            if memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+                return memo["digest"]
+
+        digest = file_digest(path)
+        self.client.set(key, json.dumps({
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest
+        }))
+        return digest
+
+    def fingerprint(self, image_paths: Iterable[str], aoi_wkb: Optional[bytes], params: Dict) -> str:
+        """
+        Fingerprint of a job over ``image_paths`` (in order) for an AOI
+        given as WKB (None for the full scene), with JSON-serializable
+        ``params``.
+        """
+        payload = {
+            "engine_version": ENGINE_VERSION,
+            "images": [self.file_digest(path) for path in image_paths],
+            "aoi": hashlib.sha256(aoi_wkb).hexdigest() if aoi_wkb is not None else None,
+            "params": params
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def claim(self, fingerprint: str, task_id: str) -> Optional[str]:
+        """
+        Record ``task_id`` as computing ``fingerprint`` unless a task already
+        is. Returns None if the claim succeeded, else the other task's id.
+        """
+        key = self._job_key(fingerprint)
+        for _ in range(2):
+            if self.client.set(key, task_id, nx=True, ex=self.ttl):
+                return None
+            existing = self.client.get(key)
+            if existing is not None:
+                return _text(existing)
+            # The record expired between the two calls; try once more
+        return _text(self.client.get(key))
+
+    def claim_age(self, fingerprint: str) -> Optional[int]:
+        """Seconds since ``fingerprint`` was claimed, or None if it is not"""
+        remaining = self.client.ttl(self._job_key(fingerprint))
+        if remaining is None or remaining < 0:
+            return None
+        return max(self.ttl - int(remaining), 0)
+
+    def is_stale(self, fingerprint: str) -> bool:
+        """True if the claim on ``fingerprint`` is older than ``stale_after``"""
+        age = self.claim_age(fingerprint)
+        return age is not None and age > self.stale_after
+
+    def release(self, fingerprint: str, task_id: str) -> bool:
+        """Forget the task of ``fingerprint`` if it is still ``task_id`` (e.g. it failed)"""
+        return bool(self.client.eval(_RELEASE_SCRIPT, 1, self._job_key(fingerprint), task_id))
+
+    def _job_key(self, fingerprint: str) -> str:
+        return f"{self.prefix}:job:{fingerprint}"
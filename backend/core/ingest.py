@@ -0,0 +1,43 @@
+"""
+Ingest-time preparation of imagery for fast detection
+"""
+
+import os
+from typing import List, Optional, Sequence
+
+import rasterio
+from loguru import logger
+from rasterio.enums import Resampling
+
+
+def build_overviews(image_path: str, factors: Optional[Sequence[int]] = None,
+                    min_size: int = 256, resampling: Resampling = Resampling.average) -> List[int]:
+    """
+    Build overviews for a scene unless it already has them.
+
+    Overviews go to an external ``.ovr`` file next to the scene, so the
+    scene itself (and its mtime, which keys the NDVI cache) is untouched.
+    By default factors double until the smallest overview is under
+    ``min_size`` pixels on its longer side.
+
+    Returns:
+        The overview factors of the scene
+    """
+    with rasterio.open(image_path) as src:
+        existing = src.overviews(1)
+        if existing:
+            return existing
+        if factors is None:
+            factors, factor = [], 2
+            while max(src.width, src.height) / factor >= min_size:
+                factors.append(factor)
+                factor *= 2
+        if not factors:
+            return []
+
+    with rasterio.Env(TIFF_USE_OVR=True):
+        with rasterio.open(image_path, "r+") as dst:
+            dst.build_overviews(list(factors), resampling)
+
+    logger.info(f"Built overviews {list(factors)} for {image_path} ({os.path.basename(image_path)}.ovr)")
+    return list(factors)
@@ -0,0 +1,144 @@
+"""
+Fused cloud/shadow masking with fast binary morphology
+"""
+
+import math
+from functools import lru_cache
+from typing import Dict, Tuple
+
+import numpy as np
+
+# NDVI below which a dark pixel counts as shadow rather than dark vegetation
+SHADOW_NDVI_THRESHOLD = 0.1
+
+
+@lru_cache(maxsize=None)
+def disk_kernel(radius: int) -> np.ndarray:
+    """``skimage.morphology.disk(radius)`` as a uint8 OpenCV kernel"""
+    offsets = np.arange(-radius, radius + 1)
+    return (offsets[:, None] ** 2 + offsets[None, :] ** 2 <= radius ** 2).astype(np.uint8)
+
+
+def binary_dilation(mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Dilation by a disk, identical to ``skimage.morphology.binary_dilation``
+    with ``disk(radius)``. OpenCV decomposes the kernel into row runs, so the
+    cost grows with the radius instead of the disk area.
+    """
+    if radius <= 0:
+        return mask.copy()
+    import cv2  # deferred: OpenCV is slow to import and only needed for masking
+    dilated = cv2.dilate(mask.view(np.uint8), disk_kernel(radius),
+                         borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    return dilated.view(bool)
+
+
+def binary_closing(mask: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Closing by a disk, identical to ``skimage.morphology.binary_closing``
+    with ``disk(radius)``: outside the array counts as background for the
+    dilation and as foreground for the erosion.
+    """
+    if radius <= 0:
+        return mask.copy()
+    import cv2
+    kernel = disk_kernel(radius)
+    dilated = cv2.dilate(mask.view(np.uint8), kernel, borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    closed = cv2.erode(dilated, kernel, borderType=cv2.BORDER_CONSTANT, borderValue=1)
+    return closed.view(bool)
+
+
+def binary_dilation_downsampled(mask: np.ndarray, radius: int, factor: int) -> np.ndarray:
+    """
+    Approximate disk dilation for large radii: max-pool by ``factor``,
+    dilate by ``ceil(radius / factor)`` and upsample by repetition. The
+    result is a superset of the exact dilation, off by at most ``factor``
+    pixels along edges.
+    """
+    if factor <= 1:
+        return binary_dilation(mask, radius)
+
+    height, width = mask.shape
+    pooled_height, pooled_width = math.ceil(height / factor), math.ceil(width / factor)
+    padded = np.zeros((pooled_height * factor, pooled_width * factor), dtype=bool)
+    padded[:height, :width] = mask
+    pooled = padded.reshape(pooled_height, factor, pooled_width, factor).any(axis=(1, 3))
+
+    dilated = binary_dilation(pooled, math.ceil(radius / factor))
+    return np.repeat(np.repeat(dilated, factor, axis=0), factor, axis=1)[:height, :width]
+
+
+class CloudShadowMasker:
+    """
+    Cloud and shadow masks from one pass over red/green/NIR.
+
+    Brightness and NDVI are computed once and shared by the cloud and the
+    shadow tests. Clouds are bright or non-vegetated pixels; shadows are
+    dark, non-vegetated pixels within ``shadow_search_radius`` of a cloud.
+    Both masks are cleaned with a disk closing.
+
+    Every output pixel depends only on inputs within ``halo`` pixels, so
+    tiles processed with that much overlap reproduce the full-scene masks
+    exactly (``downsample`` > 1 trades that exactness for speed on large
+    search radii).
+    """
+
+    def __init__(self, brightness_threshold: float = 0.7, ndvi_threshold: float = 0.1,
+                 shadow_threshold: float = 0.3, cloud_closing_radius: int = 3,
+                 shadow_closing_radius: int = 2, shadow_search_radius: int = 5,
+                 downsample: int = 1):
+        self.brightness_threshold = brightness_threshold
+        self.ndvi_threshold = ndvi_threshold
+        self.shadow_threshold = shadow_threshold
+        self.cloud_closing_radius = cloud_closing_radius
+        self.shadow_closing_radius = shadow_closing_radius
+        self.shadow_search_radius = shadow_search_radius
+        self.downsample = downsample
+
+    @classmethod
+    def from_thresholds(cls, thresholds: Dict) -> "CloudShadowMasker":
+        """Create a masker from the ``detection.cloud`` config section"""
+        morphology = thresholds.get('morphology', {})
+        return cls(
+            brightness_threshold=thresholds.get('brightness_threshold', 0.7),
+            ndvi_threshold=thresholds.get('ndvi_threshold', 0.1),
+            shadow_threshold=thresholds.get('shadow_threshold', 0.3),
+            cloud_closing_radius=morphology.get('cloud_closing_radius', 3),
+            shadow_closing_radius=morphology.get('shadow_closing_radius', 2),
+            shadow_search_radius=morphology.get('shadow_search_radius', 5),
+            downsample=morphology.get('downsample', 1)
+        )
+
+    @property
+    def halo(self) -> int:
+        """Overlap needed around a tile for its core to match the full-scene result"""
+        shadow_reach = self.shadow_search_radius + self.downsample - 1 + 2 * self.shadow_closing_radius
+        return max(2 * self.cloud_closing_radius, shadow_reach)
+
+    def masks(self, bands: np.ndarray, ndvi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute (cloud_mask, shadow_mask) for one tile.
+
+        Args:
+            bands: The first three bands of the tile (3, height, width)
+            ndvi: NDVI of the tile (height, width)
+        """
+        brightness = np.add(bands[0], bands[1], dtype=np.float32)
+        brightness += bands[2]
+        brightness /= 3
+
+        non_vegetated = ndvi < self.ndvi_threshold
+        cloud = brightness > self.brightness_threshold
+        cloud |= non_vegetated
+
+        # Shadows: dark, non-vegetated areas near the raw cloud mask
+        near_clouds = binary_dilation_downsampled(cloud, self.shadow_search_radius, self.downsample)
+        shadow = brightness < self.shadow_threshold
+        if self.ndvi_threshold == SHADOW_NDVI_THRESHOLD:
+            shadow &= non_vegetated
+        else:
+            shadow &= ndvi < SHADOW_NDVI_THRESHOLD
+        shadow &= near_clouds
+
+        return (binary_closing(cloud, self.cloud_closing_radius),
+                binary_closing(shadow, self.shadow_closing_radius))
@@ -0,0 +1,91 @@
+"""
+Fused float32 NDVI kernels operating on preallocated buffers
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+def ndvi_into(red: np.ndarray, nir: np.ndarray, out: np.ndarray,
+              denom: np.ndarray, valid: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Write NDVI = (NIR - Red) / (NIR + Red) into ``out`` without temporaries.
+
+    Pixels where NIR + Red == 0 are set to 0. The division is masked with
+    ``where=`` instead of silencing floating point errors, so global numpy
+    error state is never touched. ``out`` may alias ``red``.
+
+    Args:
+        red, nir: Input bands (float32 preferred)
+        out: Output array, same shape as the bands
+        denom: Scratch float array, same shape as the bands
+        valid: Optional scratch bool array, same shape as the bands
+
+    Returns:
+        ``out``
+    """
+    if valid is None:
+        valid = np.empty(out.shape, dtype=bool)
+
+    np.add(nir, red, out=denom)
+    np.subtract(nir, red, out=out)
+    np.not_equal(denom, 0, out=valid)
+    np.divide(out, denom, out=out, where=valid)
+    np.multiply(out, valid, out=out)
+    return out
+
+
+class NDVIDifferenceKernel:
+    """
+    Single-pass NDVI-difference over reusable float32 buffers.
+
+    One kernel is kept per thread and sized for the largest tile; smaller
+    (edge) tiles use contiguous views of the same storage, so the steady
+    state performs no allocations per tile.
+    """
+
+    _FLOAT_BUFFERS = ("red", "nir", "ndvi_before", "ndvi_after", "scratch")
+    _BOOL_BUFFERS = ("valid", "valid_before", "valid_after", "change")
+
+    def __init__(self, capacity: int = 0):
+        self.capacity = 0
+        self._buffers = {}
+        self.reserve(capacity)
+
+    def reserve(self, capacity: int):
+        """Grow the buffers so tiles of up to ``capacity`` pixels fit"""
+        if capacity <= self.capacity:
+            return
+        for name in self._FLOAT_BUFFERS:
+            self._buffers[name] = np.empty(capacity, dtype=np.float32)
+        for name in self._BOOL_BUFFERS:
+            self._buffers[name] = np.empty(capacity, dtype=bool)
+        self.capacity = capacity
+
+    def buffer(self, name: str, shape: Tuple[int, int]) -> np.ndarray:
+        """Contiguous view of a named buffer with the given 2-D shape"""
+        size = shape[0] * shape[1]
+        self.reserve(size)
+        return self._buffers[name][:size].reshape(shape)
+
+    def band_buffers(self, shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(red, nir) float32 buffers to read a window's bands into"""
+        return self.buffer("red", shape), self.buffer("nir", shape)
+
+    def ndvi(self, name: str, shape: Tuple[int, int]) -> np.ndarray:
+        """Compute NDVI from the band buffers into the ``ndvi_<name>`` buffer"""
+        red, nir = self.band_buffers(shape)
+        return ndvi_into(
+            red, nir, self.buffer(f"ndvi_{name}", shape),
+            self.buffer("scratch", shape), self.buffer("valid", shape)
+        )
+
+    def change_mask(self, ndvi_before: np.ndarray, ndvi_after: np.ndarray,
+                    threshold: float) -> np.ndarray:
+        """|after - before| > threshold, evaluated in the scratch buffer"""
+        shape = ndvi_before.shape
+        diff = self.buffer("scratch", shape)
+        np.subtract(ndvi_after, ndvi_before, out=diff)
+        np.abs(diff, out=diff)
+        return np.greater(diff, threshold, out=self.buffer("change", shape))
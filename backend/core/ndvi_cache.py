@@ -0,0 +1,176 @@
+"""
+Content-addressed on-disk cache of NDVI windows with LRU eviction
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class NDVICache:
+    """
+    NDVI rasters stored as float32 ``.npy`` files, so a hit returns
+    exactly the values a miss computes. Pixels without data are stored as
+    NaN when the caller passes a validity mask.
+
+    Entries are keyed by the source file (path, mtime and size), the band
+    indexes, the window read and the output shape, so a changed file never
+    returns stale values. File modification times double as LRU timestamps:
+    a hit touches the entry, and when the cache grows past ``max_bytes`` the
+    least recently used entries are removed. The directory can be shared by
+    several worker processes.
+    """
+
+    # Part of every key; bump it when the entry format changes
+    FORMAT = 2
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    def key(self, image_path: str, bands: Sequence, window, shape: Tuple[int, int],
+            extra: Optional[str] = None) -> str:
+        """
+        Build the cache key for one NDVI window.
+
+        Args:
+            image_path: Source raster path
+            bands: Band indexes (or names) NDVI is computed from
+            window: Source window (anything with a stable ``repr``) or None
+            shape: Output array shape
+            extra: Optional extra discriminator, e.g. a target grid
+        """
+        stat = os.stat(image_path)
+        parts = [
+            os.path.realpath(image_path), stat.st_mtime_ns, stat.st_size,
+            [str(band) for band in bands], repr(window), list(shape), extra, self.FORMAT
+        ]
+        return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+    def get(self, key: str, out: np.ndarray, valid: Optional[np.ndarray] = None) -> bool:
+        """
+        Load a cached window into the float32 ``out`` array; False on a miss.
+        With ``valid``, pixels stored without data are set to 0 in ``out``
+        and cleared in ``valid``.
+        """
+        path = self._path(key)
+        try:
+            cached = np.load(path)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            with self._lock:
+                self.misses += 1
+            return False
+
+        if cached.shape != out.shape or cached.dtype != np.float32:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        np.copyto(out, cached)
+        if valid is not None:
+            np.isnan(cached, out=valid)
+            np.copyto(out, 0, where=valid)
+            np.logical_not(valid, out=valid)
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key: str, ndvi: np.ndarray, valid: Optional[np.ndarray] = None):
+        """
+        Store a window, as NaN where ``valid`` is False if given; ``ndvi``
+        itself is left untouched.
+        """
+        stored = ndvi.astype(np.float32, copy=valid is not None)
+        if valid is not None:
+            np.copyto(stored, np.nan, where=~valid)
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, stored)
+            # Replacing an entry (e.g. two threads missing the same key)
+            # must not count its bytes twice
+            with self._lock:
+                try:
+                    replaced = path.stat().st_size
+                except FileNotFoundError:
+                    replaced = 0
+                os.replace(tmp_path, path)
+                self._bytes += path.stat().st_size - replaced
+                over_budget = self._bytes > self.max_bytes
+        except OSError as e:
+            logger.warning(f"Could not write NDVI cache entry {path}: {e}")
+            return
+
+        if over_budget:
+            self._evict()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.npy"
+
+    def _entries(self):
+        return self.root.glob("*/*.npy")
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is at 90% of its cap"""
+        with self._lock:
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry))
+            entries.sort()
+
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for _, size, entry in entries:
+                if total <= target:
+                    break
+                try:
+                    entry.unlink()
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._bytes = total
+
+
+def ndvi_cache_from_config(config: Dict) -> Optional[NDVICache]:
+    """Create the NDVI cache described by ``detection.processing.ndvi_cache``, if enabled"""
+    settings = config.get('detection', {}).get('processing', {}).get('ndvi_cache', {})
+    if not settings.get('enabled', False):
+        return None
+
+    temp_path = config.get('storage', {}).get('temp_path', './data/temp')
+    root = settings.get('path', os.path.join(temp_path, 'ndvi_cache'))
+    max_bytes = int(settings.get('max_size_mb', 2048)) * 1024 * 1024
+    return NDVICache(root, max_bytes)
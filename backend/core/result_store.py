@@ -0,0 +1,138 @@
+"""
+Out-of-band storage for large task results
+
+Celery results travel through the Redis result backend, which holds every
+byte in memory until the result expires. Results that encode to more than
+``inline_max_bytes`` are written to a result store instead, and only a
+summary with a ``result_ref`` goes through Redis (``ResultStore.offload``);
+``ResultStore.resolve`` loads the full result back. Stored results use
+the encoding of the Celery results: msgpack, zlib-compressed.
+"""
+
+import os
+import zlib
+from pathlib import Path
+from typing import Dict
+
+import msgpack
+
+# Summary fields larger than this (encoded) are left to the stored result
+SUMMARY_FIELD_MAX_BYTES = 512
+
+
+def _default(obj):
+    """Encode numpy scalars and arrays as builtins"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def dumps(payload: Dict, level: int = 6) -> bytes:
+    """msgpack-encode and zlib-compress a result"""
+    return zlib.compress(msgpack.packb(payload, default=_default, use_bin_type=True), level)
+
+
+def loads(data: bytes) -> Dict:
+    return msgpack.unpackb(zlib.decompress(data), raw=False, strict_map_key=False)
+
+
+class ResultStore:
+    """
+    Where results too large for the result backend are kept. Subclasses
+    store and fetch encoded bytes by key; ``offload`` and ``resolve`` work
+    on result dicts.
+    """
+
+    name = None
+
+    def __init__(self, inline_max_bytes: int = 65536):
+        self.inline_max_bytes = inline_max_bytes
+
+    def put(self, key: str, data: bytes) -> Dict:
+        """Store encoded bytes under ``key`` and return a reference to them"""
+        raise NotImplementedError
+
+    def get(self, ref: Dict) -> bytes:
+        raise NotImplementedError
+
+    def delete(self, ref: Dict):
+        raise NotImplementedError
+
+    def offload(self, result: Dict, key: str) -> Dict:
+        """
+        The result to hand to the result backend: ``result`` itself if it
+        encodes to at most ``inline_max_bytes``, otherwise a summary of its
+        small fields plus a ``result_ref`` to the full result stored under
+        ``key``.
+        """
+        data = dumps(result)
+        if len(data) <= self.inline_max_bytes:
+            return result
+
+        summary = {
+            name: value for name, value in result.items()
+            if len(msgpack.packb(value, default=_default, use_bin_type=True)) <= SUMMARY_FIELD_MAX_BYTES
+        }
+        summary["result_ref"] = self.put(key, data)
+        return summary
+
+    def resolve(self, result: Dict) -> Dict:
+        """The full result behind a summary from ``offload``; other results as they are"""
+        ref = result.get("result_ref") if isinstance(result, dict) else None
+        if ref is None:
+            return result
+        return loads(self.get(ref))
+
+
+class FileResultStore(ResultStore):
+    """
+    Results as files under ``root``, sharded by the first two characters
+    of the key. Writes go through a temporary file and a rename, so readers
+    never see a partial result.
+    """
+
+    name = "filesystem"
+
+    def __init__(self, root: str, inline_max_bytes: int = 65536):
+        super().__init__(inline_max_bytes)
+        self.root = Path(root)
+
+    def put(self, key: str, data: bytes) -> Dict:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return {"kind": "result", "store": self.name, "key": key, "bytes": len(data)}
+
+    def get(self, ref: Dict) -> bytes:
+        with open(self._path(ref["key"]), "rb") as f:
+            return f.read()
+
+    def delete(self, ref: Dict):
+        path = self._path(ref["key"])
+        if path.exists():
+            path.unlink()
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.msgpack.z"
+
+
+# Result store backends by ``storage.result_store.backend`` name
+RESULT_STORES = {FileResultStore.name: FileResultStore}
+
+
+def result_store_from_config(config: Dict) -> ResultStore:
+    """Create the store described by ``storage.result_store``"""
+    storage = config.get('storage', {})
+    settings = storage.get('result_store', {})
+    backend = settings.get('backend', FileResultStore.name)
+    if backend not in RESULT_STORES:
+        raise ValueError(f"Unknown result store backend: {backend}")
+
+    inline_max_bytes = int(settings.get('inline_max_kb', 64)) * 1024
+    if backend == FileResultStore.name:
+        root = settings.get('path', os.path.join(storage.get('results_path', './data/results'), 'task_results'))
+        return FileResultStore(root, inline_max_bytes)
+    return RESULT_STORES[backend](inline_max_bytes=inline_max_bytes, **settings.get('options', {}))
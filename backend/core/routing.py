@@ -0,0 +1,103 @@
+"""
+Size-aware queue routing for detection tasks
+
+Detection jobs are routed by their estimated cost, the number of pixels
+they process: the scene size, capped by the AOI area in pixels. Cheap
+jobs go to ``detection.small``, expensive ones to ``detection.large`` and
+multi-AOI jobs to ``detection.batch``, so each queue can have its own
+workers and a country-scale AOI never sits in front of interactive work.
+Within a queue, user-triggered jobs are delivered before scheduled ones.
+"""
+
+from typing import Dict, Iterable, Optional
+
+SMALL_QUEUE = "detection.small"
+LARGE_QUEUE = "detection.large"
+BATCH_QUEUE = "detection.batch"
+
+# Message priorities by trigger. With the Redis broker 0 is delivered first
+DEFAULT_PRIORITIES = {"user": 0, "scheduled": 6}
+
+
+def scene_pixels(path: str) -> Dict:
+    """Pixel count and pixel area (m², None for geographic CRS) of a scene, from its header"""
+    import rasterio
+
+    with rasterio.open(path) as src:
+        projected = src.crs is not None and src.crs.is_projected
+        return {
+            "pixels": src.width * src.height,
+            "pixel_area_m2": abs(src.transform.a * src.transform.e) if projected else None
+        }
+
+
+class QueueRouter:
+    """
+    Picks the queue and priority of a detection task.
+
+    A job is estimated to process the scene's pixels, or the AOI area in
+    pixels if that is smaller (pixel area from the scene if projected,
+    else ``pixel_size_m``). Only jobs estimated above ``large_pixels`` go
+    to the large queue; jobs whose cost cannot be estimated stay small.
+    """
+
+    def __init__(self, large_pixels: int = 50_000_000, pixel_size_m: float = 10.0,
+                 priorities: Optional[Dict[str, int]] = None,
+                 queues: Optional[Dict[str, Dict]] = None):
+        self.large_pixels = large_pixels
+        self.pixel_size_m = pixel_size_m
+        self.priorities = {**DEFAULT_PRIORITIES, **(priorities or {})}
+        self.queues = queues or {}
+
+    def estimate_pixels(self, scene: Optional[Dict] = None,
+                        area_hectares: Optional[float] = None) -> Optional[int]:
+        """Pixels a job processes, from ``scene_pixels`` and the AOI area; None if unknown"""
+        estimates = []
+        if scene is not None:
+            estimates.append(int(scene["pixels"]))
+        if area_hectares is not None:
+            pixel_area = (scene or {}).get("pixel_area_m2") or self.pixel_size_m ** 2
+            estimates.append(int(area_hectares * 10_000 / pixel_area))
+        return min(estimates) if estimates else None
+
+    def priority(self, trigger: str) -> int:
+        if trigger not in self.priorities:
+            raise ValueError(f"Unknown trigger: {trigger}")
+        return self.priorities[trigger]
+
+    def route(self, scene: Optional[Dict] = None, area_hectares: Optional[float] = None,
+              trigger: str = "user", batch: bool = False) -> Dict:
+        """
+        ``{"queue", "priority", "estimated_pixels"}`` for a job; pass
+        ``queue`` and ``priority`` on to ``apply_async``.
+        """
+        pixels = self.estimate_pixels(scene, area_hectares)
+        if batch:
+            queue = BATCH_QUEUE
+        elif pixels is not None and pixels > self.large_pixels:
+            queue = LARGE_QUEUE
+        else:
+            queue = SMALL_QUEUE
+        return {"queue": queue, "priority": self.priority(trigger), "estimated_pixels": pixels}
+
+    def concurrency(self, queues: Iterable[str]) -> Optional[int]:
+        """
+        Worker concurrency configured for a worker consuming ``queues``: the
+        largest among them, or None if none is configured.
+        """
+        values = [
+            self.queues[queue]["concurrency"] for queue in queues
+            if self.queues.get(queue, {}).get("concurrency")
+        ]
+        return max(values) if values else None
+
+
+def queue_router_from_config(config: Dict) -> QueueRouter:
+    """Create the router described by ``detection.routing``"""
+    settings = config.get('detection', {}).get('routing', {})
+    return QueueRouter(
+        large_pixels=int(settings.get('large_pixels', 50_000_000)),
+        pixel_size_m=float(settings.get('pixel_size_m', 10.0)),
+        priorities=settings.get('priorities'),
+        queues=settings.get('queues')
+    )
@@ -0,0 +1,96 @@
+"""
+Scratch arrays that spill to memory-mapped files past a memory budget
+"""
+
+import os
+import tempfile
+import threading
+import weakref
+from typing import Dict, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+class ScratchAllocator:
+    """
+    Allocates intermediate arrays in RAM while the live total stays within
+    ``budget_bytes`` and as ``np.memmap`` files under ``root`` beyond that.
+
+    Memory-mapped files are unlinked as soon as they are mapped, so the
+    disk space is returned when the last view of the array goes away, even
+    if the worker dies. Where a mapped file cannot be unlinked (Windows) it
+    is removed when the array is garbage collected. A budget of 0 disables
+    spilling.
+    """
+
+    def __init__(self, root: str, budget_bytes: int = 0):
+        self.root = root
+        self.budget_bytes = budget_bytes
+
+        self.spilled_bytes = 0
+        self._ram_bytes = 0
+        self._lock = threading.Lock()
+
+    def empty(self, shape: Tuple[int, ...], dtype=np.float32) -> np.ndarray:
+        """Uninitialised array, in RAM or memory-mapped depending on the budget"""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._lock:
+            in_ram = not self.budget_bytes or nbytes == 0 or self._ram_bytes + nbytes <= self.budget_bytes
+            if in_ram:
+                self._ram_bytes += nbytes
+            else:
+                self.spilled_bytes += nbytes
+
+        if in_ram:
+            array = np.empty(shape, dtype=dtype)
+            weakref.finalize(array, self._release, nbytes)
+            return array
+        return self._memmap(shape, dtype)
+
+    def zeros(self, shape: Tuple[int, ...], dtype=np.float32) -> np.ndarray:
+        """Zero-filled array, in RAM or memory-mapped depending on the budget"""
+        array = self.empty(shape, dtype)
+        array.fill(0)
+        return array
+
+    def stats(self) -> Dict:
+        """Bytes currently held in RAM and bytes spilled to disk so far"""
+        return {
+            "budget_bytes": self.budget_bytes,
+            "ram_bytes": self._ram_bytes,
+            "spilled_bytes": self.spilled_bytes
+        }
+
+    def _memmap(self, shape: Tuple[int, ...], dtype) -> np.ndarray:
+        os.makedirs(self.root, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="scratch-", suffix=".dat", dir=self.root)
+        os.close(fd)
+
+        array = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+        try:
+            os.unlink(path)
+        except OSError:
+            weakref.finalize(array, _remove, path)
+
+        logger.debug(f"Spilled {array.nbytes / 2**20:.1f} MiB scratch array to {path}")
+        return array
+
+    def _release(self, nbytes: int):
+        with self._lock:
+            self._ram_bytes -= nbytes
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def scratch_from_config(config: Dict) -> ScratchAllocator:
+    """Create the allocator described by ``detection.processing.memory_budget_mb``"""
+    processing = config.get('detection', {}).get('processing', {})
+    temp_path = config.get('storage', {}).get('temp_path', './data/temp')
+    budget_bytes = int(processing.get('memory_budget_mb') or 0) * 1024 * 1024
+    return ScratchAllocator(os.path.join(temp_path, 'scratch'), budget_bytes)
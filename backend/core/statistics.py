@@ -0,0 +1,208 @@
+"""
+Incremental statistics for tile-by-tile change detection
+"""
+
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class ChangeAccumulator:
+    """
+    Running totals for NDVI change statistics.
+    Updated once per tile so no full-scene array is ever needed.
+    """
+
+    def __init__(self):
+        self.change_pixels = 0
+        self.total_pixels = 0
+        self.ndvi_before_sum = 0.0
+        self.ndvi_after_sum = 0.0
+        self.skipped_pixels = 0
+
+    def update(self, ndvi_before: np.ndarray, ndvi_after: np.ndarray,
+               change_mask: np.ndarray, valid: Optional[np.ndarray] = None):
+        """Add one tile. Pixels outside ``valid`` (if given) are ignored."""
+        if valid is not None:
+            ndvi_before = ndvi_before[valid]
+            ndvi_after = ndvi_after[valid]
+            change_mask = change_mask[valid]
+
+        self.change_pixels += int(np.count_nonzero(change_mask))
+        self.total_pixels += int(change_mask.size)
+        self.ndvi_before_sum += float(ndvi_before.sum(dtype=np.float64))
+        self.ndvi_after_sum += float(ndvi_after.sum(dtype=np.float64))
+
+    def add_skipped(self, pixels: int, ndvi_before_mean: float, ndvi_after_mean: float):
+        """
+        Count pixels that were not processed at full resolution as unchanged,
+        with NDVI means estimated at a coarser resolution.
+        """
+        self.total_pixels += pixels
+        self.skipped_pixels += pixels
+        self.ndvi_before_sum += ndvi_before_mean * pixels
+        self.ndvi_after_sum += ndvi_after_mean * pixels
+
+    def merge(self, other: "ChangeAccumulator") -> "ChangeAccumulator":
+        """Fold another accumulator's totals into this one"""
+        self.change_pixels += other.change_pixels
+        self.total_pixels += other.total_pixels
+        self.ndvi_before_sum += other.ndvi_before_sum
+        self.ndvi_after_sum += other.ndvi_after_sum
+        self.skipped_pixels += other.skipped_pixels
+        return self
+
+    def to_dict(self) -> Dict:
+        """Raw totals as a JSON-friendly dict, e.g. to merge results of other processes"""
+        return {
+            "change_pixels": self.change_pixels,
+            "total_pixels": self.total_pixels,
+            "ndvi_before_sum": self.ndvi_before_sum,
+            "ndvi_after_sum": self.ndvi_after_sum,
+            "skipped_pixels": self.skipped_pixels
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ChangeAccumulator":
+        accumulator = cls()
+        accumulator.change_pixels = int(data["change_pixels"])
+        accumulator.total_pixels = int(data["total_pixels"])
+        accumulator.ndvi_before_sum = float(data["ndvi_before_sum"])
+        accumulator.ndvi_after_sum = float(data["ndvi_after_sum"])
+        accumulator.skipped_pixels = int(data.get("skipped_pixels", 0))
+        return accumulator
+
+    @property
+    def change_percentage(self) -> float:
+        return (self.change_pixels / self.total_pixels) * 100 if self.total_pixels else 0.0
+
+    @property
+    def ndvi_before_mean(self) -> float:
+        return self.ndvi_before_sum / self.total_pixels if self.total_pixels else 0.0
+
+    @property
+    def ndvi_after_mean(self) -> float:
+        return self.ndvi_after_sum / self.total_pixels if self.total_pixels else 0.0
+
+
+class LabelAccumulator:
+    """
+    Per-label change statistics for a label raster (0 = unlabelled).
+    Each tile is reduced with a handful of ``np.bincount`` calls, so the
+    cost does not depend on how many labels the tile contains.
+    """
+
+    def __init__(self, n_labels: int):
+        self.n_labels = n_labels
+        size = n_labels + 1
+        self.change_pixels = np.zeros(size, dtype=np.int64)
+        self.total_pixels = np.zeros(size, dtype=np.int64)
+        self.ndvi_before_sum = np.zeros(size, dtype=np.float64)
+        self.ndvi_after_sum = np.zeros(size, dtype=np.float64)
+
+    def update(self, labels: np.ndarray, ndvi_before: np.ndarray, ndvi_after: np.ndarray,
+               change_mask: np.ndarray):
+        """Add one tile; ``labels`` holds label ids in [0, n_labels]"""
+        size = self.n_labels + 1
+        labels = labels.ravel()
+        self.total_pixels += np.bincount(labels, minlength=size)
+        self.change_pixels += np.bincount(labels, weights=change_mask.ravel(), minlength=size).astype(np.int64)
+        self.ndvi_before_sum += np.bincount(labels, weights=ndvi_before.ravel(), minlength=size)
+        self.ndvi_after_sum += np.bincount(labels, weights=ndvi_after.ravel(), minlength=size)
+
+    def merge(self, other: "LabelAccumulator") -> "LabelAccumulator":
+        """Fold another accumulator's totals into this one"""
+        self.change_pixels += other.change_pixels
+        self.total_pixels += other.total_pixels
+        self.ndvi_before_sum += other.ndvi_before_sum
+        self.ndvi_after_sum += other.ndvi_after_sum
+        return self
+
+    def label_result(self, label: int) -> dict:
+        """Statistics for one label, in the engine's result format"""
+        total = int(self.total_pixels[label])
+        return {
+            "change_percentage": float(self.change_pixels[label] / total * 100) if total else 0.0,
+            "ndvi_before_mean": float(self.ndvi_before_sum[label] / total) if total else 0.0,
+            "ndvi_after_mean": float(self.ndvi_after_sum[label] / total) if total else 0.0,
+            "pixels_analyzed": total
+        }
+
+
+class RunningStatistics:
+    """
+    Mergeable summary of a stream of values: count, mean and variance
+    (Welford/Chan), min, max and a fixed-range histogram.
+
+    Partial statistics from tiles, threads or processes combine exactly
+    with ``merge``; the result does not depend on how the data was split
+    beyond floating point rounding.
+    """
+
+    def __init__(self, hist_bins: int = 50, hist_range: Tuple[float, float] = (0.0, 2.0)):
+        self.hist_bins = hist_bins
+        self.hist_range = hist_range
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.histogram = np.zeros(hist_bins, dtype=np.int64)
+
+    def update(self, values: np.ndarray, mask: Optional[np.ndarray] = None) -> "RunningStatistics":
+        """Add a batch of values (only those where ``mask`` is True, if given)"""
+        if mask is not None:
+            values = values[mask]
+        values = values.ravel()
+        if values.size == 0:
+            return self
+
+        batch = RunningStatistics(self.hist_bins, self.hist_range)
+        batch.count = int(values.size)
+        batch.mean = float(values.mean(dtype=np.float64))
+        deviations = values.astype(np.float64) - batch.mean
+        batch.m2 = float(np.dot(deviations, deviations))
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+
+        low, high = self.hist_range
+        # Values outside the range are clamped into the first/last bin
+        bins = ((values - low) * (self.hist_bins / (high - low))).astype(np.int64)
+        np.clip(bins, 0, self.hist_bins - 1, out=bins)
+        batch.histogram = np.bincount(bins, minlength=self.hist_bins)
+
+        return self.merge(batch)
+
+    def merge(self, other: "RunningStatistics") -> "RunningStatistics":
+        """Fold another summary into this one (Chan et al. parallel update)"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            self.histogram = other.histogram.copy()
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+        return self
+
+    @property
+    def variance(self) -> float:
+        """Population variance (matches ``np.var``)"""
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def histogram_dict(self) -> Dict:
+        """Histogram as JSON-friendly bin edges and counts"""
+        edges = np.linspace(self.hist_range[0], self.hist_range[1], self.hist_bins + 1)
+        return {"bin_edges": edges.tolist(), "counts": self.histogram.tolist()}
@@ -0,0 +1,193 @@
+"""
+Per-block validity index of a scene, built once at ingest
+"""
+
+import math
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.warp import transform_bounds
+from rasterio.windows import from_bounds
+
+from core.tiling import block_aligned_tile_shape, iter_windows
+
+# Fractions are stored with this many decimals; rounding never turns a
+# block with some valid or clear pixels into one with none
+FRACTION_DECIMALS = 4
+
+
+class TileIndex:
+    """
+    Valid and cloud fraction of every block of a scene.
+
+    ``valid_fraction`` is the share of a block's pixels that are not
+    nodata; ``cloud_fraction`` is the share of those valid pixels that are
+    bright enough to be cloud. A block is usable if it has a valid pixel
+    and (with ``skip_cloudy``) a valid pixel that is not cloud. The index
+    is a few KB of JSON, so it is stored with the image record and lets
+    the engines drop tiles before decoding them.
+    """
+
+    VERSION = 1
+
+    def __init__(self, crs, transform: Affine, width: int, height: int,
+                 block_width: int, block_height: int, valid_fraction: np.ndarray,
+                 cloud_fraction: np.ndarray, mtime_ns: Optional[int] = None,
+                 size: Optional[int] = None):
+        self.crs = CRS.from_user_input(crs)
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self.block_width = block_width
+        self.block_height = block_height
+        self.valid_fraction = np.asarray(valid_fraction, dtype=np.float32)
+        self.cloud_fraction = np.asarray(cloud_fraction, dtype=np.float32)
+        self.mtime_ns = mtime_ns
+        self.size = size
+
+    def usable_blocks(self, skip_cloudy: bool = True) -> np.ndarray:
+        """Boolean (block row, block col) grid of blocks that can yield valid pixels"""
+        usable = self.valid_fraction > 0
+        if skip_cloudy:
+            usable &= self.cloud_fraction < 1
+        return usable
+
+    def usable(self, bounds: Tuple[float, float, float, float], crs=None,
+               skip_cloudy: bool = True) -> bool:
+        """
+        Whether any block under ``bounds`` (in ``crs``, default the scene
+        CRS) can yield valid pixels. Unless the bounds fall on whole scene
+        pixels, the area is widened by a pixel so resampling kernels at its
+        edge are covered.
+        """
+        reprojected = crs is not None and CRS.from_user_input(crs) != self.crs
+        if reprojected:
+            bounds = transform_bounds(crs, self.crs, *bounds, densify_pts=21)
+
+        window = from_bounds(*bounds, transform=self.transform)
+        edges = (window.col_off, window.row_off, window.col_off + window.width, window.row_off + window.height)
+        aligned = not reprojected and all(abs(edge - round(edge)) < 1e-6 for edge in edges)
+        margin = 0 if aligned else 1
+
+        col_start = max(0, math.floor(edges[0] + 1e-6) - margin) // self.block_width
+        row_start = max(0, math.floor(edges[1] + 1e-6) - margin) // self.block_height
+        col_stop = min(self.width, math.ceil(edges[2] - 1e-6) + margin)
+        row_stop = min(self.height, math.ceil(edges[3] - 1e-6) + margin)
+        if col_stop <= 0 or row_stop <= 0:
+            return False
+
+        blocks = self.usable_blocks(skip_cloudy)[
+            row_start:math.ceil(row_stop / self.block_height),
+            col_start:math.ceil(col_stop / self.block_width)
+        ]
+        return bool(blocks.any())
+
+    def coverage(self, skip_cloudy: bool = True) -> float:
+        """Fraction of blocks that are usable"""
+        return float(self.usable_blocks(skip_cloudy).mean())
+
+    def is_current(self, image_path: str) -> bool:
+        """Whether the index was built from the scene file as it is now"""
+        if self.mtime_ns is None:
+            return True
+        stat = os.stat(image_path)
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+    def to_dict(self) -> Dict:
+        """JSON-friendly form, as stored in ``SatelliteImage.tile_index``"""
+        return {
+            "version": self.VERSION,
+            "crs": self.crs.to_wkt(),
+            "transform": list(self.transform)[:6],
+            "width": self.width,
+            "height": self.height,
+            "block_width": self.block_width,
+            "block_height": self.block_height,
+            "valid_fraction": self.valid_fraction.tolist(),
+            "cloud_fraction": self.cloud_fraction.tolist(),
+            "mtime_ns": self.mtime_ns,
+            "size": self.size
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "TileIndex":
+        return cls(
+            data["crs"], Affine(*data["transform"]), data["width"], data["height"],
+            data["block_width"], data["block_height"],
+            data["valid_fraction"], data["cloud_fraction"],
+            data.get("mtime_ns"), data.get("size")
+        )
+
+
+def build_tile_index(image_path: str, block_size: int = 256, brightness_threshold: float = 0.7,
+                     reflectance_scale: Optional[float] = None) -> TileIndex:
+    """
+    Build the index of a scene in one pass over its blocks.
+
+    A pixel is nodata where every band equals the dataset's nodata value
+    (0 when none is set). Cloud is the brightness test of the cloud masker:
+    the mean of the first three bands, divided by ``reflectance_scale``,
+    above ``brightness_threshold``. The default scale follows the dtype
+    (255 for 8-bit, 10000 for 16-bit surface reflectance, 1 for floats).
+
+    Blocks are the dataset's internal blocks grouped into roughly
+    ``block_size`` pixel tiles.
+    """
+    with rasterio.open(image_path) as src:
+        if reflectance_scale is None:
+            reflectance_scale = _default_reflectance_scale(src.dtypes[0])
+        nodata = src.nodata if src.nodata is not None else 0
+        block_width, block_height = block_aligned_tile_shape(src, block_size)
+
+        rows = math.ceil(src.height / block_height)
+        cols = math.ceil(src.width / block_width)
+        valid_fraction = np.zeros((rows, cols), dtype=np.float64)
+        cloud_fraction = np.zeros((rows, cols), dtype=np.float64)
+        bright_bands = list(range(1, min(src.count, 3) + 1))
+
+        for window, _ in iter_windows(src.width, src.height, block_width, block_height):
+            data = src.read(window=window)
+            if math.isnan(nodata):
+                valid = ~np.isnan(data).all(axis=0)
+            else:
+                valid = (data != nodata).any(axis=0)
+
+            row, col = int(window.row_off) // block_height, int(window.col_off) // block_width
+            n_valid = int(np.count_nonzero(valid))
+            valid_fraction[row, col] = n_valid / valid.size
+            if n_valid:
+                brightness = data[[band - 1 for band in bright_bands]].mean(axis=0, dtype=np.float32)
+                bright = brightness[valid] > brightness_threshold * reflectance_scale
+                cloud_fraction[row, col] = np.count_nonzero(bright) / n_valid
+
+        stat = os.stat(image_path)
+        scale = 10 ** FRACTION_DECIMALS
+        return TileIndex(
+            src.crs, src.transform, src.width, src.height, block_width, block_height,
+            np.ceil(valid_fraction * scale) / scale, np.floor(cloud_fraction * scale) / scale,
+            stat.st_mtime_ns, stat.st_size
+        )
+
+
+def _default_reflectance_scale(dtype: str) -> float:
+    if dtype == "uint8":
+        return 255.0
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        return 10000.0
+    return 1.0
+
+
+def tile_index_from_config(image_path: str, config: Dict) -> TileIndex:
+    """Build a scene's index with the ``detection.tile_index`` settings"""
+    settings = config.get('detection', {}).get('tile_index', {})
+    cloud = config.get('detection', {}).get('cloud', {})
+    return build_tile_index(
+        image_path,
+        block_size=settings.get('block_size', 256),
+        brightness_threshold=cloud.get('brightness_threshold', 0.7),
+        reflectance_scale=settings.get('reflectance_scale')
+    )
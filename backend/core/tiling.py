@@ -0,0 +1,66 @@
+"""
+Window iteration helpers for tile-by-tile raster processing
+"""
+
+from typing import Iterator, Tuple
+
+from rasterio.windows import Window
+
+
+def block_aligned_tile_shape(src, tile_size: int) -> Tuple[int, int]:
+    """
+    Pick a (tile_width, tile_height) close to tile_size x tile_size that is a
+    whole multiple of the dataset's internal block shape, so every window read
+    decodes complete blocks only.
+
+    Striped rasters (blocks spanning the full width) get full-width windows
+    with enough rows to keep the tile area near tile_size ** 2.
+    """
+    block_height, block_width = src.block_shapes[0]
+
+    if block_width >= src.width:
+        rows = max(1, (tile_size * tile_size) // src.width)
+        tile_height = max(block_height, rows // block_height * block_height)
+        return src.width, min(tile_height, src.height)
+
+    tile_width = max(block_width, tile_size // block_width * block_width)
+    tile_height = max(block_height, tile_size // block_height * block_height)
+    return min(tile_width, src.width), min(tile_height, src.height)
+
+
+def iter_windows(width: int, height: int, tile_width: int, tile_height: int = None,
+                 overlap: int = 0, col_off: int = 0,
+                 row_off: int = 0) -> Iterator[Tuple[Window, Tuple[slice, slice]]]:
+    """
+    Yield (window, core) pairs covering a width x height region.
+
+    Args:
+        width, height: Size of the region to cover
+        tile_width, tile_height: Tile size without overlap (height defaults to width)
+        overlap: Halo added on every side of a tile, clipped to the region
+        col_off, row_off: Offset of the region inside the dataset
+
+    Returns:
+        Iterator of (window, core): ``window`` is the read window including the
+        halo, ``core`` is the (rows, cols) slice pair selecting the tile's own
+        pixels inside the array read for ``window``. Cores never overlap, so
+        statistics accumulated over cores count every pixel exactly once.
+    """
+    tile_height = tile_height or tile_width
+
+    for row in range(0, height, tile_height):
+        core_height = min(tile_height, height - row)
+        top = max(0, row - overlap)
+        bottom = min(height, row + core_height + overlap)
+
+        for col in range(0, width, tile_width):
+            core_width = min(tile_width, width - col)
+            left = max(0, col - overlap)
+            right = min(width, col + core_width + overlap)
+
+            window = Window(col_off + left, row_off + top, right - left, bottom - top)
+            core = (
+                slice(row - top, row - top + core_height),
+                slice(col - left, col - left + core_width),
+            )
+            yield window, core
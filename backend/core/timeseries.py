@@ -0,0 +1,172 @@
+"""
+Per-pixel harmonic trend and breakpoint analysis of NDVI time series
+"""
+
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Days per year used to express acquisition dates as decimal years
+DAYS_PER_YEAR = 365.25
+
+
+def decimal_years(dates: Sequence[datetime]) -> np.ndarray:
+    """Acquisition dates as years since the first date"""
+    start = dates[0]
+    return np.array([(date - start).total_seconds() / 86400 / DAYS_PER_YEAR for date in dates])
+
+
+def design_matrix(t: np.ndarray, harmonics: int) -> np.ndarray:
+    """Columns: intercept, linear trend, then a cos/sin pair per annual harmonic"""
+    columns = [np.ones_like(t), t]
+    for k in range(1, harmonics + 1):
+        columns += [np.cos(2 * np.pi * k * t), np.sin(2 * np.pi * k * t)]
+    return np.stack(columns, axis=1)
+
+
+def _cumsum_dates(values: np.ndarray) -> np.ndarray:
+    """Cumulative sum over axis 0 in place, one contiguous row at a time"""
+    for index in range(1, len(values)):
+        values[index] += values[index - 1]
+    return values
+
+
+class HarmonicAnalyzer:
+    """
+    Least-squares fit of trend + annual harmonics to every pixel of an
+    NDVI cube, vectorized over the pixels of a chunk.
+
+    Each pixel gets its own fit over its valid (non-NaN) dates by solving
+    the batched weighted normal equations, so cloud gaps need no special
+    casing. Residuals then feed an OLS-CUSUM test: the date where the
+    cumulative standardized residual peaks is the breakpoint candidate, and
+    it is significant when the peak exceeds ``breakpoint_critical`` (1.36 is
+    the 5% level of the supremum of a Brownian bridge). The last valid
+    date's residual, in units of the fit RMSE, is the seasonally adjusted
+    anomaly.
+
+    With ``harmonics=0`` only the trend is removed, i.e. no seasonal filter.
+    """
+
+    OUTPUTS = ("trend", "rmse", "observations", "breakpoint", "breakpoint_magnitude",
+               "cusum", "latest_anomaly", "change")
+
+    def __init__(self, dates: Sequence[datetime], harmonics: int = 2,
+                 breakpoint_critical: float = 1.36, anomaly_z: float = 3.0):
+        self.dates = list(dates)
+        self.harmonics = harmonics
+        self.breakpoint_critical = breakpoint_critical
+        self.anomaly_z = anomaly_z
+        self.design = design_matrix(decimal_years(self.dates), harmonics)
+
+    @property
+    def n_params(self) -> int:
+        return self.design.shape[1]
+
+    @property
+    def min_observations(self) -> int:
+        """Valid dates a pixel needs to be fitted"""
+        return self.n_params + 2
+
+    def empty_outputs(self, shape) -> Dict[str, np.ndarray]:
+        """Output rasters for a grid, filled with their no-result values"""
+        return {
+            "trend": np.full(shape, np.nan, dtype=np.float32),
+            "rmse": np.full(shape, np.nan, dtype=np.float32),
+            "observations": np.zeros(shape, dtype=np.uint16),
+            "breakpoint": np.full(shape, -1, dtype=np.int16),
+            "breakpoint_magnitude": np.full(shape, np.nan, dtype=np.float32),
+            "cusum": np.full(shape, np.nan, dtype=np.float32),
+            "latest_anomaly": np.full(shape, np.nan, dtype=np.float32),
+            "change": np.zeros(shape, dtype=bool)
+        }
+
+    def analyze(self, cube: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Analyze one chunk.
+
+        Args:
+            cube: NDVI (dates, height, width), NaN where a date is invalid
+
+        Returns:
+            Dict of (height, width) rasters named as in ``OUTPUTS``
+        """
+        n_dates, height, width = cube.shape
+        X = self.design
+        p = self.n_params
+
+        Y = cube.reshape(n_dates, -1).astype(np.float64)
+        W = ~np.isnan(Y)
+        Y[~W] = 0
+        weights = W.astype(np.float64)
+        n_obs = W.sum(axis=0)
+        fitted = n_obs >= self.min_observations
+
+        # Batched weighted normal equations, one p x p system per pixel
+        pair_products = (X[:, :, None] * X[:, None, :]).reshape(n_dates, p * p)
+        A = (weights.T @ pair_products).reshape(-1, p, p)
+        A[~fitted] = np.eye(p)
+        A += 1e-9 * np.eye(p)
+        b = X.T @ Y
+        beta = np.linalg.solve(A, b.T[..., None])[..., 0]
+
+        residuals = Y - X @ beta.T
+        residuals *= weights
+        dof = np.maximum(n_obs - p, 1)
+        rmse = np.sqrt((residuals ** 2).sum(axis=0) / dof)
+        scale = np.maximum(rmse, 1e-6)
+
+        # OLS-CUSUM of the residuals; gaps contribute nothing
+        cumulative = _cumsum_dates(residuals.copy())
+        process = np.abs(cumulative) / (scale * np.sqrt(np.maximum(n_obs, 1)))
+        breakpoint = process.argmax(axis=0)
+        cusum = process.max(axis=0)
+
+        pixels = np.arange(Y.shape[1])
+        seen = _cumsum_dates(weights)[breakpoint, pixels]
+        before = cumulative[breakpoint, pixels] / np.maximum(seen, 1)
+        after = (cumulative[-1] - cumulative[breakpoint, pixels]) / np.maximum(n_obs - seen, 1)
+        significant = fitted & (cusum > self.breakpoint_critical) & (seen < n_obs)
+
+        last = n_dates - 1 - W[::-1].argmax(axis=0)
+        latest_anomaly = residuals[last, pixels] / scale
+        change = significant | (fitted & (np.abs(latest_anomaly) > self.anomaly_z))
+
+        def raster(values, dtype, fill=np.nan):
+            values = np.where(fitted, values, fill)
+            return values.astype(dtype).reshape(height, width)
+
+        return {
+            "trend": raster(beta[:, 1], np.float32),
+            "rmse": raster(rmse, np.float32),
+            "observations": n_obs.astype(np.uint16).reshape(height, width),
+            "breakpoint": np.where(significant, breakpoint, -1).astype(np.int16).reshape(height, width),
+            "breakpoint_magnitude": np.where(significant, after - before, np.nan)
+                                      .astype(np.float32).reshape(height, width),
+            "cusum": raster(cusum, np.float32),
+            "latest_anomaly": raster(latest_anomaly, np.float32),
+            "change": change.reshape(height, width)
+        }
+
+
+def write_netcdf(path: str, outputs: Dict[str, np.ndarray], dates: List[datetime],
+                 transform, crs, attrs: Optional[Dict] = None):
+    """Write the analysis rasters as a netCDF dataset with x/y pixel-centre coordinates"""
+    import xarray as xr
+
+    height, width = outputs["trend"].shape
+    xs = transform.c + transform.a * (np.arange(width) + 0.5)
+    ys = transform.f + transform.e * (np.arange(height) + 0.5)
+
+    data_vars = {
+        name: (("y", "x"), values.astype(np.uint8) if values.dtype == bool else values)
+        for name, values in outputs.items()
+    }
+    dataset = xr.Dataset(
+        data_vars,
+        coords={"y": ys, "x": xs, "date": np.array(dates, dtype="datetime64[ns]")},
+        attrs=dict(attrs or {}, crs=crs.to_wkt(), transform=list(transform)[:6])
+    )
+    dataset["breakpoint"].attrs["description"] = "Index into 'date' of the significant breakpoint, -1 if none"
+    dataset.to_netcdf(path)
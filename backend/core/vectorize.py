@@ -0,0 +1,167 @@
+"""
+Change-polygon vectorization with minimum mapping unit and simplification
+"""
+
+import json
+import math
+from itertools import groupby
+from typing import Callable, Dict, Iterator, Optional
+
+import numpy as np
+from loguru import logger
+from rasterio.crs import CRS
+from rasterio.features import shapes
+from rasterio.warp import transform_geom
+from rasterio.windows import Window
+from rasterio.windows import bounds as window_bounds
+from rasterio.windows import transform as window_transform
+from shapely.geometry import mapping, shape
+from shapely.ops import unary_union
+
+from core.tiling import iter_windows
+
+# Metres per degree of latitude, used to express metric settings in degrees
+METERS_PER_DEGREE = 111320.0
+
+
+class ChangeVectorizer:
+    """
+    Turns a boolean change mask into GeoJSON polygons, tile by tile.
+
+    Polygons entirely inside a tile are filtered by ``min_area_m2``,
+    simplified (topology preserving) and emitted straight away. Fragments
+    that touch an interior tile edge are dissolved at the end of each row
+    of tiles, together with the polygons carried over from the row above;
+    only the dissolved polygons touching the next row are carried on, the
+    rest are emitted. Memory is bounded by one row of tiles plus the
+    polygons crossing its lower seam.
+    """
+
+    def __init__(self, min_area_m2: float = 500.0, simplify_tolerance_m: float = 10.0,
+                 tile_size: int = 1024, dst_crs: str = "EPSG:4326"):
+        self.min_area_m2 = min_area_m2
+        self.simplify_tolerance_m = simplify_tolerance_m
+        self.tile_size = tile_size
+        self.dst_crs = CRS.from_user_input(dst_crs)
+
+    def iter_features(self, read_window: Callable[[Window], np.ndarray], width: int, height: int,
+                      transform, crs) -> Iterator[Dict]:
+        """
+        Yield GeoJSON features for a mask.
+
+        Args:
+            read_window: Returns the boolean mask for a window
+            width, height: Mask size in pixels
+            transform, crs: Georeferencing of the mask
+        """
+        crs = CRS.from_user_input(crs)
+        area_factor, length_factor = self._metric_factors(crs, transform, width, height)
+        min_area = self.min_area_m2 / area_factor
+        tolerance = self.simplify_tolerance_m / length_factor
+
+        carried = []
+        for row_off, row in groupby(iter_windows(width, height, self.tile_size),
+                                    key=lambda item: item[0].row_off):
+            seam_parts = list(carried)
+            row_bottom = None
+            for window, _ in row:
+                left, bottom, right, top = window_bounds(window, transform)
+                row_bottom = bottom
+                mask = np.ascontiguousarray(read_window(window), dtype=np.uint8)
+                if not mask.any():
+                    continue
+
+                interior_edges = (
+                    window.col_off > 0, window.row_off + window.height < height,
+                    window.col_off + window.width < width, window.row_off > 0
+                )
+
+                for geometry, _ in shapes(mask, mask=mask.astype(bool),
+                                          transform=window_transform(window, transform)):
+                    polygon = shape(geometry)
+                    minx, miny, maxx, maxy = polygon.bounds
+                    on_seam = (
+                        (interior_edges[0] and math.isclose(minx, left)) or
+                        (interior_edges[1] and math.isclose(miny, bottom)) or
+                        (interior_edges[2] and math.isclose(maxx, right)) or
+                        (interior_edges[3] and math.isclose(maxy, top))
+                    )
+                    if on_seam:
+                        seam_parts.append(polygon)
+                        continue
+
+                    feature = self._feature(polygon, min_area, tolerance, area_factor, crs)
+                    if feature is not None:
+                        yield feature
+
+            # Dissolve this row's seam fragments with the polygons carried
+            # into it; those reaching the next row wait for its fragments
+            carried = []
+            if not seam_parts:
+                continue
+            merged = unary_union(seam_parts)
+            last_row = row_off + self.tile_size >= height
+            for polygon in getattr(merged, "geoms", [merged]):
+                if not last_row and math.isclose(polygon.bounds[1], row_bottom):
+                    carried.append(polygon)
+                    continue
+                feature = self._feature(polygon, min_area, tolerance, area_factor, crs)
+                if feature is not None:
+                    yield feature
+
+    def write_geojson(self, path: str, read_window: Callable[[Window], np.ndarray],
+                      width: int, height: int, transform, crs) -> Dict:
+        """Stream the features of a mask into a GeoJSON FeatureCollection file"""
+        count = 0
+        with open(path, "w") as f:
+            f.write('{"type": "FeatureCollection", "features": [')
+            for feature in self.iter_features(read_window, width, height, transform, crs):
+                f.write(("," if count else "") + "\n" + json.dumps(feature))
+                count += 1
+            f.write("\n]}\n")
+
+        logger.info(f"Vectorized {count} change polygons to {path}")
+        return {"kind": "vector", "path": path, "count": count, "crs": self.dst_crs.to_string()}
+
+    def _feature(self, polygon, min_area: float, tolerance: float, area_factor: float,
+                 crs: CRS) -> Optional[Dict]:
+        """Filter, simplify and reproject one polygon into a GeoJSON feature"""
+        if polygon.area < min_area:
+            return None
+        if tolerance > 0:
+            polygon = polygon.simplify(tolerance, preserve_topology=True)
+
+        geometry = mapping(polygon)
+        if crs != self.dst_crs:
+            geometry = transform_geom(crs, self.dst_crs, geometry)
+        return {
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {"area_m2": round(polygon.area * area_factor, 1)}
+        }
+
+    def _metric_factors(self, crs: CRS, transform, width: int, height: int):
+        """(m² per CRS unit², m per CRS unit) near the centre of the mask"""
+        if not crs.is_geographic:
+            unit = crs.linear_units_factor[1] if crs.linear_units_factor else 1.0
+            return unit * unit, unit
+        _, latitude = transform * (width / 2, height / 2)
+        scale_x = METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        return scale_x * METERS_PER_DEGREE, METERS_PER_DEGREE
+
+
+def vectorizer_from_config(config: Dict, dst_crs: Optional[str] = None) -> ChangeVectorizer:
+    """Create a ChangeVectorizer from ``detection.vectorize``, optionally overriding its CRS"""
+    settings = config.get('detection', {}).get('vectorize', {})
+    processing = config.get('detection', {}).get('processing', {})
+    return ChangeVectorizer(
+        min_area_m2=settings.get('min_area_m2', 500.0),
+        simplify_tolerance_m=settings.get('simplify_tolerance_m', 10.0),
+        tile_size=settings.get('tile_size', 2 * processing.get('tile_size', 512)),
+        dst_crs=dst_crs or settings.get('crs', 'EPSG:4326')
+    )
+
+
+def raster_window_reader(src, band: int = 1) -> Callable[[Window], np.ndarray]:
+    """Window reader for a mask stored in an open rasterio dataset"""
+    return lambda window: src.read(band, window=window) > 0
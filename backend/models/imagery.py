@@ -31,6 +31,7 @@ class SatelliteImage(Base):
     
     # Image properties
     cloud_coverage = Column(Float, default=0.0)  # 0-100%
+    tile_index = Column(JSONB)  # per-block valid/cloud fractions, see core.tile_index
     resolution_meters = Column(Float)  # spatial resolution in meters
     bands_available = Column(JSONB)  # list of available bands
     
@@ -0,0 +1,104 @@
+"""
+Rolling NDVI baseline: scoring, updating and retrying failed updates
+"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from core.alignment import AlignedGrid
+from core.baseline import BaselineStore
+from core.engine import ChangeDetectionEngine
+
+GRID = AlignedGrid("EPSG:32643", from_origin(500000, 2000000, 10, 10), 8, 8)
+FULL = Window(0, 0, 8, 8)
+
+
+def fold(baseline, scene_id, ndvi, valid=None):
+    baseline.stage()
+    baseline.update(FULL, ndvi, np.ones(ndvi.shape, dtype=bool) if valid is None else valid)
+    baseline.commit(scene_id)
+
+
+def test_score_flags_departures_from_the_baseline(tmp_path):
+    store = BaselineStore(str(tmp_path))
+    baseline = store.create("aoi", GRID)
+    for index, value in enumerate((0.60, 0.62, 0.58, 0.61)):
+        fold(baseline, f"scene-{index}", np.full((8, 8), value, dtype=np.float32))
+
+    ndvi = np.full((8, 8), 0.6, dtype=np.float32)
+    ndvi[:4] = 0.2
+    stats, change = baseline.score(FULL, ndvi, np.ones((8, 8), dtype=bool), min_scenes=3,
+                                   z_threshold=3.0, min_ndvi_change=0.1)
+
+    assert change[:4].all() and not change[4:].any()
+    assert stats.total_pixels == 64
+    assert stats.ndvi_before_mean == pytest.approx(0.6025, abs=1e-5)
+
+
+def test_update_skips_invalid_pixels(tmp_path):
+    baseline = BaselineStore(str(tmp_path)).create("aoi", GRID)
+    valid = np.ones((8, 8), dtype=bool)
+    valid[:, :2] = False
+    fold(baseline, "scene", np.zeros((8, 8), dtype=np.float32), valid)
+
+    reopened = BaselineStore(str(tmp_path)).open("aoi")
+    count = reopened._arrays["count"]
+    assert not count[:, :2].any() and (count[:, 2:] == 1).all()
+    assert reopened.scenes == ["scene"]
+
+
+def test_failed_update_leaves_the_baseline_unchanged(tmp_path):
+    store = BaselineStore(str(tmp_path))
+    fold(store.create("aoi", GRID), "first", np.full((8, 8), 0.5, dtype=np.float32))
+
+    # A run that stages and updates but fails before committing
+    baseline = store.open("aoi")
+    baseline.stage()
+    baseline.update(FULL, np.full((8, 8), 0.9, dtype=np.float32), np.ones((8, 8), dtype=bool))
+    baseline.close()
+
+    baseline = store.open("aoi")
+    assert baseline.scenes == ["first"]
+    assert (baseline._arrays["count"] == 1).all()
+    assert np.allclose(baseline._arrays["mean"], 0.5)
+
+    fold(baseline, "second", np.full((8, 8), 0.9, dtype=np.float32))
+    reopened = store.open("aoi")
+    assert (reopened._arrays["count"] == 2).all()
+    assert np.allclose(reopened._arrays["mean"], 0.7)
+    assert [entry.name for entry in (tmp_path / "aoi").glob("gen-*")] == ["gen-2"]
+
+
+def test_engine_retry_counts_a_scene_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "scene.tif")
+    data = np.full((4, 128, 128), 1000, dtype=np.uint16)
+    data[3] = 3000
+    with rasterio.open(path, "w", driver="GTiff", width=128, height=128, count=4, dtype="uint16",
+                       crs="EPSG:32643", transform=from_origin(500000, 2000000, 10, 10)) as dst:
+        dst.write(data)
+
+    engine = ChangeDetectionEngine({
+        "storage": {"base_path": str(tmp_path / "data")},
+        "detection": {"processing": {"tile_size": 64, "max_workers": 1}}
+    })
+    process = ChangeDetectionEngine._process_baseline_window
+    calls = []
+
+    def failing(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 3:
+            raise OSError("disk full")
+        return process(self, *args, **kwargs)
+
+    monkeypatch.setattr(ChangeDetectionEngine, "_process_baseline_window", failing)
+    assert engine.detect_changes_baseline(path, "aoi")["status"] == "error"
+    monkeypatch.setattr(ChangeDetectionEngine, "_process_baseline_window", process)
+
+    result = engine.detect_changes_baseline(path, "aoi")
+    assert result["status"] == "success" and result["baseline_updated"]
+    baseline = engine.baseline_store.open("aoi")
+    assert baseline.n_scenes == 1
+    assert (baseline._arrays["count"] == 1).all()
@@ -0,0 +1,132 @@
+"""
+Job fingerprints and the fingerprint-to-task registry
+"""
+
+import celery.result
+import pytest
+
+import api.detection
+from core.fingerprint import JobRegistry
+
+
+class FakeRedis:
+    """The few Redis commands JobRegistry uses, with a settable clock"""
+
+    def __init__(self):
+        self.now = 0
+        self.values = {}
+        self.expires = {}
+
+    def _live(self, key):
+        if key in self.expires and self.expires[key] <= self.now:
+            self.values.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.values
+
+    def get(self, key):
+        return self.values[key].encode() if self._live(key) else None
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and self._live(key):
+            return None
+        self.values[key] = value
+        self.expires.pop(key, None)
+        if ex is not None:
+            self.expires[key] = self.now + ex
+        return True
+
+    def ttl(self, key):
+        if not self._live(key):
+            return -2
+        return self.expires[key] - self.now if key in self.expires else -1
+
+    def eval(self, script, numkeys, key, value):
+        # _RELEASE_SCRIPT: delete the key if it still holds value
+        if self._live(key) and self.values[key] == value:
+            del self.values[key]
+            self.expires.pop(key, None)
+            return 1
+        return 0
+
+
+@pytest.fixture
+def registry():
+    return JobRegistry(FakeRedis(), ttl=86400, stale_after=600)
+
+
+def test_fingerprint_follows_content_and_parameters(registry, tmp_path):
+    before, after = tmp_path / "before.tif", tmp_path / "after.tif"
+    before.write_bytes(b"before")
+    after.write_bytes(b"after")
+    paths = [str(before), str(after)]
+
+    fingerprint = registry.fingerprint(paths, None, {"threshold": 0.2})
+    assert registry.fingerprint(paths, None, {"threshold": 0.2}) == fingerprint
+    assert registry.fingerprint(paths[::-1], None, {"threshold": 0.2}) != fingerprint
+    assert registry.fingerprint(paths, b"aoi", {"threshold": 0.2}) != fingerprint
+    assert registry.fingerprint(paths, None, {"threshold": 0.3}) != fingerprint
+
+    after.write_bytes(b"changed")
+    assert registry.fingerprint(paths, None, {"threshold": 0.2}) != fingerprint
+
+
+def test_claim_and_release(registry):
+    assert registry.claim("job", "task-1") is None
+    assert registry.claim("job", "task-2") == "task-1"
+
+    assert not registry.release("job", "task-2")
+    assert registry.claim("job", "task-2") == "task-1"
+
+    assert registry.release("job", "task-1")
+    assert registry.claim("job", "task-2") is None
+
+
+def test_claims_go_stale(registry):
+    assert registry.claim_age("job") is None
+    registry.claim("job", "task-1")
+
+    registry.client.now += 600
+    assert registry.claim_age("job") == 600 and not registry.is_stale("job")
+    registry.client.now += 1
+    assert registry.is_stale("job")
+
+
+class FakeAsyncResult:
+    states = {}
+
+    def __init__(self, task_id):
+        self.state = self.states.get(task_id, "PENDING")
+        self.result = {"status": "success"} if self.state == "SUCCESS" else None
+
+    def ready(self):
+        return self.state in ("SUCCESS", "FAILURE")
+
+    def successful(self):
+        return self.state == "SUCCESS"
+
+
+@pytest.fixture
+def reuse(registry, monkeypatch):
+    monkeypatch.setattr(api.detection, "get_job_registry", lambda: registry)
+    monkeypatch.setattr(celery.result, "AsyncResult", FakeAsyncResult)
+    monkeypatch.setattr(FakeAsyncResult, "states", {})
+    return api.detection.reuse_detection_job
+
+
+def test_running_job_is_reused_until_stale(registry, reuse):
+    assert reuse("job", "task-1") is None
+    assert reuse("job", "task-2")["task_id"] == "task-1"
+
+    registry.client.now += 601
+    assert reuse("job", "task-3") is None
+    assert registry.claim("job", "task-4") == "task-3"
+
+
+def test_finished_jobs(registry, reuse):
+    reuse("job", "task-1")
+    FakeAsyncResult.states["task-1"] = "SUCCESS"
+    assert reuse("job", "task-2")["status"] == "completed"
+
+    FakeAsyncResult.states["task-1"] = "FAILURE"
+    assert reuse("job", "task-3") is None
+    assert registry.claim("job", "task-4") == "task-3"
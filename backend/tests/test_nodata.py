@@ -0,0 +1,73 @@
+"""
+Pixel validity comes from the scenes' nodata, not from the NDVI value
+"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from core.engine import ChangeDetectionEngine
+
+SIZE = 256
+
+
+def write_scene(path, data, nodata=None):
+    profile = {
+        "driver": "GTiff", "width": SIZE, "height": SIZE, "count": data.shape[0],
+        "dtype": "uint16", "crs": "EPSG:32643", "transform": from_origin(500000, 2000000, 10, 10),
+        "nodata": nodata
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+
+
+def scene_pair():
+    rng = np.random.default_rng(0)
+    before = rng.integers(500, 3000, size=(4, SIZE, SIZE), dtype=np.uint16)
+    # NDVI is exactly 0 in the top half before, then rises by at least 0.25
+    before[3, :SIZE // 2] = before[2, :SIZE // 2]
+    after = before.copy()
+    after[3, :SIZE // 2] += 2000
+    return before, after
+
+
+def engine(tmp_path, pyramid=False, cache=False):
+    return ChangeDetectionEngine({
+        "storage": {"temp_path": str(tmp_path / "temp")},
+        "detection": {"processing": {
+            "tile_size": 64, "max_workers": 1, "pyramid": {"enabled": pyramid},
+            "ndvi_cache": {"enabled": cache}
+        }}
+    })
+
+
+@pytest.mark.parametrize("pyramid", [False, True])
+@pytest.mark.parametrize("cache", [False, True])
+def test_zero_ndvi_pixels_are_valid(tmp_path, pyramid, cache):
+    before, after = scene_pair()
+    paths = (str(tmp_path / "before.tif"), str(tmp_path / "after.tif"))
+    write_scene(paths[0], before)
+    write_scene(paths[1], after)
+
+    detector = engine(tmp_path, pyramid, cache)
+    for _ in range(2 if cache else 1):
+        result = detector.detect_changes(*paths)
+        assert result["status"] == "success"
+        assert result["pixels_analyzed"] == SIZE * SIZE
+        assert result["change_percentage"] == pytest.approx(50.0)
+
+
+def test_nodata_pixels_are_left_out(tmp_path):
+    before, after = scene_pair()
+    after[:, SIZE // 2:, :SIZE // 4] = 65535
+    paths = (str(tmp_path / "before.tif"), str(tmp_path / "after.tif"))
+    write_scene(paths[0], before, nodata=65535)
+    write_scene(paths[1], after, nodata=65535)
+
+    result = engine(tmp_path).detect_changes(*paths)
+
+    assert result["status"] == "success"
+    analyzed = SIZE * SIZE - (SIZE // 2) * (SIZE // 4)
+    assert result["pixels_analyzed"] == analyzed
+    assert result["change_percentage"] == pytest.approx(100.0 * (SIZE * SIZE // 2) / analyzed)
@@ -0,0 +1,65 @@
+"""
+Compressed result encoding and out-of-band storage of large results
+"""
+
+import numpy as np
+import pytest
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+
+import worker  # noqa: F401  registers the msgpack-zlib serializer
+from core.result_store import FileResultStore, dumps, loads, result_store_from_config
+
+
+def test_round_trip_converts_numpy_values():
+    result = {"status": "success", "change_percentage": np.float32(12.5),
+              "counts": np.arange(3, dtype=np.int64), "shape": (2, 3), 7: "int key"}
+
+    decoded = loads(dumps(result))
+
+    assert decoded == {"status": "success", "change_percentage": 12.5,
+                       "counts": [0, 1, 2], "shape": [2, 3], 7: "int key"}
+
+
+def test_celery_serializer_round_trip():
+    result = {"status": "success", "values": list(range(1000))}
+
+    content_type, encoding, data = kombu_dumps(result, serializer="msgpack-zlib")
+
+    assert len(data) < len(repr(result))
+    assert kombu_loads(data, content_type, encoding) == result
+
+
+def test_small_results_stay_inline(tmp_path):
+    store = FileResultStore(str(tmp_path), inline_max_bytes=1024)
+    result = {"status": "success", "change_percentage": 1.5}
+
+    assert store.offload(result, "task-1") is result
+    assert store.resolve(result) is result
+    assert not any(tmp_path.iterdir())
+
+
+def test_large_results_are_offloaded(tmp_path):
+    store = FileResultStore(str(tmp_path), inline_max_bytes=1024)
+    rng = np.random.default_rng(0)
+    result = {"status": "success", "change_percentage": 1.5,
+              "polygons": rng.random(5000).tolist()}
+
+    summary = store.offload(result, "task-1")
+
+    assert summary["status"] == "success" and summary["change_percentage"] == 1.5
+    assert "polygons" not in summary
+    assert summary["result_ref"]["key"] == "task-1"
+    assert store.resolve(summary) == result
+
+    store.delete(summary["result_ref"])
+    assert not (tmp_path / "ta" / "task-1.msgpack.z").exists()
+
+
+def test_store_from_config(tmp_path):
+    store = result_store_from_config({"storage": {"result_store": {
+        "path": str(tmp_path), "inline_max_kb": 8
+    }}})
+    assert isinstance(store, FileResultStore) and store.inline_max_bytes == 8192
+
+    with pytest.raises(ValueError):
+        result_store_from_config({"storage": {"result_store": {"backend": "s3"}}})
@@ -0,0 +1,54 @@
+"""
+Size-aware routing of detection tasks
+"""
+
+import pytest
+
+from core.routing import (
+    BATCH_QUEUE, LARGE_QUEUE, SMALL_QUEUE, QueueRouter, queue_router_from_config
+)
+
+SCENE = {"pixels": 100_000_000, "pixel_area_m2": 100.0}
+
+
+@pytest.fixture
+def router():
+    return QueueRouter(large_pixels=50_000_000)
+
+
+def test_large_scenes_go_to_the_large_queue(router):
+    assert router.route(SCENE)["queue"] == LARGE_QUEUE
+    assert router.route({"pixels": 1_000_000, "pixel_area_m2": 100.0})["queue"] == SMALL_QUEUE
+
+
+def test_aoi_area_caps_the_estimate(router):
+    route = router.route(SCENE, area_hectares=1000)
+    assert route["estimated_pixels"] == 100_000
+    assert route["queue"] == SMALL_QUEUE
+
+    # Geographic scenes convert the area with pixel_size_m
+    route = router.route({"pixels": 100_000_000, "pixel_area_m2": None}, area_hectares=100_000)
+    assert route["estimated_pixels"] == 10_000_000
+
+
+def test_unestimated_and_batch_jobs(router):
+    assert router.route() == {"queue": SMALL_QUEUE, "priority": 0, "estimated_pixels": None}
+    assert router.route(SCENE, batch=True)["queue"] == BATCH_QUEUE
+
+
+def test_priorities(router):
+    assert router.route(trigger="user")["priority"] < router.route(trigger="scheduled")["priority"]
+    with pytest.raises(ValueError):
+        router.route(trigger="cron")
+
+
+def test_router_from_config():
+    router = queue_router_from_config({"detection": {"routing": {
+        "large_pixels": 10, "priorities": {"scheduled": 9},
+        "queues": {SMALL_QUEUE: {"concurrency": 4}, LARGE_QUEUE: {"concurrency": 1}}
+    }}})
+
+    assert router.route({"pixels": 11})["queue"] == LARGE_QUEUE
+    assert router.priority("scheduled") == 9 and router.priority("user") == 0
+    assert router.concurrency([LARGE_QUEUE, SMALL_QUEUE]) == 4
+    assert router.concurrency([BATCH_QUEUE]) is None
@@ -0,0 +1,80 @@
+"""
+A detection split with plan_detection and merged from its parts matches a single run
+"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from core.engine import ChangeDetectionEngine
+
+SIZE = 1000
+TILE = 128
+
+
+def write_scene(path, data):
+    profile = {
+        "driver": "GTiff", "width": SIZE, "height": SIZE, "count": data.shape[0],
+        "dtype": "uint16", "crs": "EPSG:32643", "transform": from_origin(500000, 2000000, 10, 10),
+        "tiled": True, "blockxsize": TILE, "blockysize": TILE
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+
+
+@pytest.fixture
+def scene_pair(tmp_path):
+    rng = np.random.default_rng(1)
+    before = rng.integers(500, 4000, size=(4, SIZE, SIZE), dtype=np.uint16)
+    after = before.copy()
+    after[3, 100:600, 250:900] //= 3
+    after[2, 700:950, 50:400] //= 4
+
+    paths = (str(tmp_path / "before.tif"), str(tmp_path / "after.tif"))
+    write_scene(paths[0], before)
+    write_scene(paths[1], after)
+    return paths
+
+
+@pytest.mark.parametrize("pyramid", [False, True])
+def test_merged_parts_match_a_single_run(scene_pair, tmp_path, pyramid):
+    engine = ChangeDetectionEngine({
+        "detection": {"processing": {"tile_size": TILE, "max_workers": 1}}
+    })
+    aoi = {"type": "Polygon", "coordinates": [[
+        (500500, 1999500), (509000, 1999000), (508000, 1991000), (501000, 1992500), (500500, 1999500)
+    ]]}
+
+    single = engine.detect_changes(*scene_pair, mask_path=str(tmp_path / "single.tif"),
+                                   aoi_geometry=aoi, aoi_crs="EPSG:32643", pyramid=pyramid)
+
+    plan = engine.plan_detection(*scene_pair, aoi_geometry=aoi, aoi_crs="EPSG:32643", tiles_per_part=10)
+    assert plan["status"] == "success" and len(plan["row_ranges"]) > 2
+    parts = [
+        engine.detect_changes_part(*scene_pair, rows, mask_path=str(tmp_path / f"part-{index}.tif"),
+                                   aoi_geometry=aoi, aoi_crs="EPSG:32643", pyramid=pyramid)
+        for index, rows in enumerate(plan["row_ranges"])
+    ]
+    merged = engine.merge_detection_parts(plan, parts, mask_path=str(tmp_path / "merged.tif"))
+
+    assert single["status"] == merged["status"] == "success"
+    for key in ("change_percentage", "pixels_analyzed", "ndvi_before_mean", "ndvi_after_mean"):
+        assert merged[key] == pytest.approx(single[key], rel=1e-9), key
+    assert tuple(merged["change_mask_shape"]) == tuple(single["change_mask_shape"])
+
+    with rasterio.open(single["change_mask_path"]) as a, rasterio.open(merged["change_mask_path"]) as b:
+        assert a.transform == b.transform
+        assert np.array_equal(a.read(1), b.read(1))
+    assert not list(tmp_path.glob("part-*"))
+
+
+def test_failed_part_fails_the_merge(scene_pair):
+    engine = ChangeDetectionEngine({"detection": {"processing": {"tile_size": TILE}}})
+    plan = engine.plan_detection(*scene_pair, tiles_per_part=20)
+    parts = [engine.detect_changes_part(*scene_pair, rows) for rows in plan["row_ranges"]]
+    parts[1] = {"status": "error", "message": "worker lost"}
+
+    merged = engine.merge_detection_parts(plan, parts)
+
+    assert merged["status"] == "error" and "worker lost" in merged["message"]
@@ -0,0 +1,75 @@
+"""
+Skipping tiles by the tile index must not change detection results
+"""
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from core.change_detection import ChangeDetector
+from core.engine import ChangeDetectionEngine
+from core.tile_index import build_tile_index
+
+SIZE = 1024
+TILE = 256
+
+
+def write_scene(path, data):
+    profile = {
+        "driver": "GTiff", "width": SIZE, "height": SIZE, "count": data.shape[0],
+        "dtype": "uint16", "crs": "EPSG:32643", "transform": from_origin(500000, 2000000, 10, 10),
+        "nodata": 0, "tiled": True, "blockxsize": TILE, "blockysize": TILE
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+
+
+@pytest.fixture
+def scene_pair(tmp_path):
+    rng = np.random.default_rng(0)
+    before = rng.integers(500, 4000, size=(4, SIZE, SIZE), dtype=np.uint16)
+    after = before.copy()
+    # Vegetation loss over a patch that crosses tile edges
+    after[3, 200:700, 300:800] //= 3
+    # Nodata blocks: shared, only in the before scene, only in the after scene
+    before[:, :TILE, :TILE] = after[:, :TILE, :TILE] = 0
+    before[:, TILE:2 * TILE, 3 * TILE:] = 0
+    after[:, 3 * TILE:, :2 * TILE] = 0
+
+    paths = (str(tmp_path / "before.tif"), str(tmp_path / "after.tif"))
+    write_scene(paths[0], before)
+    write_scene(paths[1], after)
+    return paths
+
+
+@pytest.mark.parametrize("pyramid", [False, True])
+def test_statistics_do_not_depend_on_tile_index(scene_pair, pyramid):
+    engine = ChangeDetectionEngine({
+        "detection": {"processing": {"tile_size": TILE, "max_workers": 1, "pyramid": {"enabled": pyramid}}}
+    })
+    indexes = {path: build_tile_index(path, block_size=TILE) for path in scene_pair}
+
+    plain = engine.detect_changes(*scene_pair)
+    indexed = engine.detect_changes(*scene_pair, tile_indexes=indexes)
+
+    assert plain["status"] == indexed["status"] == "success"
+    assert indexed["tiles_invalid"] == 4
+    for key in ("change_percentage", "pixels_analyzed", "ndvi_before_mean", "ndvi_after_mean"):
+        assert indexed[key] == pytest.approx(plain[key], rel=1e-9), key
+
+
+def test_change_detector_read_does_not_depend_on_tile_index(scene_pair):
+    path = scene_pair[1]
+    with rasterio.open(path, "r+") as dst:
+        # An all-cloud block by the index's reflectance scale
+        dst.write(np.full((4, TILE, TILE), 9000, dtype=np.uint16),
+                  window=Window(2 * TILE, 0, TILE, TILE))
+    detector = ChangeDetector({"detection": {"processing": {"tile_size": TILE}}})
+    index = build_tile_index(path, block_size=TILE)
+
+    plain, _, _ = detector.read_aoi(path, dst_crs="EPSG:32643")
+    indexed, _, _ = detector.read_aoi(path, dst_crs="EPSG:32643", tile_index=index)
+
+    assert np.array_equal(plain, indexed)
@@ -0,0 +1,66 @@
+"""
+Harmonic time-series analysis of NDVI cubes
+"""
+
+from datetime import datetime
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from core.engine import ChangeDetectionEngine
+from core.timeseries import HarmonicAnalyzer, decimal_years
+
+DATES = [datetime(2022 + month // 12, month % 12 + 1, 15) for month in range(24)]
+
+
+def seasonal_cube(width=4):
+    years = np.asarray(decimal_years(DATES))
+    ndvi = 0.5 + 0.2 * np.sin(2 * np.pi * years)
+    noise = np.random.default_rng(0).normal(0, 0.02, (len(DATES), 1, width))
+    return (ndvi[:, None, None] + noise).astype(np.float32)
+
+
+def test_latest_date_drop_is_a_change():
+    cube = seasonal_cube()
+    cube[-1, 0, :2] -= 0.3
+
+    outputs = HarmonicAnalyzer(DATES, harmonics=1).analyze(cube)
+
+    assert outputs["change"][0, :2].all() and not outputs["change"][0, 2:].any()
+    assert (outputs["latest_anomaly"][0, :2] < -3).all()
+
+
+def test_pixels_with_too_few_dates_are_not_fitted():
+    analyzer = HarmonicAnalyzer(DATES)
+    cube = seasonal_cube()
+    cube[analyzer.min_observations - 1:, 0, 0] = np.nan
+    cube[analyzer.min_observations:, 0, 1] = np.nan
+
+    outputs = analyzer.analyze(cube)
+
+    assert np.isnan(outputs["trend"][0, 0]) and not outputs["change"][0, 0]
+    assert not np.isnan(outputs["trend"][0, 1])
+    assert outputs["observations"][0, 1] == analyzer.min_observations
+
+
+def test_zero_ndvi_dates_are_observations(tmp_path):
+    scenes = []
+    rng = np.random.default_rng(0)
+    for date in DATES[:10]:
+        data = rng.integers(1000, 3000, size=(4, 32, 32), dtype=np.uint16)
+        data[3, :, :16] = data[2, :, :16]  # red == NIR: NDVI exactly 0
+        path = str(tmp_path / f"{date:%Y%m%d}.tif")
+        with rasterio.open(path, "w", driver="GTiff", width=32, height=32, count=4, dtype="uint16",
+                           crs="EPSG:32643", transform=from_origin(500000, 2000000, 10, 10)) as dst:
+            dst.write(data)
+        scenes.append((date, path))
+
+    engine = ChangeDetectionEngine({
+        "storage": {"temp_path": str(tmp_path / "temp")},
+        "detection": {"timeseries": {"min_dates": 8}}
+    })
+    result = engine.analyze_time_series(scenes)
+
+    assert result["status"] == "success"
+    assert result["pixels_analyzed"] == 32 * 32
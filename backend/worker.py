@@ -1,38 +1,502 @@
-
-import os
-from celery import Celery
-from loguru import logger
-from core.engine import engine
-
-# Celery Configuration
-# In production, use environment variables
-REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-
-celery_app = Celery("change_detection_worker", broker=REDIS_URL, backend=REDIS_URL)
-
-celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
-    timezone="UTC",
-    enable_utc=True,
-)
-
-@celery_app.task(name="tasks.detect_changes")
-def perform_change_detection_task(before_image_path: str, after_image_path: str, aoi_id: str):
-    """
-    Background task to run the heavy change detection algo.
-    """
-    logger.info(f"Starting change detection for AOI: {aoi_id}")
-    try:
-        # Run the engine
-        result = engine.detect_changes(before_image_path, after_image_path)
-        
-        # In a real app, you would save 'result' to the Database here
-        # db.save_result(aoi_id, result)
-        
-        logger.info(f"Completed change detection for AOI: {aoi_id}. Result: {result}")
-        return result
-    except Exception as e:
-        logger.error(f"Task failed: {e}")
-        return {"status": "failed", "error": str(e)}
+
+import os
+import uuid
+from datetime import datetime
+from celery import Celery, chord, current_task
+from celery.signals import celeryd_init, worker_process_init
+from kombu.serialization import register
+from loguru import logger
+from typing import Dict, List, Optional, Tuple
+
+from core.result_store import dumps, loads
+
+# Celery Configuration
+# In production, use environment variables
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+celery_app = Celery("change_detection_worker", broker=REDIS_URL, backend=REDIS_URL)
+
+# Messages are msgpack and results msgpack-zlib (the Redis result backend
+# ignores result_compression); large results are kept out of Redis
+# altogether (see publish_result)
+register("msgpack-zlib", dumps, loads, content_type="application/x-msgpack-zlib",
+         content_encoding="binary")
+
+celery_app.conf.update(
+    task_serializer="msgpack",
+    accept_content=["msgpack", "msgpack-zlib", "json"],
+    result_serializer="msgpack-zlib",
+    task_compression="zlib",
+    timezone="UTC",
+    enable_utc=True,
+    # Detection tasks are routed by estimated cost (see core.routing); these
+    # are the queues of tasks enqueued without an explicit one, e.g. when
+    # the estimate failed, so only jobs known to be large reach
+    # detection.large. Other tasks stay on the default "celery" queue
+    task_routes={
+        "tasks.detect_changes_batch": {"queue": "detection.batch"},
+        "tasks.detect_changes*": {"queue": "detection.small"},
+    },
+    # Reserve one task at a time so a higher-priority message arriving later
+    # is not stuck behind prefetched ones
+    worker_prefetch_multiplier=1,
+    # A worker consuming several queues drains them in the order given to -Q
+    broker_transport_options={"queue_order_strategy": "priority"},
+)
+
+@celeryd_init.connect
+def configure_worker(sender=None, conf=None, options=None, **kwargs):
+    """
+    Apply detection.routing.queues.<queue>.concurrency to a worker started
+    with -Q and without -c
+    """
+    options = options or {}
+    queues = options.get("queues")
+    if not queues or options.get("concurrency"):
+        return
+    from config.settings import get_settings
+    from core.routing import queue_router_from_config
+    if isinstance(queues, str):
+        queues = queues.split(",")
+    concurrency = queue_router_from_config(get_settings()).concurrency(queues)
+    if concurrency:
+        conf.worker_concurrency = concurrency
+        logger.info(f"Worker {sender} consuming {', '.join(queues)} with concurrency {concurrency}")
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Size GDAL's block cache in each worker process before it reads a raster"""
+    from config.settings import get_settings
+    from core.datasets import configure_gdal_cache
+    configure_gdal_cache(get_settings())
+
+def get_engine():
+    """
+    The shared ChangeDetectionEngine, imported on first use so processes
+    that only enqueue tasks (the API) never load the raster stack.
+    """
+    from core.engine import engine
+    return engine
+
+_result_store = None
+
+def get_result_store():
+    """The result store of storage.result_store, created on first use"""
+    global _result_store
+    if _result_store is None:
+        from config.settings import get_settings
+        from core.result_store import result_store_from_config
+        _result_store = result_store_from_config(get_settings())
+    return _result_store
+
+def publish_result(result: Dict) -> Dict:
+    """
+    What a task hands to the result backend: small results as they are,
+    large ones written to the result store under the task id and replaced
+    by a summary with a result_ref.
+    """
+    task_id = current_task.request.id if current_task else None
+    return get_result_store().offload(result, task_id or uuid.uuid4().hex)
+
+_job_registry = None
+
+def get_job_registry():
+    """Fingerprint-to-task records in Redis, kept as long as task results"""
+    global _job_registry
+    if _job_registry is None:
+        import redis
+        from config.settings import get_settings
+        from core.fingerprint import JobRegistry
+        expires = celery_app.conf.result_expires
+        ttl = int(expires.total_seconds()) if hasattr(expires, "total_seconds") else int(expires or 86400)
+        reuse = get_settings().get("detection", {}).get("reuse", {})
+        _job_registry = JobRegistry(redis.Redis.from_url(REDIS_URL), ttl=ttl,
+                                    stale_after=int(reuse.get("stale_after_s", 7200)))
+    return _job_registry
+
+def detection_fingerprint(before_image_path: str, after_image_path: str, aoi_id: str) -> str:
+    """
+    Fingerprint of a tasks.detect_changes job: the content of both scenes,
+    the AOI geometry, the detection settings and the engine version.
+    """
+    from config.settings import get_settings
+    geometry = load_aoi_geometry(aoi_id)
+    return get_job_registry().fingerprint(
+        [before_image_path, after_image_path],
+        geometry.wkb if geometry is not None else None,
+        {"task": "tasks.detect_changes", "detection": get_settings().get("detection", {})}
+    )
+
+_queue_router = None
+
+def get_queue_router():
+    """The QueueRouter of detection.routing, created on first use"""
+    global _queue_router
+    if _queue_router is None:
+        from config.settings import get_settings
+        from core.routing import queue_router_from_config
+        _queue_router = queue_router_from_config(get_settings())
+    return _queue_router
+
+def detection_route(after_image_path: str, aoi_ids: List[str], trigger: str = "user",
+                    batch: bool = False) -> Dict:
+    """
+    Queue and priority of a detection job over a scene and AOIs, from the
+    scene's pixel count and the AOIs' total area. Either is left out of
+    the estimate if it cannot be read.
+    """
+    from core.routing import scene_pixels
+    try:
+        scene = scene_pixels(after_image_path)
+    except Exception as e:
+        logger.warning(f"Could not read the size of {after_image_path}: {e}")
+        scene = None
+    areas = load_aoi_areas(aoi_ids)
+    area_hectares = sum(areas.values()) if len(areas) == len(set(aoi_ids)) else None
+    return get_queue_router().route(scene, area_hectares, trigger=trigger, batch=batch)
+
+def load_aoi_areas(aoi_ids: List[str]) -> Dict[str, float]:
+    """
+    AOI areas in hectares, keyed by AOI id; missing AOIs (all of them if
+    the database is unavailable) are left out.
+    """
+    try:
+        from config.database import SessionLocal
+        from models.aoi import AOI
+
+        db = SessionLocal()
+        try:
+            rows = db.query(AOI.id, AOI.area_hectares).filter(AOI.id.in_(aoi_ids)).all()
+            return {aoi_id: area for aoi_id, area in rows}
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Could not load AOI areas: {e}")
+        return {}
+
+def load_aoi_geometries(aoi_ids: List[str]) -> Dict:
+    """
+    Load AOI polygons (EPSG:4326) as shapely geometries, keyed by AOI id.
+    AOIs that are missing, or all of them if the database is unavailable,
+    are left out of the returned mapping.
+    """
+    try:
+        from geoalchemy2.shape import to_shape
+        from config.database import SessionLocal
+        from models.aoi import AOI
+
+        db = SessionLocal()
+        try:
+            aois = db.query(AOI).filter(AOI.id.in_(aoi_ids)).all()
+            return {aoi.id: to_shape(aoi.geometry) for aoi in aois}
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Could not load AOI geometries: {e}")
+        return {}
+
+def load_aoi_geometry(aoi_id: str):
+    """
+    Load an AOI polygon (EPSG:4326) as a shapely geometry.
+    Returns None if the AOI or the database is unavailable, in which case
+    the full scene is processed.
+    """
+    geometry = load_aoi_geometries([aoi_id]).get(aoi_id)
+    if geometry is None:
+        logger.warning(f"No geometry for AOI {aoi_id}, processing full scene")
+    return geometry
+
+def load_aoi_scenes(aoi_id: str, start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None,
+                    max_cloud_coverage: Optional[float] = None) -> List[Tuple[datetime, str]]:
+    """
+    (acquisition date, file path) of the stored scenes whose footprint
+    intersects the AOI, oldest first. Returns an empty list if the
+    database is unavailable.
+    """
+    try:
+        from sqlalchemy import func
+        from config.database import SessionLocal
+        from models.aoi import AOI
+        from models.imagery import SatelliteImage
+
+        db = SessionLocal()
+        try:
+            query = (
+                db.query(SatelliteImage.acquisition_date, SatelliteImage.file_path)
+                .join(AOI, func.ST_Intersects(SatelliteImage.footprint, AOI.geometry))
+                .filter(AOI.id == aoi_id, SatelliteImage.file_path.isnot(None))
+            )
+            if start_date is not None:
+                query = query.filter(SatelliteImage.acquisition_date >= start_date)
+            if end_date is not None:
+                query = query.filter(SatelliteImage.acquisition_date <= end_date)
+            if max_cloud_coverage is not None:
+                query = query.filter(SatelliteImage.cloud_coverage <= max_cloud_coverage)
+            return [(date, path) for date, path in query.order_by(SatelliteImage.acquisition_date)]
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Could not load scenes for AOI {aoi_id}: {e}")
+        return []
+
+def load_tile_indexes(paths: List[str]) -> Dict[str, "TileIndex"]:
+    """
+    Ingest-time tile indexes of the stored scenes with these file paths.
+    Scenes without one, or all of them if the database is unavailable, are
+    left out and read in full.
+    """
+    try:
+        from config.database import SessionLocal
+        from core.tile_index import TileIndex
+        from models.imagery import SatelliteImage
+
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(SatelliteImage.file_path, SatelliteImage.tile_index)
+                .filter(SatelliteImage.file_path.in_(paths), SatelliteImage.tile_index.isnot(None))
+            )
+            return {path: TileIndex.from_dict(tile_index) for path, tile_index in rows}
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Could not load tile indexes: {e}")
+        return {}
+
+def save_tile_index(image_path: str, tile_index: "TileIndex") -> bool:
+    """Store a scene's tile index on its image record; False if there is none"""
+    try:
+        from config.database import SessionLocal
+        from models.imagery import SatelliteImage
+
+        db = SessionLocal()
+        try:
+            updated = (
+                db.query(SatelliteImage)
+                .filter(SatelliteImage.file_path == image_path)
+                .update({SatelliteImage.tile_index: tile_index.to_dict()}, synchronize_session=False)
+            )
+            db.commit()
+            return updated > 0
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning(f"Could not store tile index of {image_path}: {e}")
+        return False
+
+def result_dir(aoi_id: str) -> str:
+    """Create a fresh directory for one run's artifacts under storage.results_path"""
+    results_path = get_engine().config.get('storage', {}).get('results_path', './data/results')
+    path = os.path.join(results_path, str(aoi_id), uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+@celery_app.task(name="tasks.detect_changes")
+def perform_change_detection_task(before_image_path: str, after_image_path: str, aoi_id: str,
+                                  fingerprint: Optional[str] = None):
+    """
+    Background task to run the heavy change detection algo.
+    The job ``fingerprint`` (see detection_fingerprint), if given, is
+    stored with the result.
+    """
+    logger.info(f"Starting change detection for AOI: {aoi_id}")
+    try:
+        # Run the engine on the AOI window only and vectorize the changes
+        aoi_geometry = load_aoi_geometry(aoi_id)
+        polygons_path = os.path.join(result_dir(aoi_id), "change_polygons.geojson")
+        result = get_engine().detect_changes(
+            before_image_path, after_image_path, aoi_geometry=aoi_geometry,
+            polygons_path=polygons_path,
+            tile_indexes=load_tile_indexes([before_image_path, after_image_path])
+        )
+        if fingerprint:
+            result["fingerprint"] = fingerprint
+        
+        # In a real app, you would save 'result' to the Database here
+        # db.save_result(aoi_id, result)
+        
+        logger.info(f"Completed change detection for AOI: {aoi_id}. Result: {result}")
+        return publish_result(result)
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.detect_changes_scatter", bind=True)
+def perform_scatter_change_detection_task(self, before_image_path: str, after_image_path: str, aoi_id: str,
+                                          fingerprint: Optional[str] = None):
+    """
+    Scatter/gather variant of tasks.detect_changes for large scenes. The job
+    is split into bands of tile rows (processing.scatter.tiles_per_task
+    tiles each) that run as separate tasks on any free worker, and a chord
+    callback merges them into the result tasks.detect_changes returns. This
+    task is replaced by the chord, so its id resolves to the merged result.
+    Part masks are written to the run's result directory, which must be on
+    storage every worker can reach.
+    """
+    logger.info(f"Planning scattered change detection for AOI: {aoi_id}")
+    try:
+        aoi_geometry = load_aoi_geometry(aoi_id)
+        if aoi_geometry is not None:
+            # Parts get the polygon itself rather than querying the database again
+            aoi_geometry = aoi_geometry.__geo_interface__
+        plan = get_engine().plan_detection(before_image_path, after_image_path, aoi_geometry=aoi_geometry)
+        if plan["status"] != "success":
+            return {"status": "failed", "error": plan["message"]}
+
+        run_dir = result_dir(aoi_id)
+        # Parts and the merge run on this task's queue at its priority
+        delivery_info = self.request.delivery_info or {}
+        route = {"priority": delivery_info.get("priority")}
+        if delivery_info.get("routing_key"):
+            route["queue"] = delivery_info["routing_key"]
+        parts = [
+            perform_change_detection_part_task.s(
+                before_image_path, after_image_path, rows, aoi_geometry,
+                os.path.join(run_dir, f"change_mask_rows_{rows[0]}.tif")
+            ).set(**route)
+            for rows in plan["row_ranges"]
+        ]
+        merge = merge_change_detection_parts_task.s(
+            plan, os.path.join(run_dir, "change_polygons.geojson"), fingerprint
+        ).set(**route)
+        logger.info(f"Scattering change detection for AOI {aoi_id} over {len(parts)} tasks")
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+    return self.replace(chord(parts, merge))
+
+@celery_app.task(name="tasks.detect_changes_part")
+def perform_change_detection_part_task(before_image_path: str, after_image_path: str, rows: List[int],
+                                       aoi_geometry: Optional[Dict] = None,
+                                       mask_path: Optional[str] = None):
+    """
+    One band of tile rows of a scattered change detection job. Returns the
+    band's raw statistics for tasks.merge_change_detection_parts.
+    """
+    logger.info(f"Starting change detection of rows {rows[0]}-{rows[1]} of {after_image_path}")
+    try:
+        return get_engine().detect_changes_part(
+            before_image_path, after_image_path, rows, mask_path=mask_path,
+            aoi_geometry=aoi_geometry,
+            tile_indexes=load_tile_indexes([before_image_path, after_image_path])
+        )
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.merge_change_detection_parts")
+def merge_change_detection_parts_task(parts: List[Dict], plan: Dict, polygons_path: str,
+                                      fingerprint: Optional[str] = None):
+    """
+    Chord callback of tasks.detect_changes_scatter: merges the part
+    statistics and masks into the tasks.detect_changes result.
+    """
+    logger.info(f"Merging {len(parts)} change detection parts")
+    try:
+        result = get_engine().merge_detection_parts(plan, parts, polygons_path=polygons_path)
+        if fingerprint:
+            result["fingerprint"] = fingerprint
+
+        logger.info(f"Completed scattered change detection. Result: {result}")
+        return publish_result(result)
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.detect_changes_batch")
+def perform_batch_change_detection_task(before_image_path: str, after_image_path: str, aoi_ids: List[str]):
+    """
+    Background task running change detection for many AOIs over one scene pair.
+    The scenes are read once; AOIs without a stored geometry are reported as missing.
+    """
+    logger.info(f"Starting batch change detection for {len(aoi_ids)} AOIs")
+    try:
+        geometries = load_aoi_geometries(aoi_ids)
+        result = get_engine().detect_changes_batch(
+            before_image_path, after_image_path, geometries,
+            tile_indexes=load_tile_indexes([before_image_path, after_image_path])
+        )
+        result["missing"] = [aoi_id for aoi_id in aoi_ids if aoi_id not in geometries]
+
+        logger.info(f"Completed batch change detection: {len(result.get('results', {}))} AOIs processed")
+        return publish_result(result)
+    except Exception as e:
+        logger.error(f"Batch task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.update_baseline")
+def perform_baseline_update_task(image_path: str, aoi_id: str):
+    """
+    Score a new scene against the AOI's rolling NDVI baseline and fold it in.
+    Only the new scene is read; the baseline lives under storage.base_path.
+    """
+    logger.info(f"Updating NDVI baseline for AOI: {aoi_id}")
+    try:
+        aoi_geometry = load_aoi_geometry(aoi_id)
+        result = get_engine().detect_changes_baseline(
+            image_path, aoi_id, aoi_geometry=aoi_geometry,
+            tile_indexes=load_tile_indexes([image_path])
+        )
+
+        logger.info(f"Completed baseline update for AOI: {aoi_id}. Result: {result}")
+        return publish_result(result)
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.analyze_time_series")
+def perform_time_series_task(aoi_id: str, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Background task fitting per-pixel trend/seasonality and breakpoints over
+    every stored scene of an AOI. Dates are ISO 8601 strings.
+    """
+    logger.info(f"Starting time-series analysis for AOI: {aoi_id}")
+    try:
+        settings = get_engine().config.get('detection', {}).get('timeseries', {})
+        scenes = load_aoi_scenes(
+            aoi_id,
+            start_date=datetime.fromisoformat(start_date) if start_date else None,
+            end_date=datetime.fromisoformat(end_date) if end_date else None,
+            max_cloud_coverage=settings.get('max_cloud_coverage')
+        )
+        output_path = os.path.join(result_dir(aoi_id), "timeseries.nc")
+        result = get_engine().analyze_time_series(
+            scenes, aoi_geometry=load_aoi_geometry(aoi_id), output_path=output_path,
+            tile_indexes=load_tile_indexes([path for _, path in scenes])
+        )
+
+        logger.info(f"Completed time-series analysis for AOI: {aoi_id}. Result: {result}")
+        return publish_result(result)
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+@celery_app.task(name="tasks.ingest_image")
+def perform_ingest_task(image_path: str):
+    """
+    Prepare a newly stored scene for detection: build the overviews that
+    pyramid detection scores tiles on, and the per-block tile index that
+    lets the engine skip nodata and cloud tiles (stored on the image record).
+    """
+    from core.ingest import build_overviews
+    from core.tile_index import tile_index_from_config
+
+    logger.info(f"Ingesting image: {image_path}")
+    try:
+        factors = build_overviews(image_path)
+        tile_index = tile_index_from_config(image_path, get_engine().config)
+        result = {
+            "status": "success",
+            "image_path": image_path,
+            "overviews": factors,
+            "usable_tiles": tile_index.coverage(get_engine().skip_cloudy_tiles),
+            "tile_index_stored": save_tile_index(image_path, tile_index)
+        }
+
+        logger.info(f"Completed ingest of {image_path}. Result: {result}")
+        return result
+    except Exception as e:
+        logger.error(f"Task failed: {e}")
+        return {"status": "failed", "error": str(e)}
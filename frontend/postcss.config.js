@@ -1,6 +1,6 @@
-export default {
-    plugins: {
-        tailwindcss: {},
-        autoprefixer: {},
-    },
-}
+export default {
+    plugins: {
+        tailwindcss: {},
+        autoprefixer: {},
+    },
+}